@@ -0,0 +1,126 @@
+from http import HTTPStatus
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='Group', slug='group',
+                                         description='group_description')
+        for i in range(13):
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Post_number_{i}')
+        cls.post = Post.objects.filter(author=cls.author).first()
+        Comment.objects.create(post=cls.post, author=cls.user,
+                               text='Comment_text')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ApiTests.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_pages_available(self):
+        """Адреса API отдают JSON"""
+        urls = (
+            reverse('api:index'),
+            reverse('api:group_list', args=[ApiTests.group.slug]),
+            reverse('api:profile', args=[ApiTests.author.username]),
+            reverse('api:post_detail', args=[ApiTests.post.id]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_unknown_objects_not_found(self):
+        """Несуществующие группа, автор и пост дают 404"""
+        urls = (
+            reverse('api:group_list', args=['missing']),
+            reverse('api:profile', args=['missing']),
+            reverse('api:post_detail', args=[0]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_cursor_pagination(self):
+        """Список постов разбит на страницы по курсору"""
+        first = self.guest_client.get(reverse('api:index')).json()
+        self.assertEqual(len(first['results']), 10)
+        self.assertIsNone(first['previous'])
+        second = self.guest_client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 3)
+        self.assertIsNone(second['next'])
+        ids = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(ids, list(Post.objects.order_by(
+            '-created', '-id').values_list('id', flat=True)))
+
+    def test_serialized_from_values(self):
+        """Посты сериализуются из values() без создания моделей"""
+        with mock.patch.object(Post, 'from_db') as from_db:
+            data = self.guest_client.get(reverse('api:index')).json()
+        from_db.assert_not_called()
+        post = data['results'][0]
+        self.assertEqual(post['author'], ApiTests.author.username)
+        self.assertEqual(post['group'], ApiTests.group.slug)
+
+    def test_post_detail_with_comments(self):
+        """Страница поста содержит комментарии и их количество"""
+        data = self.guest_client.get(
+            reverse('api:post_detail', args=[ApiTests.post.id])).json()
+        self.assertEqual(data['post']['id'], ApiTests.post.id)
+        self.assertEqual(data['post']['comments_count'], 1)
+        self.assertEqual(data['results'][0]['text'], 'Comment_text')
+
+    def test_not_modified(self):
+        """Повторный запрос с ETag или Last-Modified получает 304"""
+        url = reverse('api:profile', args=[ApiTests.author.username])
+        response = self.guest_client.get(url)
+        self.assertIn('ETag', response)
+        cached = self.guest_client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, HTTPStatus.NOT_MODIFIED)
+        cached = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_etag_changes_on_edit(self):
+        """Правка поста меняет ETag, хотя новых постов не появилось"""
+        url = reverse('api:index')
+        etag = self.guest_client.get(url)['ETag']
+        post = Post.objects.get(pk=ApiTests.post.pk)
+        post.text = 'Edited_text'
+        post.save()
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_follow_requires_login(self):
+        """Лента подписок требует авторизации и зависит от пользователя"""
+        url = reverse('api:follow_index')
+        response = self.guest_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        response = self.authorized_client.get(url)
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertIn('Cookie', response['Vary'])
+        second = self.authorized_client.get(response.json()['next']).json()
+        self.assertEqual(len(second['results']), 3)
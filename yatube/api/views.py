@@ -0,0 +1,163 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_safe
+
+from core.http import conditional
+from posts import counters
+from posts.conditional import (follow_validators, group_validators,
+                               index_validators, post_validators,
+                               profile_validators)
+from posts.feed import feed_posts
+from posts.models import Comment, Group, Post
+from posts.paginators import CursorPaginator
+from posts.thumbnails import rendition_url
+from yatube.settings import POSTS_ON_PAGE
+
+User = get_user_model()
+
+POST_FIELDS = ('id', 'created', 'text', 'image', 'renditions',
+               'author__username', 'group__slug')
+COMMENT_FIELDS = ('id', 'created', 'text', 'author__username')
+
+
+def serialize_post(row):
+    return {
+        'id': row['id'],
+        'created': row['created'].isoformat(),
+        'text': row['text'],
+        'author': row['author__username'],
+        'group': row['group__slug'],
+        'image': default_storage.url(row['image']) if row['image'] else None,
+        'thumbnail': rendition_url(row['renditions'],
+                                   settings.THUMBNAIL_LISTING_SIZE),
+    }
+
+
+def serialize_comment(row):
+    return {
+        'id': row['id'],
+        'created': row['created'].isoformat(),
+        'text': row['text'],
+        'author': row['author__username'],
+    }
+
+
+def cursor_page(request, rows, serialize):
+    """
+    Страница строк по курсору из параметра cursor со ссылками на соседние
+    страницы. Строки - словари из values(), модели не создаются.
+    """
+
+    page = CursorPaginator(rows, POSTS_ON_PAGE).get_page(
+        request.GET.get('cursor'))
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        return request.build_absolute_uri(
+            f'{request.path}?{urlencode({"cursor": cursor})}')
+
+    return {
+        'results': [serialize(row) for row in page],
+        'next': link(page.next_cursor),
+        'previous': link(page.previous_cursor),
+    }
+
+
+def login_required(view):
+    """Для анонимного пользователя ответ 401 вместо перенаправления"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'detail': 'Требуется авторизация'},
+                                status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def get_author(username):
+    author = User.objects.filter(username=username).values(
+        'id', 'username', 'first_name', 'last_name').first()
+    if author is None:
+        raise Http404
+    return author
+
+
+def get_group(slug):
+    group = Group.objects.filter(slug=slug).values(
+        'id', 'title', 'slug', 'description').first()
+    if group is None:
+        raise Http404
+    return group
+
+
+def get_post(post_id):
+    post = Post.objects.filter(id=post_id).values(
+        *POST_FIELDS, 'author_id').first()
+    if post is None:
+        raise Http404
+    return post
+
+
+@require_safe
+@conditional(index_validators, per_user=False)
+def index(request):
+    return JsonResponse(cursor_page(request, Post.objects.values(
+        *POST_FIELDS), serialize_post))
+
+
+@require_safe
+@conditional(group_validators, per_user=False)
+def group_posts(request, slug):
+    group = get_group(slug)
+    posts = Post.objects.filter(group_id=group['id']).values(*POST_FIELDS)
+    data = cursor_page(request, posts, serialize_post)
+    data['group'] = dict(
+        group, posts_count=counters.get(counters.GROUP_POSTS, group['id']))
+    return JsonResponse(data)
+
+
+@require_safe
+@conditional(profile_validators, per_user=False)
+def profile(request, username):
+    author = get_author(username)
+    posts = Post.objects.filter(author_id=author['id']).values(*POST_FIELDS)
+    data = cursor_page(request, posts, serialize_post)
+    data['author'] = dict(
+        author,
+        posts_count=counters.get(counters.AUTHOR_POSTS, author['id']),
+        followers_count=counters.get(counters.AUTHOR_FOLLOWERS,
+                                     author['id']),
+    )
+    return JsonResponse(data)
+
+
+@require_safe
+@conditional(post_validators, per_user=False)
+def post_detail(request, post_id):
+    post = get_post(post_id)
+    comments = Comment.objects.filter(post_id=post_id).values(
+        *COMMENT_FIELDS)
+    data = cursor_page(request, comments, serialize_comment)
+    data['post'] = dict(
+        serialize_post(post),
+        comments_count=counters.get(counters.POST_COMMENTS, post_id))
+    return JsonResponse(data)
+
+
+@require_safe
+@login_required
+@conditional(follow_validators)
+def follow_index(request):
+    posts = feed_posts(request.user)
+    # поля сортировки ленты нужны для ключа курсора
+    ordering = [field.lstrip('-') for field in posts.query.order_by]
+    fields = dict.fromkeys(POST_FIELDS + tuple(ordering))
+    return JsonResponse(cursor_page(request, posts.values(*fields),
+                                    serialize_post))
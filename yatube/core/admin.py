@@ -0,0 +1,120 @@
+import csv
+from itertools import chain
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.urls import path, reverse
+from django.utils import timezone
+
+from core.models import Task
+
+# с этих знаков табличные редакторы начинают формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def escape_cell(value):
+    """
+    Текст, который табличный редактор принял бы за формулу, выгружается
+    с апострофом в начале и открывается как обычный текст
+    """
+
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvExportMixin:
+    """
+    Выгрузка списка объектов в CSV действием и кнопкой на странице списка.
+    Кнопка передает текущие фильтры и поиск. Строки выбираются через
+    values_list() с соединением связанных таблиц и читаются курсором
+    .iterator(), ответ отдается по мере чтения, поэтому память не зависит
+    от размера таблицы.
+
+    export_fields - пары (заголовок столбца, поле для values_list).
+    Тексты пользователей, похожие на формулы, экранируются (escape_cell).
+    """
+
+    export_fields = ()
+    export_chunk_size = 2000
+    change_list_template = 'admin/csv_export_change_list.html'
+    actions = ('export_csv',)
+
+    def get_urls(self):
+        opts = self.model._meta
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view),
+                 name=f'{opts.app_label}_{opts.model_name}_export'),
+        ] + super().get_urls()
+
+    def export_view(self, request):
+        """Выгружает объекты с фильтрами и поиском страницы списка"""
+
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            # как и страница списка, сообщаем об ошибке через ?e=1
+            opts = self.model._meta
+            return HttpResponseRedirect(reverse(
+                f'{self.admin_site.name}:{opts.app_label}_'
+                f'{opts.model_name}_changelist') + '?e=1')
+        return self.stream_csv(changelist.get_queryset(request))
+
+    def export_csv(self, request, queryset):
+        return self.stream_csv(queryset)
+
+    export_csv.short_description = 'Выгрузить выбранные в CSV'
+
+    def stream_csv(self, queryset):
+        headers = [header for header, _ in self.export_fields]
+        rows = queryset.values_list(
+            *[field for _, field in self.export_fields]).iterator(
+            chunk_size=self.export_chunk_size)
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow([escape_cell(value) for value in row])
+             for row in chain([headers], rows)),
+            content_type='text/csv; charset=utf-8')
+        filename = f'{self.model._meta.model_name}.csv'
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'name',
+        'status',
+        'attempts',
+        'run_at',
+        'finished',
+    )
+    list_filter = ('status',)
+    search_fields = ('name',)
+    # в аргументах могут быть личные данные, в админке их не показываем
+    exclude = ('arguments',)
+    readonly_fields = ('name', 'created', 'started', 'finished', 'locked_by',
+                       'locked_until', 'last_error')
+    actions = ('requeue',)
+
+    def requeue(self, request, queryset):
+        """Повторить упавшие задачи с новым запасом попыток"""
+        queryset.filter(status=Task.FAILED).update(
+            status=Task.QUEUED, attempts=0, run_at=timezone.now(),
+            finished=None)
+
+    requeue.short_description = 'Повторить упавшие задачи'
+
+
+admin.site.register(Task, TaskAdmin)
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        import core.signals  # noqa: F401
+        from core import metrics
+
+        metrics.install()
@@ -0,0 +1,151 @@
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from django.conf import settings
+
+# заголовки, которые в WSGI передаются без префикса HTTP_
+UNPREFIXED_HEADERS = {'CONTENT_TYPE', 'CONTENT_LENGTH'}
+
+
+class ASGIHandler:
+    """
+    ASGI-приложение поверх WSGI-приложения Django: в Django 2.2 своего
+    ASGI-обработчика нет. Соединения держит цикл событий сервера, а
+    запрос целиком, вместе с потоковой отдачей тела ответа, выполняется
+    в одном потоке пула из workers потоков, поэтому соединения с базой
+    и сигналы завершения запроса работают как под WSGI.
+
+    Тело запроса копится в памяти до FILE_UPLOAD_MAX_MEMORY_SIZE байт, а
+    дальше пишется во временный файл. На тело больше
+    REQUEST_MAX_BODY_SIZE сразу отвечает 413.
+    """
+
+    def __init__(self, wsgi_application, workers=32):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Неподдерживаемый тип соединения: '
+                             f'{scope["type"]}')
+        limit = settings.REQUEST_MAX_BODY_SIZE
+        declared = dict(scope.get('headers', ())).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(
+                declared) > limit:
+            await self.too_large(send)
+            return
+        body = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            dir=settings.FILE_UPLOAD_TEMP_DIR)
+        try:
+            size = 0
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if size > limit:
+                    await self.too_large(send)
+                    return
+                body.write(chunk)
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            environ = self.environ(scope, body)
+            # тело без Content-Length (chunked) Django иначе не прочитает
+            environ.setdefault('CONTENT_LENGTH', str(size))
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.respond, environ,
+                                       send, loop)
+        finally:
+            body.close()
+
+    @staticmethod
+    async def too_large(send):
+        await send({'type': 'http.response.start',
+                    'status': HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                    'headers': [(b'content-type',
+                                 b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body',
+                    'body': 'Слишком большой запрос'.encode()})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def environ(scope, body):
+        """Окружение WSGI по описанию соединения ASGI, body - файл тела"""
+
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # WSGI передает путь байтами, декодированными как latin-1
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': client[0],
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            if name not in UNPREFIXED_HEADERS:
+                name = f'HTTP_{name}'
+            value = value.decode('latin-1')
+            if name in environ:
+                separator = '; ' if name == 'HTTP_COOKIE' else ','
+                value = f'{environ[name]}{separator}{value}'
+            environ[name] = value
+        return environ
+
+    def respond(self, environ, send, loop):
+        """Выполняет WSGI-приложение и передает ответ в цикл событий"""
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start.update(
+                type='http.response.start',
+                status=int(status.split(' ', 1)[0]),
+                headers=[(name.lower().encode('latin-1'),
+                          value.encode('latin-1'))
+                         for name, value in headers])
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            call(start)
+            for chunk in result:
+                if chunk:
+                    call({'type': 'http.response.body', 'body': chunk,
+                          'more_body': True})
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
@@ -0,0 +1,173 @@
+import logging
+import math
+import random
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'generation:{scope}'
+# бэкенды, у которых add - проверка и запись по отдельности: блокировку
+# пересчета могут взять несколько процессов сразу
+NON_ATOMIC_BACKENDS = (FileBasedCache,)
+_warned_backends = set()
+
+# записи get_or_compute - кортежи (значение, срок, длительность) под своими
+# ключами: значения прежнего формата под теми же ключами, оставшиеся в
+# общем кеше после обновления, не читаются как записи. При смене формата
+# записи суффикс меняется.
+ENTRY_SUFFIX = ':swr'
+
+
+def _new_generation():
+    # После вытеснения счетчика из кеша поколение не должно совпасть ни с
+    # одним из прежних, иначе снова стали бы видны устаревшие фрагменты
+    return time.time_ns()
+
+
+def get_generations(*scopes):
+    """
+    Текущие номера поколений для областей кеша. Номер поколения входит в
+    ключ закешированного фрагмента, поэтому увеличение счетчика делает
+    недействительными все фрагменты области сразу. Отсутствующий номер
+    создается через add и перечитывается: при неатомарном add
+    (FileBasedCache) два процесса могут ненадолго получить разные
+    номера, и фрагменты одного из них просто не будут прочитаны.
+    """
+
+    keys = {GENERATION_KEY.format(scope=scope): scope for scope in scopes}
+    generations = cache.get_many(keys)
+    for key in keys.keys() - generations.keys():
+        cache.add(key, _new_generation(), None)
+        generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generation(*scopes):
+    """
+    Делает недействительными закешированные фрагменты областей. Новое
+    поколение - текущее время, но всегда больше прежнего поколения, поэтому
+    по нему видно, когда область менялась в последний раз.
+    """
+
+    keys = [GENERATION_KEY.format(scope=scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    cache.set_many({key: max(_new_generation(), generations.get(key, 0) + 1)
+                    for key in keys}, None)
+
+
+def generation_time(generation):
+    """Время последнего изменения области по номеру поколения"""
+
+    return datetime.fromtimestamp(generation / 10 ** 9, tz=timezone.utc)
+
+
+def _is_fresh(entry, now):
+    # вероятностное раннее обновление (XFetch): чем ближе истечение и чем
+    # дольше вычисление, тем вероятнее, что запрос пересчитает значение
+    # заранее, пока остальные получают еще действующее
+    value, expires, duration = entry
+    if expires is None:
+        return True
+    jitter = -duration * settings.CACHE_EARLY_REFRESH_BETA * math.log(
+        1 - random.random())
+    return now + jitter < expires
+
+
+def _compute(backend, key, compute, timeout, version):
+    start = time.time()
+    value = compute()
+    duration = time.time() - start
+    if timeout is None:
+        expires = stored_timeout = None
+    else:
+        expires = time.time() + timeout
+        # устаревшее значение хранится дольше и отдается, пока его
+        # пересчитывает другой запрос
+        stored_timeout = timeout + settings.CACHE_STALE_TIMEOUT
+    backend.set(key, (value, expires, duration), stored_timeout,
+                version=version)
+    return value
+
+
+def entry_key(key):
+    """Ключ кеша, под которым get_or_compute хранит значение для key"""
+
+    return f'{key}{ENTRY_SUFFIX}'
+
+
+def _warn_if_not_atomic(backend):
+    kind = type(backend)
+    if issubclass(kind, NON_ATOMIC_BACKENDS) and kind not in _warned_backends:
+        _warned_backends.add(kind)
+        logger.warning(
+            'У кеша %s неатомарный add: одновременный пересчет значений '
+            'не предотвращается. Используйте redis:// или sqlite:// в '
+            'CACHE_URL', kind.__name__)
+
+
+def get_or_compute(key, compute, timeout, backend=None, version=None):
+    """
+    Значение из кеша или результат compute() с защитой от одновременного
+    пересчета. Пересчитывает только запрос, захвативший блокировку в кеше.
+    Остальные, пока идет пересчет, получают устаревшее значение, а если его
+    нет - ждут нового до CACHE_LOCK_TIMEOUT секунд и только затем считают
+    сами. Незадолго до истечения значение с небольшой вероятностью
+    пересчитывается заранее.
+
+    Блокировка - это backend.add, и защищает она, только если add атомарен
+    для всех процессов: LocMemCache в пределах процесса, Redis,
+    core.cache_backends.SQLiteCache. У FileBasedCache add - проверка
+    файла и запись, блокировку возьмут несколько процессов, и каждый
+    пересчитает значение. С таким бэкендом функция работает, но пишет
+    предупреждение в лог core.cache.
+    """
+
+    backend = backend or cache
+    _warn_if_not_atomic(backend)
+    key = entry_key(key)
+    entry = backend.get(key, version=version)
+    if entry is not None and _is_fresh(entry, time.time()):
+        return entry[0]
+    lock_key = f'{key}:lock'
+    if backend.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT,
+                   version=version):
+        try:
+            return _compute(backend, key, compute, timeout, version)
+        finally:
+            backend.delete(lock_key, version=version)
+    if entry is not None:
+        return entry[0]
+    deadline = time.monotonic() + settings.CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.CACHE_LOCK_POLL_INTERVAL)
+        entry = backend.get(key, version=version)
+        if entry is not None:
+            return entry[0]
+        if backend.get(lock_key, version=version) is None:
+            # пересчитывавший запрос завершился с ошибкой
+            break
+    return _compute(backend, key, compute, timeout, version)
+
+
+def cached(key, timeout):
+    """
+    Декоратор: результат функции кешируется через get_or_compute. key -
+    строка или функция от аргументов декорируемой функции, timeout -
+    секунды или функция без аргументов, например чтение настройки.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if callable(key) else key
+            return get_or_compute(
+                cache_key, lambda: func(*args, **kwargs),
+                timeout() if callable(timeout) else timeout)
+        return wrapper
+    return decorator
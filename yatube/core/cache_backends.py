@@ -0,0 +1,496 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+LOCMEM_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+FILE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+SQLITE_BACKEND = 'core.cache_backends.SQLiteCache'
+# клиент протокола Redis - необязательная зависимость django-redis
+REDIS_BACKEND = 'django_redis.cache.RedisCache'
+TWO_TIER_BACKEND = 'core.cache_backends.TwoTierCache'
+
+# журнал инвалидаций в общем кеше: номер последней записи и сами записи
+JOURNAL_SEQ_KEY = 'l1:seq'
+JOURNAL_ENTRY_KEY = 'l1:inval:{seq}'
+JOURNAL_TIMEOUT = 60 * 60
+# при большем отставании журнал не читается, L1 очищается целиком
+JOURNAL_MAX_LAG = 1000
+# запись журнала, по которой локальный кеш очищается целиком
+CLEAR_ALL = '*'
+
+_missing = object()
+
+
+def shared_cache_config(url):
+    """
+    Настройки общего кеша по адресу redis://, sqlite://, file:// или
+    locmem://
+    """
+
+    parts = urlsplit(url)
+    if parts.scheme in ('redis', 'rediss'):
+        return {'BACKEND': REDIS_BACKEND, 'LOCATION': url}
+    if parts.scheme == 'sqlite':
+        return {'BACKEND': SQLITE_BACKEND, 'LOCATION': parts.path}
+    if parts.scheme == 'file':
+        return {'BACKEND': FILE_BACKEND, 'LOCATION': parts.path}
+    if parts.scheme == 'locmem':
+        return {'BACKEND': LOCMEM_BACKEND, 'LOCATION': parts.netloc}
+    raise ImproperlyConfigured(f'Неизвестный адрес кеша: {url}')
+
+
+def cache_config(env=os.environ):
+    """
+    Настройки CACHES из переменных окружения.
+
+    CACHE_URL - общий для всех процессов кеш: redis://хост:порт/база
+    (нужен пакет django-redis) или sqlite:///путь/к/cache.sqlite3 как
+    замена без сети для процессов одной машины. file:///путь/к/каталогу
+    тоже работает, но без атомарных add и incr (см. TwoTierCache и
+    core.cache.get_or_compute). Без него каждый процесс держит свой
+    LocMemCache.
+    CACHE_KEY_PREFIX и CACHE_VERSION - префикс и версия всех ключей.
+    Перед общим кешем ставится локальный LRU процесса (CACHE_L1=0
+    отключает): CACHE_L1_MAX_ENTRIES записей, не дольше
+    CACHE_L1_TIMEOUT секунд, журнал инвалидаций читается раз в
+    CACHE_L1_SYNC_INTERVAL секунд. Перед файловым кешем LRU не ставится,
+    см. TwoTierCache.
+    """
+
+    url = env.get('CACHE_URL', '')
+    common = {
+        'KEY_PREFIX': env.get('CACHE_KEY_PREFIX', 'yatube'),
+        'VERSION': int(env.get('CACHE_VERSION', 1)),
+    }
+    if not url:
+        return {'default': dict(common, BACKEND=LOCMEM_BACKEND)}
+    shared = dict(shared_cache_config(url), **common)
+    if env.get('CACHE_L1', '1') == '0' or shared['BACKEND'] == FILE_BACKEND:
+        return {'default': shared}
+    return {'default': {
+        'BACKEND': TWO_TIER_BACKEND,
+        'LOCATION': url,
+        'OPTIONS': {
+            'L2': shared,
+            'MAX_ENTRIES': int(env.get('CACHE_L1_MAX_ENTRIES', 1000)),
+            'L1_TIMEOUT': float(env.get('CACHE_L1_TIMEOUT', 5)),
+            'SYNC_INTERVAL': float(env.get('CACHE_L1_SYNC_INTERVAL', 1)),
+        },
+    }}
+
+
+class SQLiteCache(BaseCache):
+    """
+    Общий кеш процессов одной машины в таблице файла SQLite (LOCATION) -
+    замена Redis без сети. В отличие от FileBasedCache add и incr
+    атомарны: они выполняются в транзакции BEGIN IMMEDIATE, которая сразу
+    берет блокировку записи файла. На них держатся журнал инвалидаций
+    TwoTierCache и блокировка пересчета get_or_compute.
+
+    Значения хранятся сериализованными pickle. Когда записей больше
+    MAX_ENTRIES, удаляются истекшие, а затем 1/CULL_FREQUENCY самых
+    старых.
+    """
+
+    schema = ('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+              'value BLOB NOT NULL, expires REAL)')
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.local = threading.local()
+
+    def connection(self):
+        """
+        Соединение текущего потока. После fork соединение родителя не
+        используется, процесс открывает свое.
+        """
+
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(self.schema)
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция, которая сразу берет блокировку записи"""
+
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _read(self, db, keys):
+        placeholders = ', '.join('?' * len(keys))
+        rows = db.execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            [*keys, time.time()]).fetchall()
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def _write(self, db, key, value, timeout):
+        db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (
+            key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            self.get_backend_timeout(timeout)))
+
+    def _cull(self, db):
+        count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self._max_entries:
+            db.execute(
+                'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache '
+                'ORDER BY rowid LIMIT ?)',
+                (max(count // self._cull_frequency, 1),))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._read(self.connection(), [key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        found = self._read(self.connection(), list(keys))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self.transaction() as db:
+            self._write(db, key, value, timeout)
+            self._cull(db)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.transaction() as db:
+            for key, value in data.items():
+                self._write(db, self._key(key, version), value, timeout)
+            self._cull(db)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self.transaction() as db:
+            if self._read(db, [key]):
+                return False
+            self._write(db, key, value, timeout)
+            self._cull(db)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self.transaction() as db:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute('UPDATE cache SET value = ? WHERE key = ?', (
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key))
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self.transaction() as db:
+            changed = db.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key,
+                 time.time())).rowcount
+        return bool(changed)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return bool(self._read(self.connection(), [key]))
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self.connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self.transaction() as db:
+            db.executemany('DELETE FROM cache WHERE key = ?',
+                           [(key,) for key in keys])
+
+    def clear(self):
+        self.connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # соединения потоков остаются открытыми между запросами
+        pass
+
+
+class LocalStore:
+    """
+    LRU-кеш процесса, общий для всех потоков. Значения хранятся
+    сериализованными, как в LocMemCache, чтобы изменение полученного
+    объекта не меняло закешированный.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        # последняя прочитанная запись журнала и записи этого процесса
+        self.seq = None
+        self.own = set()
+        self.synced = 0.0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return _missing
+            expires, value = item
+            if expires <= time.monotonic():
+                del self.data[key]
+                return _missing
+            self.data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.data[key] = (time.monotonic() + timeout, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+# локальные кеши по LOCATION, общие для экземпляров бэкенда в потоках
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class TwoTierCache(BaseCache):
+    """
+    Двухуровневый кеш: LRU в памяти процесса (L1) перед общим кешем (L2).
+    Чтение сначала ищет в L1, запись идет в оба уровня. Каждая запись и
+    удаление добавляют измененные ключи в журнал инвалидаций в L2, и
+    остальные процессы раз в SYNC_INTERVAL удаляют их из своих L1. Если
+    журнал потерян (вытеснен или очищен), L1 очищается целиком. Значение
+    в L1 живет не дольше L1_TIMEOUT, это и ограничивает расхождение, если
+    запись журнала не дошла.
+
+    Номера записей журнала выдает incr в L2, поэтому L2 должен
+    увеличивать значение атомарно для всех процессов, как Redis или
+    SQLiteCache. У FileBasedCache incr - это чтение и запись файла: два
+    процесса получат один номер, одна из записей журнала потеряется, и
+    устаревшее значение останется в L1 до L1_TIMEOUT. Такой L2 не
+    принимается.
+
+    Префикс, версия и функция ключей берутся из настроек L2, если не
+    заданы там, - из настроек этого кеша.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        l2 = dict(options['L2'])
+        if l2['BACKEND'] == FILE_BACKEND:
+            raise ImproperlyConfigured(
+                'Файловый кеш не подходит для L2: его incr не атомарен')
+        for name in ('KEY_PREFIX', 'VERSION', 'KEY_FUNCTION'):
+            if name in params:
+                l2.setdefault(name, params[name])
+        self.l2 = import_string(l2['BACKEND'])(l2.get('LOCATION', ''), l2)
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1)
+        with _stores_lock:
+            if location not in _stores:
+                _stores[location] = LocalStore(self._max_entries)
+            self.l1 = _stores[location]
+
+    def make_key(self, key, version=None):
+        return self.l2.make_key(key, version=version)
+
+    def validate_key(self, key):
+        self.l2.validate_key(key)
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _broadcast(self, *keys):
+        """
+        Добавляет ключи в журнал инвалидаций для остальных процессов.
+        Номер записи уникален, только если incr в L2 атомарен. Первую
+        запись гонка add/incr не портит: add не перезапишет номер,
+        созданный другим процессом.
+        """
+
+        try:
+            seq = self.l2.incr(JOURNAL_SEQ_KEY)
+        except ValueError:
+            self.l2.add(JOURNAL_SEQ_KEY, 0, None)
+            seq = self.l2.incr(JOURNAL_SEQ_KEY)
+        self.l2.set(JOURNAL_ENTRY_KEY.format(seq=seq), list(keys),
+                    JOURNAL_TIMEOUT)
+        self.l1.own.add(seq)
+
+    def sync(self, force=False):
+        """Удаляет из L1 ключи, измененные другими процессами"""
+
+        store = self.l1
+        now = time.monotonic()
+        if not force and now - store.synced < self.sync_interval:
+            return
+        store.synced = now
+        seq = self.l2.get(JOURNAL_SEQ_KEY)
+        if seq is None:
+            self.l2.add(JOURNAL_SEQ_KEY, 0, None)
+            seq = self.l2.get(JOURNAL_SEQ_KEY)
+        last, store.seq = store.seq, seq
+        if seq == last:
+            return
+        if (last is None or seq is None or seq < last
+                or seq - last > JOURNAL_MAX_LAG):
+            # первый запуск, общий кеш очищен или журнал слишком длинный
+            store.clear()
+            store.own.clear()
+            return
+        numbers = range(last + 1, seq + 1)
+        entries = self.l2.get_many(
+            [JOURNAL_ENTRY_KEY.format(seq=number) for number in numbers])
+        if len(entries) < len(numbers):
+            store.clear()
+        for number in numbers:
+            keys = entries.get(JOURNAL_ENTRY_KEY.format(seq=number), ())
+            if number in store.own:
+                store.own.discard(number)
+            elif CLEAR_ALL in keys:
+                store.clear()
+            else:
+                store.delete(*keys)
+
+    def get(self, key, default=None, version=None):
+        self.sync()
+        local_key = self.make_key(key, version=version)
+        value = self.l1.get(local_key)
+        if value is not _missing:
+            return value
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self.l1.set(local_key, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.sync()
+        found, missing = {}, []
+        for key in keys:
+            value = self.l1.get(self.make_key(key, version=version))
+            if value is _missing:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            shared = self.l2.get_many(missing, version=version)
+            for key, value in shared.items():
+                self.l1.set(self.make_key(key, version=version), value,
+                            self.l1_timeout)
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        local_key = self.make_key(key, version=version)
+        self._store_local(local_key, value, timeout)
+        self._broadcast(local_key)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version)
+        local_keys = []
+        for key, value in data.items():
+            local_key = self.make_key(key, version=version)
+            if key not in (failed or ()):
+                self._store_local(local_key, value, timeout)
+            local_keys.append(local_key)
+        self._broadcast(*local_keys)
+        return failed
+
+    def _store_local(self, local_key, value, timeout):
+        local_timeout = self._local_timeout(timeout)
+        if local_timeout > 0:
+            self.l1.set(local_key, value, local_timeout)
+        else:
+            self.l1.delete(local_key)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            local_key = self.make_key(key, version=version)
+            self._store_local(local_key, value, timeout)
+            self._broadcast(local_key)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        local_key = self.make_key(key, version=version)
+        self.l1.set(local_key, value, self.l1_timeout)
+        self._broadcast(local_key)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.l2.delete(key, version=version)
+        local_key = self.make_key(key, version=version)
+        self.l1.delete(local_key)
+        self._broadcast(local_key)
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        local_keys = [self.make_key(key, version=version) for key in keys]
+        self.l1.delete(*local_keys)
+        self._broadcast(*local_keys)
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+        self._broadcast(CLEAR_ALL)
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
@@ -0,0 +1,58 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from core import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CONCURRENT_QUERIES,
+                thread_name_prefix='queries')
+        return _executor
+
+
+def _run(func):
+    # у потока пула свои соединения с базой: разорванные и устаревшие
+    # закрываются, запросы учитываются в метриках текущего запроса
+    close_old_connections()
+    request_metrics = metrics.current.get()
+    with ExitStack() as stack:
+        if request_metrics is not None:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(request_metrics))
+        return func()
+
+
+def gather(*funcs):
+    """
+    Выполняет независимые функции с запросами к базе одновременно в
+    потоках пула, у каждого потока свое соединение, и возвращает список
+    результатов. Ожидание ответа базы на каждый запрос перекрывается, и
+    задержка складывается не из суммы, а из максимума. Внутри транзакции
+    запросы должны идти через одно соединение, поэтому, как и при
+    CONCURRENT_QUERIES = 0, функции выполняются по очереди.
+    """
+
+    in_transaction = any(connection.in_atomic_block
+                         for connection in connections.all())
+    if len(funcs) < 2 or in_transaction or not settings.CONCURRENT_QUERIES:
+        return [func() for func in funcs]
+    executor = get_executor()
+    # контекст запроса (реплика, метрики) переходит в потоки пула
+    futures = [executor.submit(contextvars.copy_context().run, _run, func)
+               for func in funcs[1:]]
+    results = [funcs[0]()]
+    results.extend(future.result() for future in futures)
+    return results
@@ -0,0 +1,92 @@
+import os
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+# читает ли текущий запрос с реплики и писал ли он в основную базу
+use_replica = ContextVar('use_replica', default=False)
+wrote_to_primary = ContextVar('wrote_to_primary', default=False)
+
+
+def database_config(base_dir, env=os.environ):
+    """
+    Настройки DATABASES из переменных окружения.
+
+    DB_ENGINE, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT - основная
+    база (по умолчанию SQLite в db.sqlite3), DB_CONN_MAX_AGE - время жизни
+    постоянного соединения в секундах. DB_REPLICAS - реплики через запятую:
+    хосты для PostgreSQL или пути к файлам для SQLite. Реплики получают
+    псевдонимы replica_1, replica_2 и т.д.
+    """
+
+    engine = env.get('DB_ENGINE', SQLITE_ENGINE)
+    primary = {
+        'ENGINE': engine,
+        'NAME': env.get('DB_NAME', os.path.join(base_dir, 'db.sqlite3')),
+        'CONN_MAX_AGE': int(env.get('DB_CONN_MAX_AGE', 60)),
+    }
+    if engine == SQLITE_ENGINE:
+        # сколько секунд ждать снятия блокировки записи
+        primary['OPTIONS'] = {'timeout': float(env.get('DB_TIMEOUT', 5))}
+    else:
+        primary.update({
+            'USER': env.get('DB_USER', ''),
+            'PASSWORD': env.get('DB_PASSWORD', ''),
+            'HOST': env.get('DB_HOST', ''),
+            'PORT': env.get('DB_PORT', ''),
+        })
+    databases = {'default': primary}
+    replicas = [replica.strip()
+                for replica in env.get('DB_REPLICAS', '').split(',')
+                if replica.strip()]
+    for number, replica in enumerate(replicas, start=1):
+        target = 'NAME' if engine == SQLITE_ENGINE else 'HOST'
+        databases[f'replica_{number}'] = dict(
+            primary, **{target: replica},
+            # в тестах реплика - то же соединение, что и основная база
+            TEST={'MIRROR': 'default'},
+        )
+    return databases
+
+
+def replica_aliases(databases):
+    return [alias for alias in databases if alias.startswith('replica_')]
+
+
+def is_locked(error):
+    message = str(error)
+    return ('database is locked' in message
+            or 'database table is locked' in message)
+
+
+def retry_on_locked(func):
+    """
+    Выполняет func в транзакции и повторяет ее с растущей паузой, если
+    SQLite ответила «database is locked». Таймаут соединения не спасает,
+    когда транзакция начала с чтения, а другой процесс успел записать:
+    SQLite сразу возвращает ошибку. Откат транзакции делает повтор
+    безопасным. Внутри внешней транзакции повтор невозможен, и func
+    вызывается как есть.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.get_connection().in_atomic_block:
+            return func(*args, **kwargs)
+        delay = settings.DB_RETRY_DELAY
+        for attempt in range(settings.DB_RETRY_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if (not is_locked(error)
+                        or attempt == settings.DB_RETRY_ATTEMPTS - 1):
+                    raise
+            time.sleep(delay)
+            delay *= 2
+    return wrapper
@@ -0,0 +1,64 @@
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Значение ETag из частей: чисел, строк, дат и None"""
+
+    return hashlib.sha1(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def conditional(compute, weak=False, per_user=True):
+    """
+    Декоратор условного GET. compute(request, *args, **kwargs) дешево
+    возвращает пару (ETag, Last-Modified) без рендеринга страницы; если
+    клиент прислал совпадающие If-None-Match или If-Modified-Since, ответ
+    304 отдается сразу, и представление не вызывается.
+
+    weak=True дает слабый ETag: страницы с формами содержат новый
+    CSRF-токен при каждом рендеринге и совпадают только по смыслу.
+    per_user=True для страниц, которые выглядят по-разному для разных
+    пользователей: ETag включает пользователя, ответ получает
+    Vary: Cookie, а для авторизованных - Cache-Control: private, чтобы
+    общие кеши не отдали страницу другому пользователю.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag, last_modified = compute(request, *args, **kwargs)
+            if per_user:
+                etag = make_etag(etag, request.user.pk)
+            etag = quote_etag(etag)
+            if weak:
+                etag = f'W/{etag}'
+            timestamp = None
+            if last_modified is not None:
+                timestamp = timegm(last_modified.utctimetuple())
+            response = get_conditional_response(
+                request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                if not response.has_header('ETag'):
+                    response['ETag'] = etag
+                if timestamp is not None and not response.has_header(
+                        'Last-Modified'):
+                    response['Last-Modified'] = http_date(timestamp)
+            # ответ всегда сверяется с сервером, но повторная загрузка
+            # без изменений обходится в 304 без тела
+            patch_cache_control(response, no_cache=True)
+            if per_user:
+                patch_vary_headers(response, ('Cookie',))
+                if request.user.is_authenticated:
+                    patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
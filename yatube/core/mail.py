@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core.tasks import task
+
+
+@task
+def send_email(subject, body, from_email, recipient_list, html_body=None):
+    """Фоновая задача: отправляет готовое письмо"""
+
+    message = EmailMultiAlternatives(subject, body, from_email,
+                                     recipient_list)
+    if html_body is not None:
+        message.attach_alternative(html_body, 'text/html')
+    message.send()
+
+
+@task(keep=False)
+def send_password_reset(user_id, domain, site_name, protocol,
+                        subject_template_name, email_template_name,
+                        from_email, html_email_template_name=None):
+    """
+    Фоновая задача: письмо со ссылкой сброса пароля. В очереди лежит
+    только id пользователя, ссылка с токеном создается и письмо
+    собирается здесь, поэтому токен не хранится в таблице задач, а
+    выполненная задача сразу удаляется. Токен зависит от пароля и
+    времени входа, поэтому созданный позже запроса он так же действителен.
+    """
+
+    user = get_user_model().objects.filter(pk=user_id,
+                                           is_active=True).first()
+    if user is None:
+        return
+    context = {
+        'email': user.email,
+        'domain': domain,
+        'site_name': site_name,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'user': user,
+        'token': default_token_generator.make_token(user),
+        'protocol': protocol,
+    }
+    subject = loader.render_to_string(subject_template_name, context)
+    # в теме письма не может быть переводов строки
+    subject = ''.join(subject.splitlines())
+    body = loader.render_to_string(email_template_name, context)
+    html_body = None
+    if html_email_template_name is not None:
+        html_body = loader.render_to_string(html_email_template_name,
+                                            context)
+    send_email(subject, body, from_email, [user.email], html_body)
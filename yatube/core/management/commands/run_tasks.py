@@ -0,0 +1,57 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.tasks import Worker
+
+
+def run_worker(burst):
+    worker = Worker(burst=burst)
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    # Ctrl+C в терминале получает вся группа процессов, остановкой
+    # воркеров управляет родительский процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        worker.run()
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди (core.tasks) в нескольких '
+            'процессах. SIGTERM или Ctrl+C останавливают воркеры после '
+            'текущей задачи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--burst', action='store_true',
+                            help='Выйти, когда готовых задач не останется')
+
+    def handle(self, *args, **options):
+        if options['processes'] == 1:
+            worker = Worker(burst=options['burst'])
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: worker.stop())
+            processed = worker.run()
+            self.stdout.write(f'Выполнено задач: {processed}')
+            return
+        # дочерние процессы открывают свои соединения с базой
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=run_worker,
+                                     args=(options['burst'],))
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import wraps
+from statistics import quantiles
+
+from django.conf import settings
+from django.template.backends.django import (
+    DjangoTemplates as BaseDjangoTemplates)
+from django.utils.module_loading import import_string
+
+# метрики текущего запроса, None вне запроса
+current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Стоимость одного запроса: SQL, шаблоны и кэш"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # запросы могут выполняться в потоках пула (core.concurrency)
+        self.lock = threading.Lock()
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicates(self):
+        """Запросы, выполненные с теми же параметрами больше одного раза"""
+
+        return {sql: count for (sql, _), count in self.queries.items()
+                if count > 1}
+
+    def elapsed(self):
+        if self.duration is not None:
+            return self.duration
+        return time.perf_counter() - self.started
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper соединения с базой
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            try:
+                key = (sql, repr(params))
+            except Exception:
+                key = (sql, None)
+            with self.lock:
+                self.db_time += duration
+                self.queries[key] += 1
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.elapsed() * 1000, 2),
+            'queries': self.query_count,
+            'db_ms': round(self.db_time * 1000, 2),
+            'duplicate_queries': sum(count - 1 for count
+                                     in self.duplicates.values()),
+            'template_ms': round(self.template_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing"""
+
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="{self.query_count} queries, '
+            f'{len(self.duplicates)} duplicated"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, '
+            f'{self.cache_misses} misses"',
+            f'total;dur={self.elapsed() * 1000:.1f}',
+        ))
+
+
+class LatencyRegistry:
+    """
+    Скользящее окно длительностей последних METRICS_WINDOW запросов для
+    каждого имени URL. Хранится в памяти процесса.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, duration):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=settings.METRICS_WINDOW)
+            self.samples[name].append(duration)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """Количество и перцентили p50/p95/p99 в миллисекундах по URL"""
+
+        with self.lock:
+            samples = {name: list(values)
+                       for name, values in self.samples.items()}
+        rows = []
+        for name, values in sorted(samples.items()):
+            if len(values) > 1:
+                cuts = quantiles(values, n=100, method='inclusive')
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = values[0]
+            rows.append({'name': name, 'count': len(values),
+                         'p50': round(p50 * 1000, 2),
+                         'p95': round(p95 * 1000, 2),
+                         'p99': round(p99 * 1000, 2)})
+        return rows
+
+
+registry = LatencyRegistry()
+
+
+class TimedTemplate:
+    """
+    Шаблон бэкенда Django, время рендеринга которого учитывается в
+    метриках текущего запроса
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        # шаблоны, отрендеренные внутри другого, уже учтены во внешнем
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """
+    Бэкенд шаблонов Django с замером времени рендеринга, подключается в
+    TEMPLATES вместо django.template.backends.django.DjangoTemplates
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def _counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, *args, **kwargs):
+        value = get(self, key, default, *args, **kwargs)
+        metrics = current.get()
+        if metrics is not None:
+            if value is default:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return value
+    wrapper.counts_metrics = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, *args, **kwargs):
+        keys = list(keys)
+        values = get_many(self, keys, *args, **kwargs)
+        metrics = current.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+    return wrapper
+
+
+def install():
+    """
+    Подключает счетчики попаданий в кэш к классам бэкендов из CACHES.
+    Вызывается при запуске приложения core и только при METRICS_ENABLED,
+    повторный вызов ничего не меняет.
+    """
+
+    if not settings.METRICS_ENABLED:
+        return
+    backends = {import_string(options['BACKEND'])
+                for options in settings.CACHES.values()}
+    for backend in backends:
+        if getattr(backend.get, 'counts_metrics', False):
+            continue
+        # get_many по умолчанию вызывает get, его не считаем дважды
+        if 'get_many' in vars(backend):
+            backend.get_many = _counted_get_many(backend.get_many)
+        backend.get = _counted_get(backend.get)
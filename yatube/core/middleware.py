@@ -0,0 +1,89 @@
+import json
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from core import metrics
+from core.db import use_replica, wrote_to_primary
+
+logger = logging.getLogger('core.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Замеряет каждый запрос: число и время SQL-запросов, повторяющиеся
+    запросы, время рендеринга шаблонов, попадания в кэш. Пишет замер
+    строкой JSON в лог core.metrics, а длительность добавляет в
+    перцентили по имени URL. При METRICS_SERVER_TIMING замер отдается и
+    в заголовке Server-Timing, но только сотрудникам (is_staff).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(request_metrics))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        duration = request_metrics.finish()
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        if view_name:
+            metrics.registry.add(view_name, duration)
+        user = getattr(request, 'user', None)
+        if settings.METRICS_SERVER_TIMING and getattr(
+                user, 'is_staff', False):
+            response['Server-Timing'] = request_metrics.server_timing()
+        logger.info(json.dumps(dict(
+            request_metrics.as_dict(), method=request.method,
+            path=request.path, view=view_name, status=response.status_code,
+        ), ensure_ascii=False))
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Отправляет чтение страниц из REPLICA_READ_VIEWS на реплики. После
+    запроса, записавшего в основную базу, пользователь получает cookie и
+    следующие REPLICA_PIN_SECONDS секунд читает основную базу, чтобы сразу
+    видеть свои изменения, пока реплики их догоняют.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tokens = (use_replica.set(False), wrote_to_primary.set(False))
+        try:
+            response = self.get_response(request)
+            # служебная запись со страниц чтения (например, заполнение
+            # счетчиков) не меняет видимых пользователю данных
+            if wrote_to_primary.get() and not getattr(
+                    request, 'replica_read_view', False):
+                response.set_cookie(settings.REPLICA_PIN_COOKIE, '1',
+                                    max_age=settings.REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            use_replica.reset(tokens[0])
+            wrote_to_primary.reset(tokens[1])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.replica_read_view = (
+            request.method in ('GET', 'HEAD')
+            and request.resolver_match.view_name
+            in settings.REPLICA_READ_VIEWS)
+        if (request.replica_read_view and settings.REPLICA_DATABASES
+                and settings.REPLICA_PIN_COOKIE not in request.COOKIES):
+            use_replica.set(True)
@@ -8,3 +8,69 @@ class CreateModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class ExplicitCreatedQuerySet(models.QuerySet):
+    """
+    QuerySet, bulk_create которого сохраняет заданную дату создания
+    моделей, унаследованных от CreateModel: значения полей вставляются как
+    есть, без pre_save. Поля модели не меняются, поэтому обычные
+    сохранения в других потоках по-прежнему получают текущую дату.
+
+        ExplicitCreatedQuerySet(Comment).bulk_create(comments)
+    """
+
+    def _insert(self, objs, fields, return_id=False, raw=False, using=None,
+                ignore_conflicts=False):
+        return super()._insert(objs, fields, return_id=return_id, raw=True,
+                               using=using,
+                               ignore_conflicts=ignore_conflicts)
+
+
+class Task(CreateModel):
+    """
+    Фоновая задача в очереди (core.tasks). Воркер выбирает готовые задачи
+    по индексу (status, run_at) и захватывает их на время lease.
+    Выполненные задачи хранятся TASKS_KEEP_DONE секунд для метрик.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(verbose_name='Функция', max_length=200)
+    arguments = models.TextField(verbose_name='Аргументы (JSON)')
+    status = models.CharField(verbose_name='Состояние', max_length=10,
+                              choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(verbose_name='Попыток',
+                                           default=0)
+    max_attempts = models.PositiveIntegerField(
+        verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(verbose_name='Выполнить не раньше')
+    started = models.DateTimeField(verbose_name='Начало выполнения',
+                                   null=True, blank=True)
+    finished = models.DateTimeField(verbose_name='Окончание выполнения',
+                                    null=True, blank=True)
+    locked_by = models.CharField(verbose_name='Воркер', max_length=100,
+                                 blank=True)
+    locked_until = models.DateTimeField(verbose_name='Захвачена до',
+                                        null=True, blank=True)
+    last_error = models.TextField(verbose_name='Последняя ошибка',
+                                  blank=True)
+
+    class Meta:
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.status})'
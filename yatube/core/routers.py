@@ -0,0 +1,26 @@
+import random
+
+from django.conf import settings
+
+from core.db import use_replica, wrote_to_primary
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись всегда идет в основную базу. Чтение идет на случайную реплику,
+    только если middleware пометило запрос как читающий с реплики,
+    остальные запросы читают основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.REPLICA_DATABASES and use_replica.get():
+            return random.choice(settings.REPLICA_DATABASES)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        wrote_to_primary.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики содержат те же данные, что и основная база
+        return True
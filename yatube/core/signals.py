@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Настраивает каждое новое соединение с SQLite по SQLITE_PRAGMAS. В режиме
+    WAL читатели не блокируются записью, а synchronous=NORMAL в WAL
+    безопасен и не вызывает fsync на каждой транзакции.
+    """
+
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from functools import update_wrapper
+from statistics import quantiles
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.db import retry_on_locked
+from core.models import Task
+
+logger = logging.getLogger('core.tasks')
+
+# как часто воркер удаляет старые выполненные задачи, секунды
+PURGE_INTERVAL = 60
+
+
+class TaskFunction:
+    """
+    Функция, объявленная задачей. Обычный вызов выполняет ее сразу,
+    delay() ставит в очередь. Аргументы хранятся в JSON, поэтому
+    передаются id объектов, а не сами объекты; даты приходят строками.
+    keep=False - удалять задачу сразу после выполнения, а не хранить
+    TASKS_KEEP_DONE секунд.
+    """
+
+    def __init__(self, func, max_attempts=None, keep=True):
+        update_wrapper(self, func)
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.max_attempts = max_attempts
+        self.keep = keep
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.schedule(args, kwargs)
+
+    def schedule(self, args=(), kwargs=None, countdown=0):
+        """
+        Ставит задачу в очередь не раньше чем через countdown секунд.
+        Внутри транзакции задача видна воркерам только после ее
+        подтверждения, вместе с остальными изменениями. При TASKS_EAGER
+        задача выполняется сразу, аргументы так же проходят через JSON.
+        """
+
+        arguments = json.dumps({'args': list(args), 'kwargs': kwargs or {}},
+                               cls=DjangoJSONEncoder)
+        if settings.TASKS_EAGER:
+            payload = json.loads(arguments)
+            self.func(*payload['args'], **payload['kwargs'])
+            return None
+        return retry_on_locked(Task.objects.create)(
+            name=self.name, arguments=arguments,
+            max_attempts=self.max_attempts or settings.TASKS_MAX_ATTEMPTS,
+            run_at=timezone.now() + timedelta(seconds=countdown))
+
+
+def task(func=None, *, max_attempts=None, keep=True):
+    """
+    Декоратор фоновой задачи: @task или @task(max_attempts=3). Функция
+    должна быть доступна по имени модуля верхнего уровня, по нему ее
+    находит воркер.
+    """
+
+    if func is None:
+        return lambda func: TaskFunction(func, max_attempts, keep)
+    return TaskFunction(func, max_attempts, keep)
+
+
+def resolve(name):
+    """
+    Находит задачу по имени из очереди. None, если по этому имени
+    лежит не функция, объявленная через @task.
+    """
+
+    try:
+        func = import_string(name)
+    except ImportError:
+        return None
+    if not isinstance(func, TaskFunction) or func.name != name:
+        return None
+    return func
+
+
+def retry_delay(attempts):
+    """Пауза перед следующей попыткой: удваивается с каждой неудачной"""
+
+    return min(settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1),
+               settings.TASKS_RETRY_MAX_DELAY)
+
+
+class Worker:
+    """
+    Выполняет задачи из очереди одну за другой. Задача захватывается
+    условным UPDATE: из нескольких воркеров его выполнит один, поэтому
+    захват работает и на SQLite, где нет SELECT ... SKIP LOCKED. Задача
+    упавшего воркера через TASKS_LEASE секунд снова доступна остальным.
+    burst=True - выйти, когда готовых задач не осталось.
+    """
+
+    def __init__(self, name=None, burst=False):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.burst = burst
+        self.stopping = False
+        self.processed = 0
+        self.purged_at = None
+
+    def stop(self):
+        """Остановка после текущей задачи"""
+        self.stopping = True
+
+    def run(self):
+        while not self.stopping:
+            close_old_connections()
+            claimed = self.claim()
+            if claimed is None:
+                self.purge()
+                if self.burst:
+                    break
+                time.sleep(settings.TASKS_POLL_INTERVAL)
+                continue
+            self.execute(claimed)
+        close_old_connections()
+        return self.processed
+
+    def claim(self):
+        now = timezone.now()
+        expired = Q(status=Task.RUNNING, locked_until__lt=now)
+        # задача, на которой воркер погиб (нехватка памяти, падение
+        # процесса), иначе перезапускалась бы без конца: failed() для нее
+        # не вызывается
+        retry_on_locked(Task.objects.filter(
+            expired, attempts__gte=F('max_attempts')).update)(
+            status=Task.FAILED, finished=now, locked_until=None,
+            last_error='Истек захват: воркер завершился, не выполнив '
+                       'задачу, попытки исчерпаны')
+        ready = (Q(status=Task.QUEUED, run_at__lte=now)
+                 | expired & Q(attempts__lt=F('max_attempts')))
+        candidates = list(Task.objects.filter(ready).order_by(
+            'run_at', 'id').values_list('id', flat=True)[:10])
+        for task_id in candidates:
+            claimed = retry_on_locked(
+                Task.objects.filter(ready, id=task_id).update)(
+                status=Task.RUNNING, locked_by=self.name, started=now,
+                locked_until=now + timedelta(seconds=settings.TASKS_LEASE),
+                attempts=F('attempts') + 1)
+            if claimed:
+                return Task.objects.get(id=task_id)
+        return None
+
+    def execute(self, claimed):
+        func = resolve(claimed.name)
+        if func is None:
+            # имя задачи можно поправить в админке: выполняем только
+            # функции, объявленные через @task, остальное сразу роняем
+            now = timezone.now()
+            self.update(claimed, status=Task.FAILED, finished=now,
+                        locked_until=None,
+                        last_error=f'{claimed.name} не объявлена задачей')
+            self.log(claimed, Task.FAILED, now, logging.ERROR)
+            self.processed += 1
+            return
+        try:
+            payload = json.loads(claimed.arguments)
+            func(*payload['args'], **payload['kwargs'])
+        except Exception:
+            self.failed(claimed, traceback.format_exc())
+        else:
+            self.finished(claimed, func.keep)
+        self.processed += 1
+
+    def finished(self, claimed, keep=True):
+        now = timezone.now()
+        if keep:
+            self.update(claimed, status=Task.DONE, finished=now,
+                        locked_until=None, last_error='')
+        else:
+            retry_on_locked(self.owned(claimed).delete)()
+        self.log(claimed, Task.DONE, now)
+
+    def failed(self, claimed, error):
+        now = timezone.now()
+        if claimed.attempts >= claimed.max_attempts:
+            self.update(claimed, status=Task.FAILED, finished=now,
+                        locked_until=None, last_error=error)
+            self.log(claimed, Task.FAILED, now, logging.ERROR)
+            return
+        run_at = now + timedelta(seconds=retry_delay(claimed.attempts))
+        self.update(claimed, status=Task.QUEUED, run_at=run_at,
+                    locked_until=None, last_error=error)
+        self.log(claimed, 'retry', now, logging.WARNING)
+
+    def update(self, claimed, **fields):
+        retry_on_locked(self.owned(claimed).update)(**fields)
+
+    def owned(self, claimed):
+        # задачу, которую после истечения захвата взял другой воркер,
+        # не трогаем
+        return Task.objects.filter(id=claimed.id, locked_by=self.name,
+                                   status=Task.RUNNING)
+
+    def log(self, claimed, outcome, now, level=logging.INFO):
+        logger.log(level, json.dumps({
+            'task': claimed.name, 'id': claimed.id, 'outcome': outcome,
+            'attempt': claimed.attempts,
+            'wait_ms': round((claimed.started - claimed.run_at)
+                             .total_seconds() * 1000, 2),
+            'run_ms': round((now - claimed.started).total_seconds() * 1000,
+                            2),
+        }))
+
+    def purge(self):
+        """Удаляет выполненные задачи старше TASKS_KEEP_DONE секунд"""
+
+        if (self.purged_at is not None
+                and time.monotonic() - self.purged_at < PURGE_INTERVAL):
+            return
+        self.purged_at = time.monotonic()
+        retry_on_locked(Task.objects.filter(
+            status=Task.DONE, finished__lt=timezone.now() - timedelta(
+                seconds=settings.TASKS_KEEP_DONE)).delete)()
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    if len(values) > 1:
+        cuts = quantiles(values, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = values[0]
+    return {'p50': round(p50 * 1000, 2), 'p95': round(p95 * 1000, 2),
+            'p99': round(p99 * 1000, 2)}
+
+
+def stats():
+    """
+    Метрики очереди: число задач по состояниям, глубина очереди (готовые
+    к выполнению), возраст самой старой готовой задачи в секундах и
+    перцентили ожидания в очереди и выполнения в миллисекундах по
+    последним TASKS_METRICS_WINDOW выполненным задачам.
+    """
+
+    now = timezone.now()
+    # order_by() убирает сортировку из GROUP BY
+    counts = dict(Task.objects.order_by().values_list('status').annotate(
+        total=Count('id')))
+    ready = Task.objects.filter(status=Task.QUEUED, run_at__lte=now)
+    oldest = ready.order_by('run_at').values_list('run_at', flat=True).first()
+    recent = Task.objects.filter(status=Task.DONE).order_by(
+        '-finished').values_list('run_at', 'started', 'finished')[
+        :settings.TASKS_METRICS_WINDOW]
+    waits, runs = [], []
+    for run_at, started, finished in recent:
+        waits.append((started - run_at).total_seconds())
+        runs.append((finished - started).total_seconds())
+    return {
+        'counts': {status: counts.get(status, 0)
+                   for status, _ in Task.STATUSES},
+        'depth': ready.count(),
+        'oldest_wait_s': (round((now - oldest).total_seconds(), 1)
+                          if oldest is not None else None),
+        'wait_ms': _percentiles(waits),
+        'run_ms': _percentiles(runs),
+    }
@@ -0,0 +1,47 @@
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode, do_cache
+
+from core.cache import get_or_compute
+
+register = template.Library()
+
+
+class SafeCacheNode(CacheNode):
+    def render(self, context):
+        try:
+            expire_time = self.expire_time_var.resolve(context)
+            if expire_time is not None:
+                expire_time = int(expire_time)
+            cache_name = (self.cache_name.resolve(context)
+                          if self.cache_name else None)
+        except (template.VariableDoesNotExist, ValueError, TypeError) as e:
+            raise template.TemplateSyntaxError(
+                f'"cache" tag got an invalid argument: {e}')
+        try:
+            fragment_cache = caches[cache_name or 'template_fragments']
+        except InvalidCacheBackendError:
+            if cache_name:
+                raise template.TemplateSyntaxError(
+                    f'Invalid cache name specified for cache tag: '
+                    f'{cache_name!r}')
+            fragment_cache = caches['default']
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_compute(
+            make_template_fragment_key(self.fragment_name, vary_on),
+            lambda: self.nodelist.render(context), expire_time,
+            backend=fragment_cache)
+
+
+@register.tag('cache')
+def do_safe_cache(parser, token):
+    """
+    Замена {% cache %} с теми же аргументами, защищенная от одновременного
+    пересчета фрагмента (core.cache.get_or_compute). Подключается
+    {% load safe_cache %} вместо {% load cache %}.
+    """
+
+    node = do_cache(parser, token)
+    return SafeCacheNode(node.nodelist, node.expire_time_var,
+                         node.fragment_name, node.vary_on, node.cache_name)
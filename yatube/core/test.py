@@ -1,6 +1,67 @@
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from io import StringIO
 from http import HTTPStatus
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import resolve, reverse
+
+from core import metrics
+from core.asgi import ASGIHandler
+from core.cache import cached, entry_key, get_or_compute
+from core.cache_backends import (FILE_BACKEND, SQLITE_BACKEND,
+                                 TWO_TIER_BACKEND, SQLiteCache, TwoTierCache,
+                                 cache_config)
+from core.concurrency import gather
+from core.db import database_config, replica_aliases, retry_on_locked
+from core.http import conditional
+from core.models import Task
+from core.tasks import Worker, stats, task
+from core.middleware import ReplicaRoutingMiddleware
+from core.routers import PrimaryReplicaRouter
+from posts.models import Post
+
+User = get_user_model()
+
+TEMP_CACHE_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+# вызовы задачи record_call в тестах очереди
+CALLS = []
+
+
+@task
+def record_call(value):
+    CALLS.append(value)
+
+
+@task(max_attempts=2)
+def failing_task():
+    raise ValueError('Ошибка задачи')
+
+
+def plain_call(value):
+    CALLS.append(value)
 
 
 class CorePageTests(TestCase):
@@ -20,3 +81,759 @@ class CorePageTests(TestCase):
         template = "core/404.html"
         response = self.guest_client.get(non_exist_url)
         self.assertTemplateUsed(response, template)
+
+
+class DatabaseConfigTests(TestCase):
+    def test_sqlite_replicas_are_files(self):
+        """Реплики SQLite задаются путями к файлам и зеркалят базу в тестах"""
+        databases = database_config('/app', {
+            'DB_REPLICAS': '/app/replica.sqlite3',
+            'DB_CONN_MAX_AGE': '300',
+        })
+        self.assertEqual(databases['default']['NAME'], '/app/db.sqlite3')
+        self.assertEqual(databases['default']['CONN_MAX_AGE'], 300)
+        replica = databases['replica_1']
+        self.assertEqual(replica['NAME'], '/app/replica.sqlite3')
+        self.assertEqual(replica['TEST'], {'MIRROR': 'default'})
+        self.assertEqual(replica_aliases(databases), ['replica_1'])
+
+    def test_postgresql_replicas_are_hosts(self):
+        """Реплики PostgreSQL задаются хостами"""
+        databases = database_config('/app', {
+            'DB_ENGINE': 'django.db.backends.postgresql',
+            'DB_NAME': 'yatube',
+            'DB_HOST': 'primary',
+            'DB_REPLICAS': 'replica-a, replica-b',
+        })
+        self.assertEqual(databases['default']['HOST'], 'primary')
+        self.assertEqual(databases['replica_2']['HOST'], 'replica-b')
+        self.assertEqual(databases['replica_2']['NAME'], 'yatube')
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.seen = []
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+
+    def get_response(self, request):
+        match = request.resolver_match
+        self.middleware.process_view(request, match.func, match.args,
+                                     match.kwargs)
+        self.seen.append(PrimaryReplicaRouter().db_for_read(None))
+        return HttpResponse()
+
+    def request(self, method, path, **cookies):
+        request = getattr(self.factory, method)(path)
+        request.COOKIES.update(cookies)
+        request.resolver_match = resolve(path)
+        return self.middleware(request)
+
+    def test_read_views_use_replica(self):
+        """Страницы чтения читают с реплики"""
+        self.request('get', reverse('posts:index'))
+        self.assertEqual(self.seen, ['replica_1'])
+
+    def test_other_requests_use_primary(self):
+        """Формы и POST-запросы читают основную базу"""
+        self.request('get', reverse('posts:post_create'))
+        self.request('post', reverse('posts:index'))
+        self.assertEqual(self.seen, ['default', 'default'])
+
+    def test_pinned_user_reads_primary(self):
+        """После записи пользователь читает основную базу"""
+        self.request('get', reverse('posts:index'),
+                     **{settings.REPLICA_PIN_COOKIE: '1'})
+        self.assertEqual(self.seen, ['default'])
+
+    def test_routing_is_reset_after_request(self):
+        """Вне запроса чтение идет в основную базу"""
+        self.request('get', reverse('posts:index'))
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(None), 'default')
+
+
+class ReadYourWritesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='writer')
+        cls.post = Post.objects.create(author=cls.user, text='Текст')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_comment_pins_user_to_primary(self):
+        """Комментарий закрепляет пользователя за основной базой"""
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.id]),
+            {'text': 'Комментарий'})
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+    def test_read_view_does_not_pin(self):
+        """Страницы чтения не закрепляют пользователя"""
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+
+class SQLiteConnectionTests(TestCase):
+    def test_pragmas_applied_to_connection(self):
+        """Новое соединение с SQLite получает PRAGMA из настроек"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0],
+                             settings.SQLITE_PRAGMAS['cache_size'])
+
+
+@override_settings(DB_RETRY_ATTEMPTS=3, DB_RETRY_DELAY=0)
+class RetryOnLockedTests(TransactionTestCase):
+    def locked_then(self, failures, error='database is locked'):
+        calls = []
+
+        def write():
+            calls.append(connection.in_atomic_block)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return 'saved'
+        return retry_on_locked(write), calls
+
+    def test_retries_locked_write_in_transaction(self):
+        """Запись повторяется в транзакции, пока база заблокирована"""
+        write, calls = self.locked_then(failures=2)
+        self.assertEqual(write(), 'saved')
+        self.assertEqual(calls, [True, True, True])
+
+    def test_gives_up_after_attempts(self):
+        """После DB_RETRY_ATTEMPTS попыток ошибка пробрасывается"""
+        write, calls = self.locked_then(failures=3)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        """Другие ошибки базы не повторяются"""
+        write, calls = self.locked_then(failures=1, error='no such table')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.post = Post.objects.create(author=cls.staff, text='Текст')
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        """
+        Сотрудник получает Server-Timing с временем базы и шаблонов,
+        остальные - нет
+        """
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'cache;desc=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertNotIn('tpl;dur=0.0,', timing)
+
+    def test_structured_log_line(self):
+        """Каждый запрос пишет строку JSON в лог core.metrics"""
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            self.client.get(reverse('posts:post_detail',
+                                    args=[self.post.id]))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts:post_detail')
+        self.assertEqual(record['status'], HTTPStatus.OK)
+        self.assertGreater(record['queries'], 0)
+
+    def test_cache_hits_counted(self):
+        """Повторный запрос страницы попадает в кэш фрагментов"""
+        self.client.get(reverse('posts:index'))
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            self.client.get(reverse('posts:index'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreater(record['cache_hits'], 0)
+
+    def test_duplicate_queries_detected(self):
+        """Одинаковые запросы с одинаковыми параметрами помечаются"""
+        request_metrics = metrics.RequestMetrics()
+
+        def execute(sql, params, many, context):
+            return None
+
+        for params in ((1,), (1,), (2,)):
+            request_metrics(execute, 'SELECT %s', params, False, {})
+        self.assertEqual(request_metrics.query_count, 3)
+        self.assertEqual(request_metrics.duplicates, {'SELECT %s': 2})
+
+    def test_percentiles(self):
+        """Перцентили считаются по окну длительностей каждого URL"""
+        for duration in range(1, 101):
+            metrics.registry.add('posts:index', duration / 1000)
+        row, = metrics.registry.summary()
+        self.assertEqual(row['count'], 100)
+        self.assertEqual(row['p50'], 50.5)
+        self.assertEqual(row['p99'], 99.01)
+
+    def test_endpoint_is_staff_only(self):
+        """Страница метрик доступна только персоналу"""
+        response = self.client.get(reverse('core:metrics'))
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.client.force_login(self.staff)
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('core:metrics'),
+                                   {'format': 'json'})
+        names = [row['name'] for row in response.json()['views']]
+        self.assertIn('posts:index', names)
+
+
+class ConditionalTests(TestCase):
+    last_modified = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.calls = 0
+
+    def view(self, request):
+        self.calls += 1
+        return HttpResponse('page')
+
+    def get(self, user=None, **headers):
+        request = self.factory.get('/', **headers)
+        request.user = user or AnonymousUser()
+        decorated = conditional(
+            lambda request: ('version', self.last_modified),
+            weak=True)(self.view)
+        return decorated(request)
+
+    def test_not_modified_skips_view(self):
+        """Совпадающий ETag дает 304 без вызова представления"""
+        response = self.get()
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        cached = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        cached = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(self.calls, 1)
+
+    def test_user_variants(self):
+        """Страница авторизованного пользователя отдельна и приватна"""
+        anonymous = self.get()
+        user = User(pk=1, username='user')
+        authorized = self.get(user=user)
+        self.assertNotEqual(anonymous['ETag'], authorized['ETag'])
+        self.assertIn('Cookie', anonymous['Vary'])
+        self.assertIn('private', authorized['Cache-Control'])
+        self.assertNotIn('private', anonymous['Cache-Control'])
+        self.assertIn('no-cache', anonymous['Cache-Control'])
+        response = self.get(user=user, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+
+class SQLiteCacheTests(TestCase):
+    def make_cache(self, **options):
+        return SQLiteCache(os.path.join(TEMP_CACHE_DIR, f'{self.id()}.db'),
+                           {'OPTIONS': options})
+
+    def setUp(self):
+        self.cache = self.make_cache()
+        self.cache.clear()
+
+    def test_basic_operations(self):
+        """Значения, сроки, add и incr видны другому экземпляру"""
+        other = self.make_cache()
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(other.get('key'), {'value': 1})
+        self.assertFalse(other.add('key', 'other'))
+        self.assertTrue(other.add('new', 1))
+        self.assertEqual(self.cache.incr('new', 5), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(other.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        other.delete_many(['a', 'b'])
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('expired', 1, timeout=0)
+        self.assertIsNone(other.get('expired'))
+        self.assertTrue(other.add('expired', 2))
+
+    def test_culls_old_entries(self):
+        """Записей не становится больше MAX_ENTRIES"""
+        cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=2)
+        for i in range(30):
+            cache.set(f'key_{i}', i)
+        self.assertEqual(cache.get('key_29'), 29)
+        count, = cache.connection().execute(
+            'SELECT COUNT(*) FROM cache').fetchone()
+        self.assertLessEqual(count, 10)
+
+    def test_concurrent_incr_and_add(self):
+        """incr и add атомарны между соединениями"""
+        self.cache.set('counter', 0)
+        added = []
+
+        def work():
+            cache = self.make_cache()
+            added.append(cache.add('lock', 1))
+            for _ in range(50):
+                cache.incr('counter')
+
+        workers = [threading.Thread(target=work) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        self.assertEqual(added.count(True), 1)
+
+
+class TwoTierCacheTests(TestCase):
+    def make_cache(self, worker, **options):
+        # два экземпляра с разными LOCATION - кеши двух процессов с общим
+        # L2 в одном файле SQLite
+        options = dict({
+            'L2': {'BACKEND': SQLITE_BACKEND,
+                   'LOCATION': os.path.join(TEMP_CACHE_DIR,
+                                            'two-tier.db')},
+            'L1_TIMEOUT': 60,
+            'SYNC_INTERVAL': 0,
+        }, **options)
+        return TwoTierCache(f'{self.id()}-{worker}',
+                            {'OPTIONS': options, 'KEY_PREFIX': 'test'})
+
+    def setUp(self):
+        self.first = self.make_cache('first')
+        self.second = self.make_cache('second')
+        self.first.l2.clear()
+
+    def test_config_from_env(self):
+        """Адрес общего кеша задает L2, перед ним ставится L1"""
+        self.assertEqual(cache_config({})['default']['BACKEND'],
+                         'django.core.cache.backends.locmem.LocMemCache')
+        config = cache_config({'CACHE_URL': 'redis://cache:6379/0',
+                               'CACHE_KEY_PREFIX': 'site'})['default']
+        self.assertEqual(config['BACKEND'], TWO_TIER_BACKEND)
+        self.assertEqual(config['OPTIONS']['L2']['BACKEND'],
+                         'django_redis.cache.RedisCache')
+        self.assertEqual(config['OPTIONS']['L2']['KEY_PREFIX'], 'site')
+        # incr файлового кеша не атомарен, L1 перед ним не ставится
+        config = cache_config({'CACHE_URL': 'file:///tmp/yatube-cache',
+                               'CACHE_KEY_PREFIX': 'site'})['default']
+        self.assertEqual(config['BACKEND'], FILE_BACKEND)
+        self.assertEqual(config['LOCATION'], '/tmp/yatube-cache')
+        self.assertEqual(config['KEY_PREFIX'], 'site')
+        with self.assertRaises(ImproperlyConfigured):
+            self.make_cache('file', L2={'BACKEND': FILE_BACKEND,
+                                        'LOCATION': '/tmp/yatube-cache'})
+        config = cache_config({'CACHE_URL': 'sqlite:///tmp/cache.db'})
+        self.assertEqual(config['default']['BACKEND'], TWO_TIER_BACKEND)
+        self.assertEqual(config['default']['OPTIONS']['L2']['LOCATION'],
+                         '/tmp/cache.db')
+        config = cache_config({'CACHE_URL': 'redis://cache:6379/0',
+                               'CACHE_L1': '0'})['default']
+        self.assertEqual(config['LOCATION'], 'redis://cache:6379/0')
+
+    def test_reads_served_from_local_tier(self):
+        """Повторное чтение не обращается к общему кешу"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.second.l2.delete('key')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get_many(['key', 'missing']),
+                         {'key': 'value'})
+
+    def test_invalidation_broadcast(self):
+        """Запись в одном процессе удаляет устаревшее значение в другом"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+        self.second.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.first.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        self.second.incr('a')
+        self.assertEqual(self.first.get('a'), 2)
+        self.second.clear()
+        self.assertIsNone(self.first.get('b'))
+
+    def test_stale_until_sync(self):
+        """Между чтениями журнала L1 может отдать прежнее значение"""
+        second = self.make_cache('lazy', SYNC_INTERVAL=60)
+        self.first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(second.get('key'), 'old')
+        second.sync(force=True)
+        self.assertEqual(second.get('key'), 'new')
+
+    def test_lost_journal_clears_local_tier(self):
+        """Если записи журнала вытеснены, L1 очищается целиком"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.l2.set('key', 'new')
+        self.first.l2.incr('l1:seq')
+        self.assertEqual(self.second.get('key'), 'new')
+
+
+@override_settings(CACHE_EARLY_REFRESH_BETA=0)
+class StampedeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        cache.clear()
+
+    def compute(self):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(0.2)
+        return f'value_{calls}'
+
+    def run_concurrently(self, func, threads=8):
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(func()))
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_single_recompute_per_expiry(self):
+        """Одновременные запросы пересчитывают значение один раз"""
+        results = self.run_concurrently(
+            lambda: get_or_compute('key', self.compute, 60))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(set(results), {'value_1'})
+        # срок истек: пересчитывает один, остальные получают прежнее
+        value, _, duration = cache.get(entry_key('key'))
+        cache.set(entry_key('key'), (value, time.time() - 1, duration))
+        results = self.run_concurrently(
+            lambda: get_or_compute('key', self.compute, 60))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(results.count('value_2'), 1)
+        self.assertEqual(cache.get(entry_key('key'))[0], 'value_2')
+
+    def test_single_recompute_with_sqlite_cache(self):
+        """
+        Блокировка пересчета работает и в общем кеше SQLite, где у каждого
+        потока свое соединение
+        """
+        backend = SQLiteCache(os.path.join(TEMP_CACHE_DIR, 'stampede.db'),
+                              {})
+        backend.clear()
+        results = self.run_concurrently(
+            lambda: get_or_compute('key', self.compute, 60, backend))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(set(results), {'value_1'})
+
+    def test_warns_about_non_atomic_backend(self):
+        """Для FileBasedCache пишется предупреждение"""
+        backend = FileBasedCache(os.path.join(TEMP_CACHE_DIR, 'files'), {})
+        with self.assertLogs('core.cache', 'WARNING'):
+            self.assertEqual(
+                get_or_compute('key', lambda: 'value', 60, backend), 'value')
+
+    def test_stale_value_while_locked(self):
+        """Пока значение пересчитывается, отдается устаревшее"""
+        cache.set(entry_key('key'), ('stale', time.time() - 1, 0))
+        cache.add(entry_key('key') + ':lock', 1)
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'stale')
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(CACHE_EARLY_REFRESH_BETA=1)
+    def test_early_refresh(self):
+        """Долгое вычисление перед истечением пересчитывается заранее"""
+        cache.set(entry_key('key'), ('old', time.time() + 1, 10 ** 6))
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'value_1')
+
+    def test_value_of_previous_format_ignored(self):
+        """
+        Значение прежнего формата под тем же ключом, например оставшееся
+        в общем кеше после обновления, не ломает чтение
+        """
+        cache.set('key', frozenset({1}))
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'value_1')
+        self.assertEqual(cache.get('key'), frozenset({1}))
+
+    def test_decorator_and_template_tag(self):
+        """Декоратор и тег кешируют результат"""
+        decorated = cached(lambda number: f'number:{number}', 60)(
+            lambda number: self.compute())
+        self.assertEqual(decorated(1), decorated(1))
+        self.assertEqual(self.calls, 1)
+        template = Template('{% load safe_cache %}'
+                            '{% cache 60 fragment name %}{{ value }}'
+                            '{% endcache %}')
+        for value in ('first', 'second'):
+            self.assertEqual(
+                template.render(Context({'name': 'a', 'value': value})),
+                'first')
+
+
+class GatherTests(TransactionTestCase):
+    def test_functions_run_in_threads(self):
+        """Функции выполняются одновременно в разных потоках"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def wait():
+            # завершится, только если все три функции работают сразу
+            barrier.wait()
+            return threading.get_ident()
+
+        with override_settings(CONCURRENT_QUERIES=4):
+            idents = gather(wait, wait, wait)
+        self.assertEqual(len(set(idents)), 3)
+
+    def test_queries_see_committed_data(self):
+        """Запросы в потоках пула возвращают результаты по порядку"""
+        User.objects.create_user(username='author')
+        with override_settings(CONCURRENT_QUERIES=4):
+            users, posts = gather(
+                lambda: User.objects.filter(username='author').count(),
+                lambda: Post.objects.count(),
+            )
+        self.assertEqual((users, posts), (1, 0))
+
+    def test_sequential_in_transaction(self):
+        """Внутри транзакции функции выполняются в текущем потоке"""
+        with transaction.atomic():
+            idents = gather(threading.get_ident, threading.get_ident)
+        self.assertEqual(set(idents), {threading.get_ident()})
+
+
+class ASGIHandlerTests(TransactionTestCase):
+    def request(self, path, headers=(), method='GET', chunks=(b'',)):
+        messages = []
+        chunks = list(chunks)
+
+        async def receive():
+            body = chunks.pop(0)
+            return {'type': 'http.request', 'body': body,
+                    'more_body': bool(chunks)}
+
+        async def send(message):
+            messages.append(message)
+
+        handler = ASGIHandler(WSGIHandler(), workers=2)
+        asyncio.run(handler({
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': b'', 'headers': [(b'host', b'testserver'),
+                                             *headers],
+        }, receive, send))
+        handler.executor.shutdown()
+        return messages
+
+    def test_response_sent(self):
+        """Ответ Django передается сообщениями ASGI"""
+        Post.objects.create(author=User.objects.create_user('author'),
+                            text='Asgi_post_text')
+        messages = self.request(reverse('posts:index'))
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        self.assertEqual(messages[0]['status'], HTTPStatus.OK)
+        self.assertIn((b'content-type', b'text/html; charset=utf-8'),
+                      messages[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in messages)
+        self.assertIn('Asgi_post_text', body.decode())
+        self.assertFalse(messages[-1].get('more_body'))
+
+    @override_settings(REQUEST_MAX_BODY_SIZE=100,
+                       FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_large_body(self):
+        """
+        Тело больше FILE_UPLOAD_MAX_MEMORY_SIZE доходит до Django, тело
+        больше REQUEST_MAX_BODY_SIZE получает 413
+        """
+        author = User.objects.create_user('author')
+        post = Post.objects.create(author=author, text='Asgi_post_text')
+        client = Client()
+        client.force_login(author)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        token = 'a' * 64
+        cookies = (f'{settings.SESSION_COOKIE_NAME}={session}; '
+                   f'{settings.CSRF_COOKIE_NAME}={token}')
+        headers = [(b'cookie', cookies.encode()),
+                   (b'x-csrftoken', token.encode()),
+                   (b'content-type', b'application/x-www-form-urlencoded')]
+        url = reverse('posts:add_comment', kwargs={'post_id': post.id})
+        messages = self.request(url, headers, 'POST',
+                                [b'text=' + b'a' * 40, b'b' * 40])
+        self.assertEqual(messages[0]['status'], HTTPStatus.FOUND)
+        self.assertEqual(post.comments.get().text, 'a' * 40 + 'b' * 40)
+        messages = self.request(url, headers, 'POST',
+                                [b'text=' + b'a' * 60, b'b' * 60])
+        self.assertEqual(messages[0]['status'],
+                         HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        messages = self.request(url, [*headers, (b'content-length',
+                                                 b'1000')], 'POST')
+        self.assertEqual(messages[0]['status'],
+                         HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(post.comments.count(), 1)
+
+    def test_headers_in_environ(self):
+        """Заголовки ASGI становятся переменными окружения WSGI"""
+        environ = ASGIHandler.environ({
+            'method': 'POST', 'path': '/путь/', 'query_string': b'a=1',
+            'headers': [(b'content-type', b'text/plain'),
+                        (b'cookie', b'a=1'), (b'cookie', b'b=2')],
+        }, io.BytesIO(b'body'))
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['wsgi.input'].read(), b'body')
+        self.assertEqual(
+            environ['PATH_INFO'].encode('latin-1').decode(), '/путь/')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_delay_enqueues_task(self):
+        """delay() ставит задачу в очередь, воркер ее выполняет"""
+        record_call.delay(1)
+        self.assertEqual(CALLS, [])
+        queued = Task.objects.get()
+        self.assertEqual(queued.name, 'core.test.record_call')
+        self.assertEqual(queued.status, Task.QUEUED)
+        output = StringIO()
+        call_command('run_tasks', burst=True, stdout=output)
+        self.assertIn('Выполнено задач: 1', output.getvalue())
+        self.assertEqual(CALLS, [1])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.DONE)
+        self.assertEqual(queued.attempts, 1)
+
+    def test_direct_call_and_eager_mode(self):
+        """Вызов выполняет задачу сразу, TASKS_EAGER - и delay() тоже"""
+        record_call(1)
+        with override_settings(TASKS_EAGER=True):
+            record_call.delay(2)
+        self.assertEqual(CALLS, [1, 2])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_RETRY_DELAY=10)
+    def test_retry_with_backoff(self):
+        """
+        Упавшая задача повторяется с паузой, после max_attempts попыток
+        помечается упавшей
+        """
+        failing_task.delay()
+        before = datetime.now(timezone.utc)
+        Worker(burst=True).run()
+        failed = Task.objects.get()
+        self.assertEqual(failed.status, Task.QUEUED)
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreaterEqual(failed.run_at, before + timedelta(seconds=10))
+        self.assertIn('ValueError', failed.last_error)
+        # пауза еще не прошла
+        self.assertEqual(Worker(burst=True).run(), 0)
+        Task.objects.update(run_at=before)
+        Worker(burst=True).run()
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, Task.FAILED)
+        self.assertEqual(failed.attempts, 2)
+
+    def test_only_declared_tasks_executed(self):
+        """
+        Функции не через @task и несуществующие имена не выполняются,
+        задача сразу помечается упавшей без повторов
+        """
+        for name in ('core.test.plain_call', 'core.test.CALLS',
+                     'core.missing.record_call'):
+            Task.objects.create(
+                name=name, arguments='{"args": [1], "kwargs": {}}',
+                max_attempts=5, run_at=datetime.now(timezone.utc))
+        self.assertEqual(Worker(burst=True).run(), 3)
+        self.assertEqual(CALLS, [])
+        for rejected in Task.objects.all():
+            self.assertEqual(rejected.status, Task.FAILED)
+            self.assertEqual(rejected.attempts, 1)
+            self.assertIn('не объявлена задачей', rejected.last_error)
+
+    def test_expired_lease_reclaimed(self):
+        """Задачу упавшего воркера после истечения захвата берет другой"""
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        abandoned = Task.objects.create(
+            name='core.test.record_call', arguments='{"args": [3], '
+            '"kwargs": {}}', status=Task.RUNNING, attempts=1,
+            max_attempts=5, run_at=past, started=past, locked_by='dead',
+            locked_until=past)
+        Worker(burst=True).run()
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, Task.DONE)
+        self.assertEqual(abandoned.attempts, 2)
+        self.assertEqual(CALLS, [3])
+
+    def test_expired_lease_at_attempt_limit_failed(self):
+        """
+        Задача, на которой воркер погибал до исчерпания попыток, больше
+        не выполняется и помечается упавшей
+        """
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        abandoned = Task.objects.create(
+            name='core.test.record_call', arguments='{"args": [3], '
+            '"kwargs": {}}', status=Task.RUNNING, attempts=5,
+            max_attempts=5, run_at=past, started=past, locked_by='dead',
+            locked_until=past)
+        self.assertEqual(Worker(burst=True).run(), 0)
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, Task.FAILED)
+        self.assertIsNone(abandoned.locked_until)
+        self.assertEqual(CALLS, [])
+
+    def test_queue_stats(self):
+        """Метрики очереди: глубина, состояния и задержки"""
+        for value in range(3):
+            record_call.delay(value)
+        self.assertEqual(stats()['depth'], 3)
+        Worker(burst=True).run()
+        queue = stats()
+        self.assertEqual(queue['depth'], 0)
+        self.assertEqual(queue['counts'][Task.DONE], 3)
+        self.assertIn('p95', queue['wait_ms'])
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('core:metrics'),
+                                   {'format': 'json'})
+        self.assertEqual(response.json()['tasks']['counts'][Task.DONE], 3)
+
+    def test_password_reset_email_sent_by_worker(self):
+        """Письмо сброса пароля отправляет воркер, а не запрос"""
+        user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        response = self.client.post(reverse('users:password_reset_form'),
+                                    {'email': 'user@example.com'})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(len(mail.outbox), 0)
+        # в очереди нет ссылки с токеном, только id пользователя
+        queued = Task.objects.get()
+        self.assertNotIn('/reset/', queued.arguments)
+        self.assertEqual(json.loads(queued.arguments)['args'][0], user.pk)
+        Worker(burst=True).run()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        # ссылка из письма рабочая, а выполненная задача удалена
+        link = re.search(r'https?://\S+/reset/\S+/\S+/', mail.outbox[0].body)
+        response = self.client.get(link.group(0), follow=True)
+        self.assertContains(response, 'new_password1')
+        self.assertFalse(Task.objects.exists())
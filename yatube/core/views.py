@@ -1,5 +1,10 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from core import tasks
+from core.metrics import registry
+
 
 def page_not_found(request, exception):
     template = 'core/404.html'
@@ -18,3 +23,18 @@ def server_error(request):
 
 def csrf_failure(request):
     return render(request, 'core/403csrf.html')
+
+
+@staff_member_required
+def metrics(request):
+    """
+    Перцентили длительности запросов по URL и метрики очереди фоновых
+    задач, только для персонала
+    """
+
+    rows = registry.summary()
+    queue = tasks.stats()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'views': rows, 'tasks': queue})
+    return render(request, 'core/metrics.html',
+                  {'rows': rows, 'tasks': queue})
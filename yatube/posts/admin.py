@@ -1,6 +1,8 @@
 from django.contrib import admin
 
+from core.admin import CsvExportMixin
 from posts.models import Post, Group, Comment, Follow
+from posts.paginators import EstimatedCountPaginator
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -13,7 +15,7 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
@@ -22,31 +24,69 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('created',)
+    date_hierarchy = 'created'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
+    export_fields = (
+        ('id', 'pk'),
+        ('created', 'created'),
+        ('author', 'author__username'),
+        ('group', 'group__slug'),
+        ('text', 'text'),
+        ('image', 'image'),
+    )
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'text',
         'author',
         'created'
     )
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
+    # поиск постов по тексту для автодополнения слишком медленный
+    raw_id_fields = ('post',)
     search_fields = ('text',)
     list_filter = ('created',)
+    date_hierarchy = 'created'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
+    export_fields = (
+        ('id', 'pk'),
+        ('created', 'created'),
+        ('post', 'post_id'),
+        ('author', 'author__username'),
+        ('text', 'text'),
+    )
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(CsvExportMixin, admin.ModelAdmin):
     list_display = (
         'pk',
         'author',
         'user'
     )
-    list_filter = ('author', 'user',)
+    list_select_related = ('author', 'user')
+    autocomplete_fields = ('author', 'user')
+    # фильтр по автору и подписчику выводил в боковую панель всех
+    # пользователей, поиск по имени заменяет его
+    search_fields = ('author__username', 'user__username')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
+    export_fields = (
+        ('id', 'pk'),
+        ('user', 'user__username'),
+        ('author', 'author__username'),
+    )
 
 
 admin.site.register(Post, PostAdmin)
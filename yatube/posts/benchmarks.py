@@ -0,0 +1,225 @@
+import random
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+from statistics import mean, quantiles
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+
+from core.cache import entry_key
+from core.models import ExplicitCreatedQuerySet
+from posts import counters
+from posts.feed import FAN_OUT_ON_READ_CACHE_KEY, fan_out_on_read_authors
+from posts.models import Comment, Counter, FeedEntry, Follow, Group, Post
+from posts.search import get_backend
+
+User = get_user_model()
+
+
+@contextmanager
+def benchmark_database(verbosity=0, name=None):
+    """
+    Создает временную базу данных для замеров (как при запуске тестов) и
+    удаляет ее по завершении, рабочая база не затрагивается. Имя name
+    задает файл базы SQLite вместо базы в памяти, которую нельзя открыть
+    из нескольких потоков.
+    """
+
+    setup_test_environment()
+    if name is not None:
+        connection.settings_dict['TEST']['NAME'] = name
+    old_name = connection.creation.create_test_db(verbosity=verbosity,
+                                                  autoclobber=True,
+                                                  serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def timeit(func, repeat=5):
+    """Возвращает список длительностей (в секундах) repeat вызовов func"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(latencies, errors, elapsed):
+    """Пропускная способность и перцентили задержки в миллисекундах"""
+
+    stats = {'requests': len(latencies), 'errors': errors,
+             'throughput_rps': round(len(latencies) / elapsed, 1)}
+    if len(latencies) > 1:
+        cuts = quantiles(latencies, n=100, method='inclusive')
+        stats.update(mean_ms=round(mean(latencies) * 1000, 2),
+                     p50_ms=round(cuts[49] * 1000, 2),
+                     p95_ms=round(cuts[94] * 1000, 2),
+                     p99_ms=round(cuts[98] * 1000, 2))
+    return stats
+
+
+def heaviest_objects():
+    """
+    Параметры адресов с самыми тяжелыми страницами: самый популярный
+    автор, самая большая группа, пост с наибольшим числом комментариев.
+    """
+
+    def top(kind):
+        key = Counter.objects.filter(
+            **counters.key_range(kind)).order_by('-value').values_list(
+            'key', flat=True).first()
+        return counters.parse_key(key)[1]
+
+    return {
+        'username': User.objects.get(
+            pk=top(counters.AUTHOR_FOLLOWERS)).username,
+        'slug': Group.objects.get(pk=top(counters.GROUP_POSTS)).slug,
+        'post_id': Post.objects.get(pk=top(counters.POST_COMMENTS)).pk,
+    }
+
+
+def seed_posts(number, author=None, batch_size=10000, text=None):
+    """
+    Быстро заполняет таблицу постов пакетными INSERT. Дата создания
+    убывает на секунду от поста к посту, как у реальной ленты. Текст
+    поста i возвращает функция text(i).
+    """
+
+    if author is None:
+        author, _ = User.objects.get_or_create(username='bench_author')
+    table = Post._meta.db_table
+    sql = (f'INSERT INTO {table} (created, image, renditions, text, '
+           f'author_id) VALUES (%s, %s, %s, %s, %s)')
+    if text is None:
+        def text(i):
+            return f'Post {i}'
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        for start in range(0, number, batch_size):
+            stop = min(start + batch_size, number)
+            cursor.executemany(sql, [
+                (now - timedelta(seconds=i), '', '', text(i), author.id)
+                for i in range(start, stop)
+            ])
+    return author
+
+
+def zipf_weights(size, exponent=1.0):
+    """Накопленные веса степенного распределения для size элементов"""
+
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+def seed_dataset(users=1000, groups=20, posts=20000, comments=50000,
+                 follows=20000, seed=0, batch_size=5000):
+    """
+    Заполняет базу пользователями, группами, постами, комментариями и
+    подписками через bulk_create. Популярность распределена по степенному
+    закону: немногие авторы пишут большую часть постов и собирают
+    большинство подписчиков, немногие посты - большинство комментариев.
+    Сигналы при bulk_create не срабатывают, поэтому ленты подписок,
+    счетчики и поисковый индекс заполняются здесь же. Пароль всех
+    пользователей - bench. Одинаковый seed дает одинаковые данные.
+    """
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password('bench')
+    User.objects.bulk_create(
+        [User(username=f'user{i}', password=password)
+         for i in range(users)])
+    user_ids = list(User.objects.filter(
+        username__startswith='user').order_by('id').values_list(
+        'id', flat=True))
+    Group.objects.bulk_create(
+        [Group(title=f'Группа {i}', slug=f'group-{i}',
+               description=f'Описание группы {i}') for i in range(groups)])
+    group_ids = list(Group.objects.order_by('id').values_list(
+        'id', flat=True))
+    # ранги популярности не совпадают с порядком id
+    popular_users = rng.sample(user_ids, len(user_ids))
+    user_weights = zipf_weights(len(user_ids))
+    group_weights = zipf_weights(len(group_ids))
+
+    authors = rng.choices(popular_users, cum_weights=user_weights, k=posts)
+    ExplicitCreatedQuerySet(Post).bulk_create(
+        [Post(author_id=author_id, text=f'Пост {i} автора {author_id}',
+              group_id=(rng.choices(group_ids,
+                                    cum_weights=group_weights)[0]
+                        if rng.random() < 0.7 else None),
+              created=now - timedelta(minutes=i), renditions='')
+         for i, author_id in enumerate(authors)])
+    post_rows = list(Post.objects.order_by('-created', '-id').values_list(
+        'id', 'author_id', 'group_id', 'created'))
+    popular_posts = rng.sample([row[0] for row in post_rows],
+                               len(post_rows))
+    commented = rng.choices(popular_posts,
+                            cum_weights=zipf_weights(len(popular_posts)),
+                            k=comments)
+    ExplicitCreatedQuerySet(Comment).bulk_create(
+        [Comment(post_id=post_id, author_id=rng.choice(user_ids),
+                 text=f'Комментарий {i}',
+                 created=now - timedelta(seconds=i))
+         for i, post_id in enumerate(commented)])
+
+    edges = set()
+    for _ in range(follows * 2):
+        if len(edges) >= follows:
+            break
+        user_id = rng.choice(user_ids)
+        author_id = rng.choices(popular_users, cum_weights=user_weights)[0]
+        if user_id != author_id:
+            edges.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in edges])
+
+    followers = Tally(author_id for _, author_id in edges)
+    author_posts = Tally(row[1] for row in post_rows)
+    group_posts = Tally(row[2] for row in post_rows if row[2] is not None)
+    post_comments = Tally(commented)
+    Counter.objects.bulk_create(
+        [Counter(key=counters.POSTS, value=len(post_rows))]
+        + [Counter(key=counters.make_key(kind, object_id), value=value)
+           for kind, tally in ((counters.AUTHOR_FOLLOWERS, followers),
+                               (counters.AUTHOR_POSTS, author_posts),
+                               (counters.GROUP_POSTS, group_posts),
+                               (counters.POST_COMMENTS, post_comments))
+           for object_id, value in tally.items()])
+
+    # ленты подписок, как после backfill при подписке
+    cache.delete(entry_key(FAN_OUT_ON_READ_CACHE_KEY))
+    fan_out_on_read = fan_out_on_read_authors()
+    recent = {}
+    for post_id, author_id, _, created in post_rows:
+        posts_of_author = recent.setdefault(author_id, [])
+        if len(posts_of_author) < settings.FEED_BACKFILL_SIZE:
+            posts_of_author.append((post_id, created))
+    entries = []
+    for user_id, author_id in edges:
+        if author_id in fan_out_on_read:
+            continue
+        entries.extend(
+            FeedEntry(user_id=user_id, post_id=post_id, author_id=author_id,
+                      created=created)
+            for post_id, created in recent.get(author_id, ()))
+        if len(entries) >= batch_size:
+            FeedEntry.objects.bulk_create(entries)
+            entries = []
+    FeedEntry.objects.bulk_create(entries)
+    get_backend().rebuild(batch_size=batch_size)
@@ -0,0 +1,55 @@
+from django.conf import settings
+
+from core.cache import cached, get_generations
+from posts import counters
+
+INDEX_SCOPE = 'posts'
+# изменения групп отображаются на всех страницах со списками постов
+GROUPS_SCOPE = 'groups'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def profile_scope(author_id):
+    return f'profile:{author_id}'
+
+
+def post_scopes(author_id, group_id=None):
+    """Области кеша, в которых отображается пост"""
+
+    scopes = [INDEX_SCOPE, profile_scope(author_id)]
+    if group_id is not None:
+        scopes.append(group_scope(group_id))
+    return scopes
+
+
+def listing_cache(request, scope):
+    """
+    Параметры кеша фрагмента со списком постов: время жизни и версия
+    фрагмента. Версия складывается из поколений области и номера страницы
+    или курсора, поэтому каждая страница кешируется отдельно, а запись в
+    области сразу делает ее фрагменты недействительными.
+    """
+
+    generations = get_generations(scope, GROUPS_SCOPE)
+    page = request.GET.get('cursor') or request.GET.get('page') or ''
+    return {
+        'timeout': settings.LISTING_CACHE_TIMEOUT,
+        'version': '.'.join(map(str, generations)) + f':{page}',
+    }
+
+
+def author_posts_key(author_id):
+    # поколение области профиля меняется с каждым новым или удаленным
+    # постом автора, и вместе с ним ключ
+    generation, = get_generations(profile_scope(author_id))
+    return f'author_posts:{author_id}:{generation}'
+
+
+@cached(author_posts_key, lambda: settings.LISTING_CACHE_TIMEOUT)
+def author_posts_count(author_id):
+    """Количество постов автора из кеша"""
+
+    return counters.get(counters.AUTHOR_POSTS, author_id)
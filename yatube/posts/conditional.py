@@ -0,0 +1,96 @@
+from django.contrib.auth import get_user_model
+from django.http import Http404
+
+from core.cache import generation_time, get_generations
+from core.concurrency import gather
+from core.http import make_etag
+from posts import counters, journal
+from posts.cache import GROUPS_SCOPE, INDEX_SCOPE, group_scope, profile_scope
+from posts.feed import feed_count, feed_posts
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+
+
+def validators(request, scopes, newest, *extra):
+    """
+    ETag и Last-Modified страницы. ETag складывается из поколений областей
+    кеша, которые меняются при любой записи в области (в том числе при
+    правке), даты самого нового объекта и параметров запроса. Last-Modified
+    - самое позднее из времени последнего изменения областей и даты самого
+    нового объекта.
+    """
+
+    generations = get_generations(*scopes, GROUPS_SCOPE)
+    etag = make_etag(*generations, newest, request.GET.urlencode(), *extra)
+    times = [generation_time(generation) for generation in generations]
+    if newest is not None:
+        times.append(newest)
+    return etag, max(times)
+
+
+def newest(posts):
+    return posts.order_by('-created', '-id').values_list(
+        'created', flat=True).first()
+
+
+def get_author_id(username):
+    author_id = User.objects.filter(username=username).values_list(
+        'id', flat=True).first()
+    if author_id is None:
+        raise Http404
+    return author_id
+
+
+def get_group_id(slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'id', flat=True).first()
+    if group_id is None:
+        raise Http404
+    return group_id
+
+
+def index_validators(request):
+    return validators(request, [INDEX_SCOPE], newest(Post.objects.all()))
+
+
+def group_validators(request, slug):
+    group_id = get_group_id(slug)
+    return validators(request, [group_scope(group_id)],
+                      newest(Post.objects.filter(group_id=group_id)))
+
+
+def profile_validators(request, username):
+    author_id = get_author_id(username)
+    # подписка и отписка меняют кнопку подписки и счетчик подписчиков
+    last_post, followers = gather(
+        lambda: newest(Post.objects.filter(author_id=author_id)),
+        lambda: counters.get(counters.AUTHOR_FOLLOWERS, author_id),
+    )
+    return validators(request, [profile_scope(author_id)], last_post,
+                      followers)
+
+
+def post_validators(request, post_id):
+    post, last_comment = gather(
+        lambda: Post.objects.filter(id=post_id).values(
+            'author_id', 'created').first(),
+        lambda: newest(Comment.objects.filter(post_id=post_id)),
+    )
+    if post is None:
+        raise Http404
+    # свои комментарии, еще не перенесенные из журнала, видны автору
+    pending = [comment.journal_id for comment in
+               journal.pending_comments(request.user, post_id)]
+    # комментарии и правка поста меняют поколение профиля автора
+    return validators(request, [profile_scope(post['author_id'])],
+                      last_comment, post_id, post['created'], pending)
+
+
+def follow_validators(request):
+    # любая запись в постах меняет поколение главной ленты, а подписка и
+    # отписка - число постов в ленте пользователя
+    return validators(request, [INDEX_SCOPE],
+                      feed_posts(request.user).values_list(
+                          'created', flat=True).first(),
+                      feed_count(request.user))
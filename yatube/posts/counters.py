@@ -0,0 +1,172 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from posts.models import Comment, Counter, Follow, Post
+
+POSTS = 'posts'
+GROUP_POSTS = 'group_posts'
+AUTHOR_POSTS = 'author_posts'
+AUTHOR_FOLLOWERS = 'author_followers'
+POST_COMMENTS = 'post_comments'
+IMAGE_USES = 'image_uses'
+
+# вид счетчика -> (модель, поле, по которому считаются объекты)
+SOURCES = {
+    POSTS: (Post, None),
+    GROUP_POSTS: (Post, 'group_id'),
+    AUTHOR_POSTS: (Post, 'author_id'),
+    AUTHOR_FOLLOWERS: (Follow, 'author_id'),
+    POST_COMMENTS: (Comment, 'post_id'),
+    IMAGE_USES: (Post, 'image'),
+}
+# виды счетчиков, у которых объект задан не id, а строкой: у IMAGE_USES
+# это имя файла изображения в хранилище
+NAMED_KINDS = {IMAGE_USES}
+
+
+def make_key(kind, object_id=None):
+    if object_id is None:
+        return kind
+    return f'{kind}:{object_id}'
+
+
+def parse_key(key):
+    kind, _, object_id = key.partition(':')
+    if not object_id:
+        return kind, None
+    return kind, object_id if kind in NAMED_KINDS else int(object_id)
+
+
+def key_range(kind):
+    """
+    Границы ключей счетчиков одного вида. Сравнение по диапазону, в отличие
+    от LIKE, использует индекс первичного ключа.
+    """
+    return {'key__gt': f'{kind}:', 'key__lt': f'{kind};'}
+
+
+def count_source(kind, object_id=None):
+    """Точное значение счетчика, посчитанное по исходной таблице"""
+
+    model, field = SOURCES[kind]
+    objects = model.objects.all()
+    if field is not None:
+        objects = objects.filter(**{field: object_id})
+    return objects.count()
+
+
+def get(kind, object_id=None):
+    """
+    Значение счетчика. Отсутствующий счетчик один раз считается по исходной
+    таблице и сохраняется.
+    """
+
+    key = make_key(kind, object_id)
+    value = Counter.objects.filter(key=key).values_list(
+        'value', flat=True).first()
+    if value is None:
+        value = count_source(kind, object_id)
+        try:
+            with transaction.atomic():
+                Counter.objects.create(key=key, value=value)
+        except IntegrityError:
+            # счетчик уже создан параллельным запросом
+            pass
+    return value
+
+
+def incr(kind, object_id=None, delta=1):
+    """
+    Атомарно изменяет счетчик на delta. Если счетчика еще нет, он создается
+    подсчетом по исходной таблице, в котором изменение уже учтено.
+    """
+
+    key = make_key(kind, object_id)
+    updated = Counter.objects.filter(key=key).update(
+        value=F('value') + delta)
+    if not updated:
+        get(kind, object_id)
+
+
+def incr_many(kind, deltas, batch_size=500):
+    """
+    Изменяет счетчики одного вида: deltas - словарь id объекта ->
+    изменение. Существующие счетчики обновляются одним UPDATE на каждое
+    различное значение изменения, отсутствующие создаются подсчетом по
+    исходной таблице, в котором изменения уже учтены.
+    """
+
+    keys = {make_key(kind, object_id): object_id for object_id in deltas}
+    batches = [list(keys)[start:start + batch_size]
+               for start in range(0, len(keys), batch_size)]
+    existing = set()
+    for batch in batches:
+        existing.update(Counter.objects.filter(key__in=batch).values_list(
+            'key', flat=True))
+    by_delta = {}
+    for key in existing:
+        by_delta.setdefault(deltas[keys[key]], []).append(key)
+    for delta, delta_keys in by_delta.items():
+        for start in range(0, len(delta_keys), batch_size):
+            Counter.objects.filter(
+                key__in=delta_keys[start:start + batch_size]).update(
+                value=F('value') + delta)
+    missing = [object_id for key, object_id in keys.items()
+               if key not in existing]
+    model, field = SOURCES[kind]
+    for start in range(0, len(missing), batch_size):
+        ids = missing[start:start + batch_size]
+        actual = dict(
+            model.objects.filter(**{f'{field}__in': ids}).order_by()
+            .values(field).annotate(total=Count('pk'))
+            .values_list(field, 'total')
+        )
+        # счетчик, созданный параллельным запросом, уже учел изменение
+        Counter.objects.bulk_create(
+            [Counter(key=make_key(kind, object_id),
+                     value=actual.get(object_id, 0)) for object_id in ids],
+            ignore_conflicts=True)
+
+
+def reconcile(batch_size=1000):
+    """
+    Пересчитывает сохраненные счетчики по исходным таблицам пачками по
+    batch_size и исправляет расхождения. Возвращает число исправленных.
+    """
+
+    fixed = 0
+    for kind, (model, field) in SOURCES.items():
+        if field is None:
+            counter = Counter.objects.filter(key=kind).first()
+            if counter is not None:
+                value = count_source(kind)
+                if counter.value != value:
+                    counter.value = value
+                    counter.save(update_fields=['value'])
+                    fixed += 1
+            continue
+        last_key = None
+        while True:
+            batch = Counter.objects.filter(**key_range(kind)).order_by('key')
+            if last_key is not None:
+                batch = batch.filter(key__gt=last_key)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_key = batch[-1].key
+            ids = [parse_key(counter.key)[1] for counter in batch]
+            # order_by() убирает сортировку модели из GROUP BY
+            actual = dict(
+                model.objects.filter(**{f'{field}__in': ids}).order_by()
+                .values(field).annotate(total=Count('pk'))
+                .values_list(field, 'total')
+            )
+            drifted = []
+            for counter, object_id in zip(batch, ids):
+                value = actual.get(object_id, 0)
+                if counter.value != value:
+                    counter.value = value
+                    drifted.append(counter)
+            Counter.objects.bulk_update(drifted, ['value'])
+            fixed += len(drifted)
+    return fixed
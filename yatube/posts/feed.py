@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db.models import F, Q
+
+from core.cache import cached
+from posts import counters
+from posts.models import Counter, FeedEntry, Follow, Post
+
+FAN_OUT_ON_READ_CACHE_KEY = 'feed:fan_out_on_read_authors'
+
+
+@cached(FAN_OUT_ON_READ_CACHE_KEY,
+        lambda: settings.FEED_FANOUT_AUTHORS_TIMEOUT)
+def fan_out_on_read_authors():
+    """
+    Авторы, у которых подписчиков больше FEED_FANOUT_MAX_FOLLOWERS. Их посты
+    не раскладываются по лентам при публикации, а подмешиваются при чтении.
+    Список кешируется, чтобы запись и чтение ленты опирались на одно и то
+    же множество авторов.
+    """
+
+    keys = Counter.objects.filter(
+        value__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        **counters.key_range(counters.AUTHOR_FOLLOWERS),
+    ).values_list('key', flat=True)
+    return frozenset(counters.parse_key(key)[1] for key in keys)
+
+
+def fan_out_post(post):
+    """Добавляет новый пост в ленты всех подписчиков автора"""
+
+    if post.author_id in fan_out_on_read_authors():
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True)
+    batch_size = settings.FEED_FANOUT_BATCH_SIZE
+    entries = []
+    for user_id in followers.iterator(chunk_size=batch_size):
+        entries.append(FeedEntry(user_id=user_id, post_id=post.id,
+                                 author_id=post.author_id,
+                                 created=post.created))
+        if len(entries) >= batch_size:
+            FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill(user_id, author_id):
+    """
+    Заполняет ленту пользователя последними постами автора при подписке.
+    Количество постов ограничено настройкой FEED_BACKFILL_SIZE.
+    """
+
+    if author_id in fan_out_on_read_authors():
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-created', '-id').values_list('id', 'created')
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, post_id=post_id, author_id=author_id,
+                   created=created)
+         for post_id, created in posts[:settings.FEED_BACKFILL_SIZE]],
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    """Удаляет посты автора из ленты пользователя при отписке"""
+
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def _fan_out_on_read_followed(user):
+    """Авторы с чтением при запросе, на которых подписан пользователь"""
+
+    fan_out_on_read = fan_out_on_read_authors()
+    if not fan_out_on_read:
+        return []
+    return list(Follow.objects.filter(
+        user=user, author_id__in=fan_out_on_read
+    ).values_list('author_id', flat=True))
+
+
+def feed_count(user):
+    """
+    Количество постов в ленте для пагинатора по номеру страницы: считается
+    по индексу FeedEntry без соединения с постами. None, если в ленту
+    подмешиваются посты при чтении и счет нужно вести по постам.
+    """
+
+    if _fan_out_on_read_followed(user):
+        return None
+    return FeedEntry.objects.filter(user=user).count()
+
+
+def feed_posts(user):
+    """
+    Кверисет постов ленты подписок пользователя. Обычно лента читается из
+    FeedEntry по индексу (user, created), так что стоимость страницы не
+    зависит от числа подписок. Если пользователь подписан на авторов с
+    огромным числом подписчиков, их посты добавляются запросом по автору.
+    """
+
+    read_authors = _fan_out_on_read_followed(user)
+    if not read_authors:
+        return Post.objects.filter(feed_entries__user=user).annotate(
+            feed_created=F('feed_entries__created'),
+            feed_post=F('feed_entries__post_id'),
+        ).order_by('-feed_created', '-feed_post')
+    entries = FeedEntry.objects.filter(user=user).values('post_id')
+    return Post.objects.filter(
+        Q(id__in=entries) | Q(author_id__in=read_authors)
+    ).order_by('-created', '-id')
@@ -1,12 +1,28 @@
 from django import forms
 
+from posts import images
 from posts.models import Post, Comment
 
 
+class UploadedImageField(forms.ImageField):
+    """
+    Поле изображения поста: вместо полной проверки Pillow файл проходит
+    стадию обработки posts.images - проверку заголовка и пересжатие.
+    """
+
+    def to_python(self, data):
+        # FileField.to_python: проверки имени и пустого файла без Pillow
+        upload = super(forms.ImageField, self).to_python(data)
+        if upload is None:
+            return None
+        return images.process(upload)
+
+
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        field_classes = {'image': UploadedImageField}
 
 
 class CommentForm(forms.ModelForm):
@@ -0,0 +1,105 @@
+import math
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from PIL import Image, ImageOps
+
+# расширение, тип содержимого и режимы изображения для формата сохранения
+FORMATS = {
+    'JPEG': ('.jpg', 'image/jpeg', ('RGB', 'L')),
+    'WEBP': ('.webp', 'image/webp', ('RGB', 'RGBA')),
+}
+
+INVALID_IMAGE = ('Загрузите правильное изображение. Файл, который вы '
+                 'загрузили, поврежден или не является изображением.')
+
+
+def inspect(upload):
+    """
+    Проверяет загруженный файл до декодирования: размер файла, формат и
+    размеры изображения. Image.open читает только заголовок, поэтому
+    «бомба» из нескольких килобайт с огромными размерами отклоняется,
+    не занимая памяти под пиксели. Возвращает открытое изображение.
+    """
+
+    if upload.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ValidationError(
+            'Файл больше %(limit)d МБ.', code='file_too_large',
+            params={'limit': settings.IMAGE_UPLOAD_MAX_SIZE // 2 ** 20})
+    too_large = ValidationError(
+        'Изображение больше %(limit)d мегапикселей.', code='image_too_large',
+        params={'limit': settings.IMAGE_MAX_PIXELS // 10 ** 6})
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except Image.DecompressionBombError:
+        # собственная проверка Pillow для совсем огромных размеров
+        raise too_large
+    except Exception:
+        raise ValidationError(INVALID_IMAGE, code='invalid_image')
+    if image.format not in settings.IMAGE_UPLOAD_FORMATS:
+        raise ValidationError(
+            'Формат %(format)s не поддерживается.', code='invalid_format',
+            params={'format': image.format})
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise too_large
+    return image
+
+
+def reencode(upload, image):
+    """
+    Пересохраняет изображение в формате IMAGE_FORMAT (прогрессивный JPEG
+    или WebP), уменьшив большую сторону до IMAGE_MAX_DIMENSION. JPEG
+    декодируется сразу в уменьшенном масштабе (draft), поэтому снимок с
+    телефона не разворачивается в памяти целиком. Поворот из EXIF
+    применяется к пикселям, а сами метаданные (EXIF с геопозицией, XMP,
+    профили) в новый файл не попадают. Анимированные изображения
+    возвращаются как есть, чтобы не потерять кадры. Результат - временный
+    файл на диске с именем исходного и расширением нового формата.
+    """
+
+    if getattr(image, 'is_animated', False):
+        upload.seek(0)
+        return upload
+    limit = settings.IMAGE_MAX_DIMENSION
+    extension, content_type, modes = FORMATS[settings.IMAGE_FORMAT]
+    width, height = image.size
+    scale = min(limit / max(width, height), 1)
+    try:
+        # draft выбирает наименьший масштаб декодирования JPEG, при
+        # котором обе стороны не меньше запрошенных
+        image.draft('RGB', (math.ceil(width * scale),
+                            math.ceil(height * scale)))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((limit, limit), Image.LANCZOS)
+        if image.mode not in modes:
+            transparent = (image.mode in ('RGBA', 'LA', 'PA')
+                           or 'transparency' in image.info)
+            image = image.convert(
+                'RGBA' if transparent and 'RGBA' in modes else 'RGB')
+    except Exception:
+        raise ValidationError(INVALID_IMAGE, code='invalid_image')
+    base, _ = os.path.splitext(os.path.basename(upload.name))
+    result = File(tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR),
+                  name=base + extension)
+    image.save(result, settings.IMAGE_FORMAT,
+               quality=settings.IMAGE_QUALITY, optimize=True,
+               progressive=True)
+    result.content_type = content_type
+    result.seek(0)
+    return result
+
+
+def process(upload):
+    """Стадия обработки загруженного изображения: проверка и пересжатие"""
+
+    image = inspect(upload)
+    result = reencode(upload, image)
+    if result is not upload:
+        # у анимированного изображения close() закрыл бы и сам upload
+        image.close()
+    return result
@@ -0,0 +1,279 @@
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter as Tally
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.cache import bump_generation
+from core.db import retry_on_locked
+from core.models import ExplicitCreatedQuerySet
+from posts import counters
+from posts.cache import post_scopes
+from posts.models import Comment, Counter, Post
+from posts.search import get_backend
+from posts.transfer import Importer
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS comments ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, '
+    'author_id INTEGER NOT NULL, text TEXT NOT NULL, created TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS comments_post_author '
+    'ON comments (post_id, author_id)',
+)
+
+_journals = {}
+_journals_lock = threading.Lock()
+_worker = None
+
+
+class CommentJournal:
+    """
+    Локальный журнал комментариев в отдельном файле SQLite. Добавление -
+    одна короткая транзакция в своем файле, которая не ждет блокировку
+    записи основной базы. Номера записей только растут (AUTOINCREMENT),
+    поэтому перенесенную в базу часть журнала задает один номер - отметка.
+    У журнала свой случайный идентификатор: отметка хранится в базе под
+    ключом с ним, и пересозданный журнал не путается с прежним.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = self.connection()
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)',
+                   ('id', uuid.uuid4().hex))
+        self.id = db.execute(
+            "SELECT value FROM meta WHERE key = 'id'").fetchone()[0]
+
+    def connection(self):
+        """Соединение текущего потока: sqlite3 не делит их между потоками"""
+
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            # комментарий, о котором сказали «принят», переживает сбой
+            db.execute('PRAGMA synchronous=FULL')
+            self.local.db = db
+        return db
+
+    def append(self, post_id, author_id, text, created):
+        """Добавляет комментарий, возвращает номер записи"""
+
+        return self.connection().execute(
+            'INSERT INTO comments (post_id, author_id, text, created) '
+            'VALUES (?, ?, ?, ?)',
+            (post_id, author_id, text, created.isoformat())).lastrowid
+
+    def read(self, after, limit):
+        """Записи с номером больше after по порядку"""
+
+        return self.connection().execute(
+            'SELECT id, post_id, author_id, text, created FROM comments '
+            'WHERE id > ? ORDER BY id LIMIT ?', (after, limit)).fetchall()
+
+    def pending(self, post_id, author_id):
+        return self.connection().execute(
+            'SELECT id, text, created FROM comments '
+            'WHERE post_id = ? AND author_id = ? ORDER BY id DESC',
+            (post_id, author_id)).fetchall()
+
+    def discard(self, upto):
+        """Удаляет записи до номера upto включительно"""
+
+        self.connection().execute('DELETE FROM comments WHERE id <= ?',
+                                  (upto,))
+
+    def __len__(self):
+        return self.connection().execute(
+            'SELECT COUNT(*) FROM comments').fetchone()[0]
+
+
+def get_journal():
+    path = settings.COMMENTS_JOURNAL_PATH
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = CommentJournal(path)
+        return _journals[path]
+
+
+def watermark_key(journal):
+    return f'comment_journal.{journal.id}'
+
+
+def watermark(journal):
+    """Номер последней записи журнала, перенесенной в базу"""
+
+    return Counter.objects.filter(key=watermark_key(journal)).values_list(
+        'value', flat=True).first() or 0
+
+
+def advance_watermark(journal, done, last):
+    """
+    Переносит отметку с done на last, только если ее не сдвинул другой
+    процесс. Вызывается в транзакции переноса: UPDATE блокирует строку
+    отметки, и пачку записывает в базу ровно один процесс.
+    """
+
+    key = watermark_key(journal)
+    if Counter.objects.filter(key=key, value=done).update(value=last):
+        return True
+    if done:
+        return False
+    try:
+        with transaction.atomic():
+            Counter.objects.create(key=key, value=last)
+    except IntegrityError:
+        return False
+    return True
+
+
+def submit(post_id, author, text):
+    """
+    Принимает проверенный комментарий в журнал вместо INSERT в базу и
+    запускает фоновый перенос в этом процессе.
+    """
+
+    get_journal().append(post_id, author.id, text, timezone.now())
+    if settings.COMMENTS_FLUSH_INTERVAL:
+        start_worker()
+
+
+def pending_comments(user, post_id):
+    """
+    Комментарии пользователя к посту, которые еще ждут переноса в базу,
+    от новых к старым. Автор видит свой комментарий сразу после отправки
+    в любой сессии, остальные - после переноса. Между записью пачки в
+    базу и очисткой журнала комментарий на мгновение может оказаться и
+    там, и там.
+    """
+
+    if not settings.COMMENTS_WRITE_BEHIND or not user.is_authenticated:
+        return []
+    comments = []
+    for journal_id, text, created in get_journal().pending(post_id,
+                                                           user.id):
+        comment = Comment(post_id=post_id, author=user, text=text,
+                          created=parse_datetime(created))
+        comment.journal_id = journal_id
+        comments.append(comment)
+    return comments
+
+
+def flush(batch_size=None):
+    """
+    Переносит пачку из журнала в базу одним bulk_create. Сигналы при этом
+    не отправляются, поэтому счетчики, поисковый индекс и кеш страниц
+    обновляются здесь же. Отметка сдвигается в той же транзакции, поэтому
+    после сбоя между записью в базу и очисткой журнала пачка не
+    переносится повторно. Комментарии к удаленным за это время постам и
+    от удаленных авторов отбрасываются: иначе вставка пачки падала бы на
+    внешнем ключе при каждой попытке и перенос остановился бы.
+    Возвращает число обработанных записей журнала.
+    """
+
+    journal = get_journal()
+    done = watermark(journal)
+    # перенесенное до сбоя или другим процессом
+    journal.discard(done)
+    rows = journal.read(done, batch_size or settings.COMMENTS_FLUSH_BATCH)
+    if not rows:
+        return 0
+    last = rows[-1][0]
+    posts = {post_id: (author_id, group_id)
+             for post_id, author_id, group_id in Post.objects.filter(
+                 id__in={row[1] for row in rows}).values_list(
+                 'id', 'author_id', 'group_id')}
+    authors = set(User.objects.filter(
+        id__in={row[2] for row in rows}).values_list('id', flat=True))
+    comments = [Comment(post_id=post_id, author_id=author_id, text=text,
+                        created=parse_datetime(created))
+                for _, post_id, author_id, text, created in rows
+                if post_id in posts and author_id in authors]
+
+    @retry_on_locked
+    def write():
+        if not advance_watermark(journal, done, last):
+            return False
+        Importer.assign_ids(Comment, comments)
+        # поток переноса не трогает поля модели: запросы этого процесса
+        # сохраняют комментарии одновременно с ним
+        ExplicitCreatedQuerySet(Comment).bulk_create(comments)
+        get_backend().index_many([], [
+            (comment.id, comment.text, comment.post_id)
+            for comment in comments])
+        counters.incr_many(counters.POST_COMMENTS,
+                           Tally(comment.post_id for comment in comments))
+        return True
+
+    if not write():
+        # пачку перенес другой процесс, отметка уже дальше
+        return flush(batch_size)
+    journal.discard(last)
+    bump_generation(*{scope for comment in comments
+                      for scope in post_scopes(*posts[comment.post_id])})
+    return len(rows)
+
+
+def drain():
+    """Переносит весь журнал, возвращает число записей"""
+
+    total = 0
+    while True:
+        flushed = flush()
+        if not flushed:
+            return total
+        total += flushed
+
+
+def run_worker(interval, stop=None):
+    """
+    Переносит журнал, пока не установлено событие stop: пачка за пачкой,
+    а когда журнал пуст - раз в interval секунд
+    """
+
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            close_old_connections()
+            flushed = flush()
+        except Exception:
+            logger.exception('Ошибка переноса комментариев из журнала')
+            flushed = 0
+        if flushed < settings.COMMENTS_FLUSH_BATCH:
+            stop.wait(interval)
+
+
+def start_worker():
+    """
+    Фоновый поток переноса журнала, один на процесс. Потоки после fork
+    не наследуются, поэтому поток запускается заново в каждом процессе.
+    Несколько процессов переносят один журнал безопасно: пачку записывает
+    тот, кто первым сдвинул отметку.
+    """
+
+    global _worker
+    with _journals_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=run_worker, args=(settings.COMMENTS_FLUSH_INTERVAL,),
+                name='comment-journal', daemon=True)
+            _worker.start()
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import reverse
+
+from core.asgi import ASGIHandler
+from posts.benchmarks import (benchmark_database, heaviest_objects,
+                              seed_dataset, summarize)
+
+WSGI = 'wsgi'
+WSGI_GATHER = 'wsgi_gather'
+ASGI = 'asgi'
+ROUTES = {
+    'posts:index': {},
+    'posts:group_list': {'slug'},
+    'posts:profile': {'username'},
+    'posts:post_detail': {'post_id'},
+}
+
+
+def scope(url):
+    path, _, query = url.partition('?')
+    return {'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': query.encode(),
+            'headers': [(b'host', b'testserver')],
+            'server': ('testserver', 80)}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность и задержку страниц с '
+            'постами под WSGI (синхронные воркеры, запросы страницы по '
+            'очереди и одновременно) и под ASGI при большом числе '
+            'одновременных клиентов и искусственной задержке базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--latency', type=float, default=2,
+                            help='Задержка каждого SQL-запроса, мс')
+        parser.add_argument('--requests', type=int, default=400,
+                            help='Запросов к каждому адресу')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='Одновременных запросов')
+        parser.add_argument('--wsgi-workers', type=int, default=4,
+                            help='Синхронных воркеров WSGI, каждый '
+                                 'обрабатывает один запрос за раз')
+        parser.add_argument('--asgi-threads', type=int, default=32,
+                            help='Потоков пула ASGI')
+        parser.add_argument('--modes', nargs='+',
+                            default=[WSGI, WSGI_GATHER, ASGI],
+                            choices=[WSGI, WSGI_GATHER, ASGI])
+        parser.add_argument('--output', default='bench_asgi.json')
+
+    def handle(self, *args, **options):
+        logging.getLogger('core.metrics').setLevel(logging.WARNING)
+        dataset = {name: options[name] for name in
+                   ('users', 'groups', 'posts', 'comments', 'follows',
+                    'seed')}
+        results = {'dataset': dataset, 'latency_ms': options['latency'],
+                   'requests': options['requests'],
+                   'concurrency': options['concurrency'], 'modes': {}}
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'bench.sqlite3')
+            with benchmark_database(name=name):
+                self.stdout.write('Заполнение базы: ' + ', '.join(
+                    f'{key}={value}' for key, value in dataset.items()))
+                seed_dataset(**dataset)
+                values = heaviest_objects()
+                routes = {
+                    route: reverse(route, kwargs={
+                        key: values[key] for key in keys})
+                    for route, keys in ROUTES.items()
+                }
+                application = WSGIHandler()
+                with self.simulated_latency(options['latency'] / 1000):
+                    for mode in options['modes']:
+                        results['modes'][mode] = self.run_mode(
+                            mode, application, routes, options)
+                connection.close()
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.report(results)
+        self.stdout.write(f'Результат сохранен в {options["output"]}')
+
+    def simulated_latency(self, seconds):
+        """Задержка каждого SQL-запроса во всех соединениях всех потоков"""
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        class SimulatedLatency:
+            def __enter__(self):
+                connection_created.connect(add_delay, weak=False)
+                add_delay(None, connection)
+
+            def __exit__(self, *exc_info):
+                connection_created.disconnect(add_delay)
+                connection.execute_wrappers.remove(delay)
+
+        return SimulatedLatency()
+
+    def run_mode(self, mode, application, routes, options):
+        # CONCURRENT_QUERIES = 0 - запросы страницы по очереди, как раньше
+        concurrent = 0 if mode == WSGI else options['asgi_threads']
+        results = {}
+        with override_settings(CONCURRENT_QUERIES=concurrent):
+            for name, url in routes.items():
+                self.stdout.write(f'{mode}: {name}')
+                if mode == ASGI:
+                    handler = ASGIHandler(application,
+                                          workers=options['asgi_threads'])
+                    results[name] = asyncio.run(
+                        self.load_asgi(handler, url, options))
+                    handler.executor.shutdown(wait=True)
+                else:
+                    results[name] = self.load_wsgi(application, url,
+                                                   options)
+        return results
+
+    def load_wsgi(self, application, url, options):
+        """
+        concurrency клиентов отправляют запросы к wsgi_workers синхронным
+        воркерам, каждый обрабатывает один запрос за раз. Задержка клиента
+        включает ожидание свободного воркера, как в очереди соединений
+        gunicorn.
+        """
+
+        workers = threading.Semaphore(options['wsgi_workers'])
+        remaining = [options['requests']]
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        return
+                    remaining[0] -= 1
+                start = time.perf_counter()
+                status = []
+                with workers:
+                    result = application(
+                        ASGIHandler.environ(scope(url), b''),
+                        lambda code, headers: status.append(code))
+                    try:
+                        b''.join(result)
+                    finally:
+                        result.close()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    errors.append(not status[0].startswith('200'))
+
+        threads = [threading.Thread(target=client)
+                   for _ in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(latencies, sum(errors),
+                         time.perf_counter() - started)
+
+    async def load_asgi(self, handler, url, options):
+        """concurrency одновременных запросов к ASGI-приложению"""
+
+        latencies, errors = [], []
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                status = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b''}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+
+                await handler(scope(url), receive, send)
+                latencies.append(time.perf_counter() - start)
+                errors.append(status[0] != 200)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request()
+                               for _ in range(options['requests'])))
+        return summarize(latencies, sum(errors),
+                         time.perf_counter() - started)
+
+    def report(self, results):
+        for mode, routes in results['modes'].items():
+            self.stdout.write(f'\n{mode}')
+            self.stdout.write(f'{"адрес":<24} {"зап/с":>8} {"p50":>8} '
+                              f'{"p95":>8} {"ошибок":>7}')
+            for name, stats in routes.items():
+                self.stdout.write(
+                    f'{name:<24} {stats["throughput_rps"]:>8} '
+                    f'{stats.get("p50_ms", "-"):>8} '
+                    f'{stats.get("p95_ms", "-"):>8} {stats["errors"]:>7}')
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts import journal
+from posts.benchmarks import benchmark_database, seed_dataset, summarize
+from posts.models import Comment, Post
+
+User = get_user_model()
+
+DIRECT = 'direct'
+WRITE_BEHIND = 'write_behind'
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает устойчивую скорость добавления комментариев к '
+            'одному популярному посту при записи в базу в каждом запросе '
+            'и при отложенной записи через журнал')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8,
+                            help='Одновременных авторов комментариев')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность каждого замера в секундах')
+        parser.add_argument('--flush-interval', type=float, default=0.2)
+        parser.add_argument('--modes', nargs='+',
+                            default=[DIRECT, WRITE_BEHIND],
+                            choices=[DIRECT, WRITE_BEHIND])
+        parser.add_argument('--output', default='bench_comment_writes.json')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('Замер имеет смысл только для SQLite')
+            return
+        logging.getLogger('core.metrics').setLevel(logging.WARNING)
+        results = {'writers': options['writers'],
+                   'duration': options['duration'], 'modes': {}}
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'bench.sqlite3')
+            with benchmark_database(name=name):
+                seed_dataset(users=max(options['writers'], 10), groups=1,
+                             posts=100, comments=0, follows=0)
+                post = Post.objects.first()
+                for mode in options['modes']:
+                    self.stdout.write(f'{mode}: {options["writers"]} '
+                                      f'авторов, {options["duration"]} с')
+                    Comment.objects.all().delete()
+                    with override_settings(
+                            COMMENTS_WRITE_BEHIND=mode == WRITE_BEHIND,
+                            COMMENTS_FLUSH_INTERVAL=0,
+                            COMMENTS_JOURNAL_PATH=os.path.join(
+                                directory, f'{mode}.sqlite3')):
+                        results['modes'][mode] = self.run(post, options)
+                connection.close()
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.report(results)
+        self.stdout.write(f'Результат сохранен в {options["output"]}')
+
+    def run(self, post, options):
+        """
+        Авторы отправляют комментарии без пауз. При отложенной записи
+        журнал переносит поток, как фоновый поток процесса, а после
+        замера оставшееся в журнале дописывается в базу: устойчивая
+        скорость - комментарии в базе за все время, включая дозапись.
+        """
+
+        url = reverse('posts:add_comment', kwargs={'post_id': post.id})
+        users = list(Post.objects.values_list('author', flat=True).distinct())
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def writer(number):
+            client = Client()
+            client.force_login(User.objects.get(
+                pk=users[number % len(users)]))
+            try:
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        response = client.post(url, {'text': 'Комментарий'})
+                        failed = response.status_code != 302
+                    except Exception:
+                        failed = True
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+                        errors.append(failed)
+            finally:
+                connection.close()
+
+        stop = threading.Event()
+        flusher = None
+        if settings.COMMENTS_WRITE_BEHIND:
+            def flush():
+                try:
+                    journal.run_worker(options['flush_interval'], stop)
+                finally:
+                    connection.close()
+
+            flusher = threading.Thread(target=flush)
+            flusher.start()
+        threads = [threading.Thread(target=writer, args=(number,))
+                   for number in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stats = summarize(latencies, sum(errors), elapsed)
+        stats['stored_at_deadline'] = Comment.objects.count()
+        if flusher is not None:
+            stop.set()
+            flusher.join()
+            journal.drain()
+        total = time.perf_counter() - started
+        stats['stored'] = Comment.objects.count()
+        stats['sustained_per_s'] = round(stats['stored'] / total, 1)
+        return stats
+
+    def report(self, results):
+        self.stdout.write(f'{"режим":<14} {"принято/с":>10} '
+                          f'{"в базе/с":>9} {"p50":>8} {"p95":>8} '
+                          f'{"ошибок":>7}')
+        for mode, stats in results['modes'].items():
+            self.stdout.write(
+                f'{mode:<14} {stats["throughput_rps"]:>10} '
+                f'{stats["sustained_per_s"]:>9} '
+                f'{stats.get("p50_ms", "-"):>8} '
+                f'{stats.get("p95_ms", "-"):>8} {stats["errors"]:>7}')
@@ -0,0 +1,121 @@
+import json
+import logging
+import time
+from datetime import timedelta
+from statistics import median
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.asgi import ASGIHandler
+from core.models import ExplicitCreatedQuerySet
+from posts import counters
+from posts.benchmarks import benchmark_database, seed_dataset
+from posts.models import Comment, Post
+from posts.paginators import CursorPage, encode_cursor
+
+ALL = 'all'
+PAGED = 'paged'
+FRAGMENT = 'fragment'
+
+
+class Command(BaseCommand):
+    help = ('Измеряет время до первого байта и размер страницы поста с '
+            'большим числом комментариев: все комментарии сразу, как '
+            'раньше, первая порция и порция «показать еще» из середины '
+            'обсуждения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', default='bench_comments.json')
+
+    def handle(self, *args, **options):
+        logging.getLogger('core.metrics').setLevel(logging.WARNING)
+        with benchmark_database():
+            self.stdout.write(f'Заполнение базы: {options["comments"]} '
+                              f'комментариев к одному посту')
+            seed_dataset(users=options['users'], groups=1, posts=10,
+                         comments=0, follows=0)
+            post = Post.objects.first()
+            self.seed_comments(post, options['comments'])
+            results = {'comments': options['comments'],
+                       'repeat': options['repeat'],
+                       'modes': self.run(post, options)}
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.report(results)
+        self.stdout.write(f'Результат сохранен в {options["output"]}')
+
+    def seed_comments(self, post, number):
+        user_ids = list(Post.objects.values_list('author_id', flat=True))
+        now = timezone.now()
+        ExplicitCreatedQuerySet(Comment).bulk_create(
+            [Comment(post=post, author_id=user_ids[i % len(user_ids)],
+                     text=f'Комментарий {i} ' * 5,
+                     created=now - timedelta(seconds=i))
+             for i in range(number)])
+        counters.incr(counters.POST_COMMENTS, post.id, number)
+
+    def run(self, post, options):
+        detail_url = reverse('posts:post_detail',
+                             kwargs={'post_id': post.id})
+        # курсор порции из середины обсуждения
+        middle = Comment.objects.filter(post=post).order_by(
+            '-created', '-id').values_list('created', 'id')[
+            options['comments'] // 2]
+        fragment_url = reverse('posts:post_comments',
+                               kwargs={'post_id': post.id})
+        fragment_url += '?cursor=' + encode_cursor(CursorPage.NEXT, middle)
+        application = WSGIHandler()
+        results = {}
+        # COMMENTS_ON_PAGE не меньше числа комментариев воспроизводит
+        # прежнюю страницу со всеми комментариями
+        with override_settings(COMMENTS_ON_PAGE=options['comments']):
+            results[ALL] = self.measure(application, detail_url, options)
+        results[PAGED] = self.measure(application, detail_url, options)
+        results[FRAGMENT] = self.measure(application, fragment_url, options)
+        return results
+
+    def measure(self, application, url, options):
+        """
+        Время до первого байта: от вызова WSGI-приложения до получения
+        первого куска тела ответа. Ответ Django рендерится
+        целиком до отдачи, поэтому оно включает запросы к базе и шаблон.
+        """
+
+        path, _, query = url.partition('?')
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query.encode(),
+                 'headers': [(b'host', b'testserver')],
+                 'server': ('testserver', 80)}
+        timings, size = [], 0
+        for _ in range(options['repeat']):
+            status = []
+            start = time.perf_counter()
+            result = application(ASGIHandler.environ(scope, b''),
+                                 lambda code, headers: status.append(code))
+            try:
+                chunks = iter(result)
+                first = next(chunks, b'')
+                timings.append(time.perf_counter() - start)
+                size = len(first) + sum(map(len, chunks))
+            finally:
+                result.close()
+            if not status[0].startswith('200'):
+                raise RuntimeError(f'{url}: {status[0]}')
+        return {'ttfb_p50_ms': round(median(timings) * 1000, 2),
+                'ttfb_max_ms': round(max(timings) * 1000, 2),
+                'bytes': size}
+
+    def report(self, results):
+        self.stdout.write(f'{"режим":<10} {"TTFB p50, мс":>13} '
+                          f'{"max, мс":>9} {"байт":>10}')
+        for mode, stats in results['modes'].items():
+            self.stdout.write(
+                f'{mode:<10} {stats["ttfb_p50_ms"]:>13} '
+                f'{stats["ttfb_max_ms"]:>9} {stats["bytes"]:>10}')
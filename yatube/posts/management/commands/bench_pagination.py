@@ -0,0 +1,53 @@
+from statistics import median
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from posts.benchmarks import benchmark_database, seed_posts, timeit
+from posts.models import Post
+from posts.paginators import CursorPage, encode_cursor
+from posts.views import paginator
+from yatube.settings import POSTS_ON_PAGE
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время выдачи глубоких страниц ленты при пагинации '
+            'по номеру страницы и по курсору на временной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--depths', type=int, nargs='+',
+                            default=[1, 10, 100, 1000, 10000, 50000])
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(f'Заполнение базы: {options["posts"]} постов')
+            seed_posts(options['posts'])
+            self.run(options)
+
+    def run(self, options):
+        factory = RequestFactory()
+        pages = options['posts'] // POSTS_ON_PAGE
+        self.stdout.write(f'{"страница":>10} {"page, мс":>12} '
+                          f'{"cursor, мс":>12}')
+        for depth in options['depths']:
+            if depth > pages:
+                continue
+            # курсор страницы depth - ключ последнего поста предыдущей
+            offset = (depth - 1) * POSTS_ON_PAGE
+            cursor = ''
+            if offset:
+                key = Post.objects.order_by('-created', '-id').values_list(
+                    'created', 'id')[offset - 1]
+                cursor = encode_cursor(CursorPage.NEXT, key)
+            page_request = factory.get('/', {'page': depth})
+            cursor_request = factory.get('/', {'cursor': cursor})
+            by_page = timeit(lambda: list(paginator(
+                page_request, Post.objects.all(), mode='page')),
+                options['repeat'])
+            by_cursor = timeit(lambda: list(paginator(
+                cursor_request, Post.objects.all(), mode='cursor')),
+                options['repeat'])
+            self.stdout.write(f'{depth:>10} {median(by_page) * 1000:>12.2f} '
+                              f'{median(by_cursor) * 1000:>12.2f}')
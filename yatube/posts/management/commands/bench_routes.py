@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter as Tally
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+import posts.urls
+import users.urls
+from posts.benchmarks import (benchmark_database, heaviest_objects,
+                              seed_dataset, summarize)
+from posts.models import Follow, Post
+
+CLIENT = 'client'
+GUNICORN = 'gunicorn'
+
+User = get_user_model()
+
+# длина токена CSRF, который принимает Django
+CSRF_TOKEN_LENGTH = 64
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность и перцентили задержки всех '
+            'адресов posts.urls и users.urls на временной базе со '
+            'сгенерированными данными. Результат сохраняется в JSON для '
+            'сравнения между коммитами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов к каждому адресу')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Неучитываемых запросов перед замером')
+        parser.add_argument('--modes', nargs='+', default=[CLIENT],
+                            choices=[CLIENT, GUNICORN],
+                            help='client - тестовый клиент в процессе, '
+                                 'gunicorn - HTTP к локальному gunicorn')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Параллельных HTTP-клиентов для gunicorn')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Процессов gunicorn')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', default='bench_routes.json')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего замера для сравнения')
+        parser.add_argument('--threshold', type=float, default=20,
+                            help='Рост p95 в процентах, считающийся '
+                                 'регрессией')
+
+    def handle(self, *args, **options):
+        # строка лога на каждый запрос заглушила бы отчет
+        logging.getLogger('core.metrics').setLevel(logging.WARNING)
+        dataset = {name: options[name] for name in
+                   ('users', 'groups', 'posts', 'comments', 'follows',
+                    'seed')}
+        results = {'commit': git_commit(),
+                   'created': timezone.now().isoformat(),
+                   'dataset': dataset, 'requests': options['requests'],
+                   'modes': {}}
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'bench.sqlite3')
+            with benchmark_database(name=name):
+                self.stdout.write('Заполнение базы: ' + ', '.join(
+                    f'{key}={value}' for key, value in dataset.items()))
+                seed_dataset(**dataset)
+                routes = self.routes()
+                for mode in options['modes']:
+                    run = (self.run_client if mode == CLIENT
+                           else self.run_gunicorn)
+                    results['modes'][mode] = run(routes, options)
+                connection.close()
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.report(results)
+        self.stdout.write(f'Результат сохранен в {options["output"]}')
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def routes(self):
+        """
+        Адреса для замера с самыми тяжелыми параметрами (heaviest_objects).
+        Запросы идут от пользователя с наибольшим числом подписок. Адреса
+        записи получают POST с данными формы, редактирование поста - от
+        его автора, иначе замер показал бы только перенаправление. Перед
+        каждым запросом подписки подписка удаляется, перед отпиской -
+        создается, чтобы каждый запрос действительно писал в базу.
+        """
+
+        values = heaviest_objects()
+        user = User.objects.get(pk=Follow.objects.values('user').annotate(
+            total=Count('id')).order_by('-total').values_list(
+            'user', flat=True).first())
+        post = Post.objects.get(pk=values['post_id'])
+        author = User.objects.get(username=values['username'])
+        writes = {
+            'posts:post_edit': {
+                'user': post.author, 'method': 'post',
+                'data': {'text': post.text, 'group': post.group_id or ''}},
+            'posts:add_comment': {
+                'method': 'post', 'data': {'text': 'Комментарий замера'}},
+            'posts:profile_follow': {
+                'prepare': lambda: Follow.objects.filter(
+                    user=user, author=author).delete()},
+            'posts:profile_unfollow': {
+                'prepare': lambda: Follow.objects.get_or_create(
+                    user=user, author=author)},
+        }
+        routes = {}
+        for module in (posts.urls, users.urls):
+            for pattern in module.urlpatterns:
+                kwargs = {name: values[name]
+                          for name in pattern.pattern.converters}
+                name = f'{module.app_name}:{pattern.name}'
+                routes[name] = dict({
+                    'url': reverse(name, kwargs=kwargs), 'user': user,
+                    'method': 'get', 'data': None, 'prepare': None,
+                }, **writes.get(name, {}))
+        return routes
+
+    def run_client(self, routes, options):
+        """Последовательные запросы тестовым клиентом в этом процессе"""
+
+        results = {}
+        for name, route in routes.items():
+            self.stdout.write(f'{CLIENT}: {name}')
+            # свежий клиент на каждый адрес: logout завершает сессию
+            client = Client()
+            client.force_login(route['user'])
+            send = getattr(client, route['method'])
+            for _ in range(options['warmup']):
+                self.prepare(route)
+                send(route['url'], route['data'])
+            latencies, errors, statuses = [], 0, Tally()
+            elapsed = 0.0
+            for _ in range(options['requests']):
+                self.prepare(route)
+                start = time.perf_counter()
+                try:
+                    status = send(route['url'], route['data']).status_code
+                except Exception:
+                    status = None
+                latency = time.perf_counter() - start
+                elapsed += latency
+                latencies.append(latency)
+                statuses[status] += 1
+                if status is None or status >= 500:
+                    errors += 1
+            results[name] = dict(summarize(latencies, errors, elapsed),
+                                 method=route['method'].upper(),
+                                 status=statuses.most_common(1)[0][0])
+        return results
+
+    @staticmethod
+    def prepare(route):
+        # подготовка не входит в замер
+        if route['prepare'] is not None:
+            route['prepare']()
+
+    def run_gunicorn(self, routes, options):
+        """
+        HTTP-запросы из нескольких потоков к gunicorn, запущенному на той
+        же временной базе.
+        """
+
+        env = dict(os.environ, DB_NAME=connection.settings_dict['NAME'],
+                   DB_REPLICAS='', METRICS_LOG_LEVEL='WARNING')
+        address = f'127.0.0.1:{options["port"]}'
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'yatube.wsgi',
+             '--bind', address, '--workers', str(options['workers'])],
+            cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.wait_for(server, options['port'])
+            results = {}
+            for name, route in routes.items():
+                self.stdout.write(f'{GUNICORN}: {name}')
+                results[name] = self.load(f'http://{address}', route,
+                                          options)
+            return results
+        finally:
+            server.terminate()
+            server.wait()
+
+    def wait_for(self, server, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn завершился при запуске')
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError('gunicorn не запустился за отведенное время')
+
+    def load(self, address, route, options):
+        latencies, errors, statuses = [], [], Tally()
+        remaining = [options['requests']]
+        lock = threading.Lock()
+        url = address + route['url']
+
+        def worker():
+            client = Client()
+            client.force_login(route['user'])
+            session = requests.Session()
+            cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+            session.cookies.set(settings.SESSION_COOKIE_NAME, cookie)
+            # сервер проверяет CSRF: токен в cookie и в заголовке совпадают
+            token = get_random_string(CSRF_TOKEN_LENGTH)
+            session.cookies.set(settings.CSRF_COOKIE_NAME, token)
+            session.headers['X-CSRFToken'] = token
+            send = getattr(session, route['method'])
+            for _ in range(options['warmup']):
+                send(url, data=route['data'], allow_redirects=False)
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        return
+                    remaining[0] -= 1
+                    # при нескольких потоках подготовка и запросы других
+                    # потоков могут чередоваться
+                    self.prepare(route)
+                start = time.perf_counter()
+                try:
+                    status = send(url, data=route['data'],
+                                  allow_redirects=False).status_code
+                except requests.RequestException:
+                    status = None
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] += 1
+                    errors.append(status is None or status >= 500)
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return dict(summarize(latencies, sum(errors),
+                              time.perf_counter() - started),
+                    method=route['method'].upper(),
+                    status=statuses.most_common(1)[0][0])
+
+    def report(self, results):
+        for mode, routes in results['modes'].items():
+            self.stdout.write(f'\n{mode}')
+            # метод и самый частый код ответа: 302 у страницы чтения
+            # значит, что замерено только перенаправление
+            self.stdout.write(f'{"адрес":<32} {"запрос":>10} {"зап/с":>8} '
+                              f'{"p50":>8} {"p95":>8} {"p99":>8} '
+                              f'{"ошибок":>7}')
+            for name, stats in routes.items():
+                request = (f'{stats.get("method", "GET")} '
+                           f'{stats.get("status", "-")}')
+                self.stdout.write(
+                    f'{name:<32} {request:>10} '
+                    f'{stats["throughput_rps"]:>8} '
+                    f'{stats.get("p50_ms", "-"):>8} '
+                    f'{stats.get("p95_ms", "-"):>8} '
+                    f'{stats.get("p99_ms", "-"):>8} {stats["errors"]:>7}')
+
+    def compare(self, path, results, threshold):
+        """Сравнивает p95 с предыдущим замером и отмечает регрессии"""
+
+        with open(path) as previous_file:
+            previous = json.load(previous_file)
+        self.stdout.write(f'\nСравнение с {previous.get("commit")} '
+                          f'({path}), p95, мс')
+        regressions = 0
+        for mode, routes in results['modes'].items():
+            old_routes = previous.get('modes', {}).get(mode, {})
+            for name, stats in routes.items():
+                old = old_routes.get(name, {}).get('p95_ms')
+                new = stats.get('p95_ms')
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                mark = ''
+                if change > threshold:
+                    mark = '  регрессия'
+                    regressions += 1
+                self.stdout.write(f'{mode:<9} {name:<32} {old:>8} -> '
+                                  f'{new:>8} {change:>+7.1f}%{mark}')
+        if regressions:
+            raise CommandError(f'Регрессий: {regressions}')
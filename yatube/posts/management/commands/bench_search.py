@@ -0,0 +1,62 @@
+import random
+from statistics import median
+
+from django.core.management.base import BaseCommand
+
+from posts.benchmarks import benchmark_database, seed_posts, timeit
+from posts.search import SimpleSearchBackend, SQLiteFTS5Backend
+from yatube.settings import POSTS_ON_PAGE
+
+SYLLABLES = ('ка', 'ро', 'ми', 'ту', 'ле', 'на', 'со', 'пе', 'ди', 'го',
+             'ва', 'лу', 'зе', 'бо', 'ри', 'ня')
+
+
+def make_vocabulary(size, rng):
+    """Словарь из size псевдослов с частотами по закону Ципфа"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    weights = [1 / rank for rank in range(1, size + 1)]
+    return words, weights
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время поиска по индексу FTS5 и поиска подстрокой '
+            'на временной базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--vocabulary', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        words, weights = make_vocabulary(options['vocabulary'], rng)
+
+        def text(i):
+            return ' '.join(rng.choices(words, weights, k=30))
+
+        with benchmark_database():
+            self.stdout.write(f'Заполнение базы: {options["posts"]} постов')
+            seed_posts(options['posts'], text=text)
+            fts = SQLiteFTS5Backend()
+            fts.rebuild(batch_size=10000)
+            backends = {'fts5': fts, 'like': SimpleSearchBackend()}
+            self.stdout.write(f'{"запрос":>28} {"fts5, мс":>10} '
+                              f'{"like, мс":>10}')
+            # частое, среднее и редкое слово и запрос из двух слов
+            queries = (words[0], words[100], words[5000],
+                       f'{words[10]} {words[200]}')
+            for query in queries:
+                timings = []
+                for backend in backends.values():
+                    def first_page():
+                        results = backend.search(query)
+                        results.count()
+                        return results[:POSTS_ON_PAGE]
+                    timings.append(median(timeit(first_page,
+                                                 options['repeat'])))
+                self.stdout.write(f'{query:>28} {timings[0] * 1000:>10.1f} '
+                                  f'{timings[1] * 1000:>10.1f}')
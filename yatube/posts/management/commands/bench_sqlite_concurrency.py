@@ -0,0 +1,102 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts.benchmarks import benchmark_database, seed_posts
+from posts.models import Post
+
+# настройки SQLite по умолчанию: журнал отката и fsync на каждую транзакцию
+ROLLBACK_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность страниц постов при '
+            'одновременных чтении и записи в SQLite с журналом отката '
+            'и в режиме WAL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность каждого замера в секундах')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('Замер имеет смысл только для SQLite')
+            return
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'bench.sqlite3')
+            with benchmark_database(name=name):
+                self.stdout.write(f'Заполнение базы: {options["posts"]} '
+                                  f'постов')
+                author = seed_posts(options['posts'])
+                post_ids = list(Post.objects.values_list('id', flat=True))
+                self.stdout.write(f'{"режим":>8} {"чтений/с":>10} '
+                                  f'{"записей/с":>10} {"ошибок":>8}')
+                for mode, pragmas in (('DELETE', ROLLBACK_PRAGMAS),
+                                      ('WAL', settings.SQLITE_PRAGMAS)):
+                    # PRAGMA применяются к новым соединениям
+                    connection.close()
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        reads, writes, errors = self.run(
+                            options, author, post_ids)
+                    duration = options['duration']
+                    self.stdout.write(f'{mode:>8} {reads / duration:>10.1f} '
+                                      f'{writes / duration:>10.1f} '
+                                      f'{errors:>8}')
+                connection.close()
+
+    def run(self, options, author, post_ids):
+        deadline = time.monotonic() + options['duration']
+        results = {'read': 0, 'write': 0, 'error': 0}
+        lock = threading.Lock()
+
+        def reader(client):
+            post_id = random.choice(post_ids)
+            return random.choice((
+                lambda: client.get(reverse('posts:index')),
+                lambda: client.get(reverse('posts:post_detail',
+                                           args=[post_id])),
+                lambda: client.get(reverse('posts:profile',
+                                           args=[author.username])),
+            ))()
+
+        def writer(client):
+            return client.post(
+                reverse('posts:add_comment',
+                        args=[random.choice(post_ids)]),
+                {'text': 'Комментарий'})
+
+        def worker(kind, request):
+            client = Client()
+            client.force_login(author)
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        request(client)
+                        outcome = kind
+                    except Exception:
+                        outcome = 'error'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = ([threading.Thread(target=worker, args=('read', reader))
+                    for _ in range(options['readers'])]
+                   + [threading.Thread(target=worker, args=('write', writer))
+                      for _ in range(options['writers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results['read'], results['write'], results['error']
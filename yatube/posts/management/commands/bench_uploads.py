@@ -0,0 +1,203 @@
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from statistics import median
+from unittest import mock
+
+from django import forms
+from django.conf import global_settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.client import (BOUNDARY, MULTIPART_CONTENT, FakePayload,
+                                encode_multipart)
+from django.urls import reverse
+from PIL import Image
+
+from posts import thumbnails
+from posts.benchmarks import benchmark_database
+from posts.models import Post
+
+User = get_user_model()
+
+ORIGINAL = 'original'
+PROCESSED = 'processed'
+
+
+class OriginalPostForm(forms.ModelForm):
+    """Прежняя форма: изображение проверяется Pillow и хранится как есть"""
+
+    class Meta:
+        model = Post
+        fields = ('text', 'group', 'image')
+
+
+def memory_status():
+    """Текущий и пиковый размер резидентной памяти процесса, КБ"""
+
+    status = {}
+    with open('/proc/self/status') as lines:
+        for line in lines:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                status[key] = int(value.split()[0])
+    return status['VmRSS'], status['VmHWM']
+
+
+def reset_peak():
+    """Сбрасывает пик резидентной памяти до текущего значения (Linux)"""
+
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    return memory_status()[0]
+
+
+def measure(func):
+    """Длительность в мс и прирост пика памяти в МБ за вызов func"""
+
+    before = reset_peak()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = memory_status()[1]
+    return result, round(elapsed * 1000, 1), round((peak - before) / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = ('Измеряет время запроса создания поста и пик памяти при '
+            'загрузке большого снимка: прежнее сохранение оригинала и '
+            'обработка с проверкой заголовка и пересжатием. Каждый замер - '
+            'в отдельном процессе. Только Linux: пик памяти читается из '
+            '/proc.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=6000)
+        parser.add_argument('--height', type=int, default=4000)
+        parser.add_argument('--quality', type=int, default=95,
+                            help='Качество JPEG загружаемого снимка')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--modes', nargs='+',
+                            default=[ORIGINAL, PROCESSED],
+                            choices=[ORIGINAL, PROCESSED])
+        parser.add_argument('--output', default='bench_uploads.json')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/clear_refs'):
+            self.stderr.write('Нужен Linux с /proc/self/clear_refs')
+            return
+        logging.getLogger('core.metrics').setLevel(logging.WARNING)
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            photo = os.path.join(directory, 'photo.jpg')
+            self.make_photo(photo, options)
+            results = {'width': options['width'],
+                       'height': options['height'],
+                       'upload_bytes': os.path.getsize(photo), 'modes': {}}
+            self.stdout.write(f'Снимок {options["width"]}x'
+                              f'{options["height"]}: '
+                              f'{results["upload_bytes"]} байт')
+            media_root = os.path.join(directory, 'media')
+            with benchmark_database(name=os.path.join(directory,
+                                                      'bench.sqlite3')), \
+                    override_settings(MEDIA_ROOT=media_root):
+                User.objects.create_user(username='bench_author')
+                for mode in options['modes']:
+                    runs = []
+                    for _ in range(options['repeat']):
+                        # соединение с базой не должно переходить в
+                        # дочерний процесс
+                        connection.close()
+                        queue = context.Queue()
+                        process = context.Process(
+                            target=self.run, args=(mode, photo, queue))
+                        process.start()
+                        runs.append(queue.get())
+                        process.join()
+                    results['modes'][mode] = self.aggregate(runs)
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.report(results)
+        self.stdout.write(f'Результат сохранен в {options["output"]}')
+
+    def make_photo(self, path, options):
+        """Снимок с шумом, который плохо сжимается, и EXIF, как с телефона"""
+
+        size = (options['width'], options['height'])
+        noise = Image.effect_noise(size, 48)
+        gradient = Image.linear_gradient('L').resize(size)
+        exif = Image.Exif()
+        exif[0x010F] = 'Phone'
+        exif[0x0112] = 1
+        Image.merge('RGB', (noise, gradient, noise)).save(
+            path, 'JPEG', quality=options['quality'], exif=exif)
+
+    def run(self, mode, photo, queue):
+        """
+        Один замер в дочернем процессе: тело запроса готовится заранее,
+        затем отдельно измеряются запрос создания поста (разбор тела,
+        проверка формы, сохранение файла) и нарезка копий, которая
+        выполняется фоновой задачей.
+        """
+
+        try:
+            client = Client()
+            client.force_login(User.objects.get(username='bench_author'))
+            with open(photo, 'rb') as image:
+                body = encode_multipart(BOUNDARY, {'text': 'Снимок',
+                                                   'image': image})
+            environ = client._base_environ(
+                REQUEST_METHOD='POST', PATH_INFO=reverse('posts:post_create'),
+                CONTENT_TYPE=MULTIPART_CONTENT,
+                CONTENT_LENGTH=str(len(body)))
+            environ['wsgi.input'] = FakePayload(body)
+            del body
+            with ExitStack() as stack:
+                if mode == ORIGINAL:
+                    # прежние обработчики: файл до 2,5 МБ читается в память
+                    stack.enter_context(override_settings(
+                        FILE_UPLOAD_HANDLERS=(
+                            global_settings.FILE_UPLOAD_HANDLERS)))
+                    stack.enter_context(mock.patch('posts.views.PostForm',
+                                                   OriginalPostForm))
+                response, request_ms, request_mb = measure(
+                    lambda: client.handler(environ))
+            if response.status_code != 302:
+                raise RuntimeError(f'{mode}: {response.status_code}')
+            post = Post.objects.latest('id')
+            _, renditions_ms, renditions_mb = measure(
+                lambda: thumbnails.make_renditions(post.id))
+            queue.put({'request_ms': request_ms, 'request_mb': request_mb,
+                       'renditions_ms': renditions_ms,
+                       'renditions_mb': renditions_mb,
+                       'stored_bytes': post.image.size})
+        finally:
+            connection.close()
+
+    def aggregate(self, runs):
+        """Медиана времени и наибольший пик памяти по повторам"""
+
+        return {
+            'request_ms': round(median(run['request_ms'] for run in runs), 1),
+            'request_peak_mb': max(run['request_mb'] for run in runs),
+            'renditions_ms': round(
+                median(run['renditions_ms'] for run in runs), 1),
+            'renditions_peak_mb': max(run['renditions_mb'] for run in runs),
+            'stored_bytes': runs[-1]['stored_bytes'],
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"режим":<10} {"запрос, мс":>11} '
+                          f'{"пик, МБ":>8} {"копии, мс":>10} '
+                          f'{"пик, МБ":>8} {"хранится, байт":>15}')
+        for mode, stats in results['modes'].items():
+            self.stdout.write(
+                f'{mode:<10} {stats["request_ms"]:>11} '
+                f'{stats["request_peak_mb"]:>8} '
+                f'{stats["renditions_ms"]:>10} '
+                f'{stats["renditions_peak_mb"]:>8} '
+                f'{stats["stored_bytes"]:>15}')
@@ -0,0 +1,118 @@
+import re
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts.benchmarks import benchmark_database
+from posts.models import Comment, Follow, Group, Post
+from yatube.settings import POSTS_ON_PAGE
+
+User = get_user_model()
+
+# полный просмотр таблицы (без индекса) и сортировка во временном B-дереве
+FULL_SCAN_RE = re.compile(r'^SCAN (?!.*\bUSING\b)(?!.*VIRTUAL TABLE)'
+                          r'(?!\(?SUBQUERY)')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE')
+
+
+class Command(BaseCommand):
+    help = ('Выполняет запросы всех страниц с постами на временной базе, '
+            'проверяет их планы EXPLAIN QUERY PLAN и завершается с ошибкой, '
+            'если запрос просматривает таблицу целиком или сортирует '
+            'результат во временном B-дереве')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Проверка планов поддерживается только для '
+                               'SQLite')
+        with benchmark_database():
+            urls = self.prepare()
+            problems = []
+            for mode in ('page', 'cursor'):
+                with override_settings(POSTS_PAGINATION=mode):
+                    for url, client in urls:
+                        problems += self.check_url(url, client, mode)
+        if problems:
+            for url, mode, sql, detail in problems:
+                self.stderr.write(f'{url} [{mode}]: {detail}\n    {sql}')
+            raise CommandError(f'Запросов с неудачным планом: '
+                               f'{len(problems)}')
+        self.stdout.write('Все запросы используют индексы')
+
+    def prepare(self):
+        """
+        Создает данные, при которых страницы выполняют все запросы.
+        Возвращает адреса страниц с клиентом, которому страница доступна:
+        редактирование поста открывается только автору
+        """
+
+        author = User.objects.create_user(username='plan_author')
+        reader = User.objects.create_user(username='plan_reader')
+        group = Group.objects.create(title='Plan', slug='plan',
+                                     description='plan')
+        Follow.objects.create(user=reader, author=author)
+        posts = [Post.objects.create(author=author, group=group,
+                                     text=f'Plan post {i}')
+                 for i in range(POSTS_ON_PAGE + 1)]
+        Comment.objects.create(post=posts[0], author=reader, text='Plan')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        author_client = Client()
+        author_client.force_login(author)
+        return [
+            (reverse('posts:index'), reader_client),
+            (reverse('posts:group_list', kwargs={'slug': group.slug}),
+             reader_client),
+            (reverse('posts:profile', kwargs={'username': author.username}),
+             reader_client),
+            (reverse('posts:post_detail', kwargs={'post_id': posts[0].id}),
+             reader_client),
+            (reverse('posts:post_edit', kwargs={'post_id': posts[0].id}),
+             author_client),
+            (reverse('posts:post_create'), reader_client),
+            (reverse('posts:follow_index'), reader_client),
+        ]
+
+    def check_url(self, url, client, mode):
+        # первый запрос прогревает счетчики и кеши, проверяется второй и
+        # переход на следующую страницу
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            # запросы без условий и сортировки (например, все группы для
+            # выбора в форме) читают таблицу целиком намеренно
+            statement = sql.lstrip().upper()
+            if statement.startswith('SELECT') and (
+                    ' WHERE ' in statement or ' ORDER BY ' in statement):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        first = client.get(url)
+        if first.status_code != HTTPStatus.OK:
+            # перенаправление не выполняет запросы самой страницы
+            return [(url, mode, '', f'ответ {first.status_code}')]
+        page_obj = first.context and first.context.get('page_obj')
+        next_url = None
+        if page_obj is not None and page_obj.has_next():
+            if mode == 'cursor':
+                next_url = f'{url}?cursor={page_obj.next_cursor}'
+            else:
+                next_url = f'{url}?page={page_obj.next_page_number()}'
+        with connection.execute_wrapper(capture):
+            client.get(url)
+            if next_url:
+                client.get(next_url)
+        problems = []
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    if FULL_SCAN_RE.search(detail) or TEMP_SORT_RE.search(
+                            detail):
+                        problems.append((url, mode, sql, detail))
+        return problems
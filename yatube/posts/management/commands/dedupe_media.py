@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+from collections import Counter as Tally
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from core.cache import bump_generation
+from posts import counters
+from posts.cache import GROUPS_SCOPE
+from posts.models import Post
+from posts.storage import content_name, file_digest, is_content_addressed
+from posts.thumbnails import rendition_name
+
+# прежние имена файлов, которые удаляются после подтверждения транзакции
+MANIFEST_NAME = '.dedupe_media.json'
+
+
+def link(source, target):
+    """Жесткая ссылка на файл, на другой файловой системе - копия"""
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_image(name):
+    """Удаляет файл изображения вместе с нарезанными копиями"""
+
+    remove(os.path.join(settings.MEDIA_ROOT, name))
+    for size in settings.THUMBNAIL_RENDITIONS:
+        remove(os.path.join(settings.MEDIA_ROOT, rendition_name(name, size)))
+
+
+def manifest_path():
+    return os.path.join(settings.MEDIA_ROOT, MANIFEST_NAME)
+
+
+def write_manifest(names):
+    """Записывает список целиком или не записывает вовсе"""
+
+    path = manifest_path()
+    with open(path + '.tmp', 'w') as manifest:
+        json.dump(sorted(names), manifest)
+        manifest.flush()
+        os.fsync(manifest.fileno())
+    os.replace(path + '.tmp', path)
+
+
+class Command(BaseCommand):
+    help = ('Переводит изображения постов, сохраненные до хранилища с '
+            'адресацией по содержимому, на имена по хешу: одинаковые '
+            'файлы остаются одной копией вместе с нарезанными копиями. '
+            'Хеши считаются параллельно на всех ядрах процессора.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, ничего не менять')
+
+    def handle(self, *args, **options):
+        # order_by() убирает сортировку модели из GROUP BY
+        uses = {name: total for name, total in Post.objects.exclude(
+            image='').order_by().values_list('image').annotate(
+            total=Count('id')) if not is_content_addressed(name)}
+        names = sorted(uses)
+        self.stats = Tally()
+        self.digests = set()
+        if not options['dry_run']:
+            self.remove_pending()
+        with ProcessPoolExecutor(options['workers']) as pool:
+            for start in range(0, len(names), options['batch_size']):
+                batch = names[start:start + options['batch_size']]
+                paths = [os.path.join(settings.MEDIA_ROOT, name)
+                         for name in batch]
+                # отсутствующий файл не останавливает остальные
+                futures = [pool.submit(file_digest, path) for path in paths]
+                digests = {}
+                for name, future in zip(batch, futures):
+                    try:
+                        digests[name] = future.result()
+                    except OSError as error:
+                        self.stderr.write(f'{name}: {error}')
+                        self.stats['failed'] += 1
+                self.process(digests, uses, options['dry_run'])
+        if not options['dry_run'] and self.stats['files']:
+            # адреса изображений изменились на всех страницах со списками
+            bump_generation(GROUPS_SCOPE)
+        self.stdout.write(
+            f'Файлов: {self.stats["files"]}, уникальных: '
+            f'{len(self.digests)}, освобождено байт: '
+            f'{self.stats["freed_bytes"]}, с ошибками: '
+            f'{self.stats["failed"]}')
+
+    def remove_pending(self):
+        """
+        Удаляет прежние файлы, оставшиеся от прерванного запуска: их
+        список записывается до транзакции пачки. Файлы, на которые еще
+        ссылаются посты (транзакция не подтвердилась), остаются.
+        """
+
+        try:
+            with open(manifest_path()) as manifest:
+                names = json.load(manifest)
+        except FileNotFoundError:
+            return
+        used = set(Post.objects.filter(image__in=names).values_list(
+            'image', flat=True))
+        for name in names:
+            if name not in used:
+                remove_image(name)
+        remove(manifest_path())
+
+    def process(self, digests, uses, dry_run):
+        """
+        Переводит пачку файлов на имена по хешу. Сначала под новым именем
+        появляется ссылка на файл, затем в одной транзакции меняются
+        посты и счетчики использований, и только после этого удаляются
+        прежние файлы. Их список записывается на диск до транзакции, и
+        если процесс прервется после нее, файлы удалит следующий запуск:
+        прерванный перевод можно просто запустить снова.
+        """
+
+        moves = {}
+        for name, digest in digests.items():
+            directory = os.path.dirname(name)
+            extension = os.path.splitext(name)[1]
+            target = content_name(directory, digest, extension)
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            target_path = os.path.join(settings.MEDIA_ROOT, target)
+            self.stats['files'] += 1
+            if digest in self.digests or os.path.exists(target_path):
+                self.stats['freed_bytes'] += os.path.getsize(path)
+            self.digests.add(digest)
+            moves[name] = target
+            if dry_run:
+                continue
+            link(path, target_path)
+            for size in settings.THUMBNAIL_RENDITIONS:
+                rendition = os.path.join(settings.MEDIA_ROOT,
+                                         rendition_name(name, size))
+                if os.path.exists(rendition):
+                    link(rendition, os.path.join(
+                        settings.MEDIA_ROOT, rendition_name(target, size)))
+        if dry_run:
+            return
+        write_manifest(moves)
+        with transaction.atomic():
+            for name, target in moves.items():
+                renditions = {
+                    size: rendition_name(target, size)
+                    for size in settings.THUMBNAIL_RENDITIONS
+                    if os.path.exists(os.path.join(
+                        settings.MEDIA_ROOT, rendition_name(target, size)))}
+                Post.objects.filter(image=name).update(
+                    image=target, renditions=json.dumps(renditions)
+                    if renditions else '')
+            added = Tally()
+            for name, target in moves.items():
+                added[target] += uses[name]
+            counters.incr_many(counters.IMAGE_USES, added)
+        for name in moves:
+            remove_image(name)
+        remove(manifest_path())
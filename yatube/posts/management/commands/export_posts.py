@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import (FORMATS, export_records, guess_format,
+                            write_records)
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты с комментариями в NDJSON или CSV. Таблицы '
+            'читаются курсором, память не зависит от их размера')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Файл или - для stdout')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='По умолчанию - по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or guess_format(path)
+        records = export_records(chunk_size=options['chunk_size'])
+        if path == '-':
+            written = write_records(records, sys.stdout, fmt)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                written = write_records(records, output, fmt)
+        self.stderr.write(f'Выгружено постов: {written}')
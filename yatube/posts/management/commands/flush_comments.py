@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import journal
+
+
+class Command(BaseCommand):
+    help = ('Переносит комментарии из журнала отложенной записи в базу. '
+            'С --watch работает постоянно, как фоновый поток переноса, '
+            'в отдельном процессе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true')
+        parser.add_argument('--interval', type=float,
+                            default=settings.COMMENTS_FLUSH_INTERVAL or 1)
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            journal.run_worker(options['interval'])
+        flushed = journal.drain()
+        self.stdout.write(f'Перенесено записей журнала: {flushed}, '
+                          f'осталось: {len(journal.get_journal())}')
@@ -0,0 +1,44 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import FORMATS, Importer, guess_format, read_records
+
+
+class Command(BaseCommand):
+    help = ('Загружает посты с комментариями из NDJSON или CSV пачками '
+            'через bulk_create. Отсутствующие авторы и группы создаются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл или - для stdin')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--media-source',
+                            help='Каталог, из которого копируются '
+                                 'изображения постов в MEDIA_ROOT')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Потоков копирования изображений')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        fmt = options['format'] or guess_format(path)
+        importer = Importer(batch_size=options['batch_size'],
+                            media_source=options['media_source'],
+                            workers=options['workers'])
+        start = time.perf_counter()
+        if path == '-':
+            stats = importer.run(read_records(sys.stdin, fmt))
+        else:
+            with open(path, encoding='utf-8', newline='') as source:
+                stats = importer.run(read_records(source, fmt))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'Загружено постов: {stats["posts"]}, комментариев: '
+            f'{stats["comments"]}, создано пользователей: '
+            f'{stats["created_users"]}, групп: {stats["created_groups"]} '
+            f'за {elapsed:.1f} с ({stats["posts"] / elapsed:.0f} постов/с)')
+        if stats['posts'] and options['media_source']:
+            self.stdout.write('Копии изображений для страниц создаст '
+                              'команда regenerate_thumbnails')
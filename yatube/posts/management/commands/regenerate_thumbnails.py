@@ -0,0 +1,62 @@
+import json
+import os
+from collections import Counter as Tally
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.cache import bump_generation
+from posts import thumbnails
+from posts.cache import GROUPS_SCOPE
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Заново нарезает копии изображений всех постов, используя все '
+            'ядра процессора')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        render = partial(thumbnails.render, settings.MEDIA_ROOT,
+                         sizes=settings.THUMBNAIL_RENDITIONS, force=True)
+        # один файл используют многие посты (posts.storage): каждое
+        # изображение нарезается один раз, а копии записываются во все
+        # посты с ним
+        images = Post.objects.exclude(image='').order_by(
+            'image').values_list('image', flat=True).distinct()
+        batch_size = options['batch_size']
+        self.stats = Tally()
+        with ProcessPoolExecutor(options['workers']) as pool:
+            batch = []
+            for image in images.iterator(chunk_size=batch_size):
+                batch.append(image)
+                if len(batch) >= batch_size:
+                    self.process(pool, render, batch)
+                    batch = []
+            self.process(pool, render, batch)
+        # копии видны на всех страницах со списками постов
+        bump_generation(GROUPS_SCOPE)
+        self.stdout.write(f'Обработано изображений: {self.stats["images"]}, '
+                          f'постов: {self.stats["posts"]}, '
+                          f'с ошибками: {self.stats["failed"]}')
+
+    def process(self, pool, render, batch):
+        futures = [(image, pool.submit(render, image)) for image in batch]
+        renditions = {}
+        for image, future in futures:
+            try:
+                renditions[image] = json.dumps(future.result())
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{image}: {error}')
+                self.stats['failed'] += 1
+        posts = [Post(pk=post_id, renditions=renditions[image])
+                 for post_id, image in Post.objects.filter(
+                     image__in=renditions).values_list('pk', 'image')]
+        Post.objects.bulk_update(posts, ['renditions'])
+        self.stats['images'] += len(renditions)
+        self.stats['posts'] += len(posts)
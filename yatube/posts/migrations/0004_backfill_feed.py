@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# число последних постов автора в ленте новой подписки на момент
+# миграции: значение зафиксировано, чтобы миграция не зависела от
+# настроек
+BACKFILL_SIZE = 1000
+
+
+def backfill_feed(apps, schema_editor):
+    """Заполняет ленты по уже существующим подпискам"""
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    FeedEntry = apps.get_model('posts', 'FeedEntry')
+    for user_id, author_id in Follow.objects.values_list(
+            'user_id', 'author_id').iterator():
+        posts = Post.objects.filter(author_id=author_id).order_by(
+            '-created', '-id').values_list('id', 'created')
+        FeedEntry.objects.bulk_create(
+            [FeedEntry(user_id=user_id, post_id=post_id, author_id=author_id,
+                       created=created)
+             for post_id, created in posts[:BACKFILL_SIZE]],
+            # без batch_size: Django сам делит вставку под ограничения
+            # базы, на SQLite - не больше 500 строк в запросе
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_feedentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_feed, migrations.RunPython.noop),
+    ]
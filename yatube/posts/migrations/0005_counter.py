@@ -0,0 +1,20 @@
+# Generated by Django 2.2.27 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_backfill_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+        ),
+    ]
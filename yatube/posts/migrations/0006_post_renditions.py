@@ -0,0 +1,18 @@
+# Generated by Django 2.2.27 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='renditions',
+            field=models.TextField(blank=True, editable=False, help_text='Имена заранее нарезанных копий изображения в формате JSON', verbose_name='Копии изображения'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_search_index USING fts5(
+    text, post_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+# rowid поста - 2 * id, rowid комментария - 2 * id + 1
+FILL_INDEX = (
+    "INSERT INTO posts_search_index (rowid, text, post_id) "
+    "SELECT id * 2, text, id FROM posts_post",
+    "INSERT INTO posts_search_index (rowid, text, post_id) "
+    "SELECT id * 2 + 1, text, post_id FROM posts_comment",
+)
+
+
+def create_search_index(apps, schema_editor):
+    """Полнотекстовый индекс FTS5 создается только на SQLite"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    for sql in FILL_INDEX:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS posts_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import models
 
 from core.models import CreateModel
+from posts.storage import image_storage
+from posts.thumbnails import rendition_url
 
 User = get_user_model()
 
@@ -20,32 +23,84 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Посты для страниц со списками и страницы поста: автор и группа
+        подгружаются одним запросом, выбираются только поля, которые
+        используют шаблоны.
+        """
+        return self.select_related('author', 'group').only(
+            'id', 'created', 'image', 'renditions', 'text', 'author', 'group',
+            'author__username', 'author__first_name', 'author__last_name',
+            'group__title', 'group__slug',
+        )
+
+
+class CommentQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Комментарии к посту вместе с именем автора одним запросом"""
+        return self.select_related('author').only(
+            'id', 'created', 'text', 'post', 'author', 'author__username',
+        )
+
+
 class Post(CreateModel):
     image = models.ImageField(verbose_name='Картинка', upload_to='posts/',
-                              blank=True, help_text='Изображение поста')
+                              storage=image_storage, blank=True,
+                              help_text='Изображение поста')
     text = models.TextField(verbose_name='Текст поста',
                             help_text='Текст нового поста')
+    # одиночные индексы по автору и группе не нужны: их заменяют
+    # составные индексы из Meta
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
-                               related_name='posts')
+                               related_name='posts',
+                               db_index=False)
     group = models.ForeignKey(Group, on_delete=models.SET_NULL, blank=True,
                               null=True, verbose_name='Группа',
-                              related_name='posts',
+                              related_name='posts', db_index=False,
                               help_text='Группа, к которой будет относиться '
                                         'пост')
+    renditions = models.TextField(verbose_name='Копии изображения',
+                                  blank=True, editable=False,
+                                  help_text='Имена заранее нарезанных копий '
+                                            'изображения в формате JSON')
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            # ключ пагинации по курсору (created, id)
+            models.Index(fields=['-created', '-id'],
+                         name='post_created_id_idx'),
+            # списки постов автора и группы, новые сверху. id в индексе
+            # нужен для сортировки по ключу (created, id) без временного
+            # B-дерева
+            models.Index(fields=['author', '-created', '-id'],
+                         name='post_author_created_idx'),
+            models.Index(fields=['group', '-created', '-id'],
+                         name='post_group_created_idx'),
+            # посты с тем же файлом изображения: готовые копии и проверка
+            # перед удалением файла
+            models.Index(fields=['image'], name='post_image_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    @property
+    def thumbnail_url(self):
+        """Адрес копии изображения для страниц со списками постов"""
+        return rendition_url(self.renditions, settings.THUMBNAIL_LISTING_SIZE)
+
 
 class Comment(CreateModel):
     post = models.ForeignKey(Post,
                              verbose_name='Пост',
                              on_delete=models.CASCADE, related_name='comments',
-                             help_text='Пост')
+                             help_text='Пост', db_index=False)
     author = models.ForeignKey(User,
                                verbose_name='Пользователь',
                                on_delete=models.CASCADE,
@@ -54,29 +109,47 @@ class Comment(CreateModel):
     text = models.TextField(verbose_name='Текст комментария',
                             help_text='Текст нового комментария')
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            # комментарии к посту, новые сверху
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_idx'),
+            # список комментариев в админке и иерархия по датам
+            models.Index(fields=['-created', '-id'],
+                         name='comment_created_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.author} / {self.text}'
 
 
 class Follow(models.Model):
+    # поиск по пользователю обслуживает уникальный индекс (user, author),
+    # поиск по автору - индекс (author, user)
     user = models.ForeignKey(User,
                              verbose_name='Пользователь',
                              related_name='follower',
                              on_delete=models.CASCADE,
-                             help_text='Пользователь')
+                             help_text='Пользователь',
+                             db_index=False)
     author = models.ForeignKey(User,
                                verbose_name='Автор постов',
                                related_name='following',
                                on_delete=models.CASCADE,
-                               help_text='Автор постов')
+                               help_text='Автор постов',
+                               db_index=False)
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=['user', 'author'],
                                                name='unique_following_author')
                        ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
 
     def clean(self):
         if self.user == self.author:
@@ -85,3 +158,54 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'Пользователь: {self.user} / Автор: {self.author}'
+
+
+class FeedEntry(models.Model):
+    """
+    Запись материализованной ленты подписок: пост автора, на которого
+    подписан пользователь. Дата создания копируется из поста, чтобы лента
+    читалась и сортировалась по одному индексу (user, created).
+    """
+    user = models.ForeignKey(User,
+                             verbose_name='Пользователь',
+                             related_name='feed_entries',
+                             on_delete=models.CASCADE,
+                             db_index=False)
+    post = models.ForeignKey(Post,
+                             verbose_name='Пост',
+                             related_name='feed_entries',
+                             on_delete=models.CASCADE)
+    author = models.ForeignKey(User,
+                               verbose_name='Автор постов',
+                               related_name='+',
+                               on_delete=models.CASCADE)
+    created = models.DateTimeField(verbose_name='Дата создания поста')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'post'],
+                                               name='unique_feed_entry')
+                       ]
+        indexes = [
+            models.Index(fields=['user', '-created', '-post'],
+                         name='feed_user_created_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'Пользователь: {self.user_id} / Пост: {self.post_id}'
+
+
+class Counter(models.Model):
+    """
+    Денормализованный счетчик: количество постов на сайте, в группе и у
+    автора, комментариев к посту, подписчиков автора, постов с файлом
+    изображения. Обновляется атомарно выражениями F() при создании и
+    удалении объектов.
+    """
+    key = models.CharField(verbose_name='Ключ', max_length=100,
+                           primary_key=True)
+    value = models.BigIntegerField(verbose_name='Значение', default=0)
+
+    def __str__(self):
+        return f'{self.key}: {self.value}'
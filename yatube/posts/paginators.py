@@ -0,0 +1,285 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, values):
+    """
+    Кодирует направление и значения ключа в непрозрачную строку курсора.
+    Даты сериализуются в ISO-формат, ORM сам приводит их обратно к нужному
+    типу при фильтрации.
+    """
+
+    values = [value.isoformat() if isinstance(value, datetime) else value
+              for value in values]
+    raw = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Раскодирует курсор. Возвращает пару (направление, значения ключа)"""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(
+            base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if direction not in (CursorPage.NEXT, CursorPage.PREVIOUS) or not (
+            isinstance(values, list)):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class CountedPaginator(Paginator):
+    """
+    Пагинатор по номеру страницы, которому общее количество элементов
+    передается заранее (из денормализованного счетчика), без COUNT(*).
+    """
+
+    def __init__(self, object_list, per_page, total=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.total = total
+
+    @cached_property
+    def count(self):
+        if self.total is not None:
+            return self.total
+        return super().count
+
+
+def estimate_count(queryset):
+    """
+    Приблизительное количество строк кверисета или None, если оценить его
+    нельзя. PostgreSQL берет оценку из плана запроса. Для кверисета без
+    условий на других базах оценкой служит разброс первичных ключей: MIN и
+    MAX читаются из индекса, удаленные строки не вычитаются.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
+    if queryset.query.where:
+        return None
+    bounds = queryset.model._default_manager.using(queryset.db).aggregate(
+        first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return 0
+    return bounds['last'] - bounds['first'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц. Количество до threshold считается точно
+    запросом COUNT с LIMIT, больше - оценивается через estimate_count, и
+    только если оценка невозможна, выполняется полный COUNT(*).
+    """
+
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        bounded = self.object_list.order_by()[:self.threshold + 1].count()
+        if bounded <= self.threshold:
+            return bounded
+        estimate = estimate_count(self.object_list)
+        if estimate is None:
+            return super().count
+        return max(estimate, bounded)
+
+
+class CursorPaginator:
+    """
+    Пагинатор по ключу (keyset pagination). Вместо OFFSET и COUNT(*)
+    страница выбирается условием «строго после/до ключа» по полям сортировки,
+    поэтому стоимость запроса не зависит от глубины страницы. Ключом служит
+    явная сортировка кверисета, а без нее пара (created, id). Последнее поле
+    ключа должно быть уникальным.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        if ordering is None:
+            ordering = object_list.query.order_by or ('-created', '-id')
+        self.ordering = tuple(ordering)
+        self.fields = tuple(field.lstrip('-') for field in self.ordering)
+
+    def get_page(self, cursor):
+        """
+        Возвращает страницу по курсору. Пустой или некорректный курсор
+        возвращает первую страницу.
+        """
+
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
+
+    def page(self, cursor):
+        if not cursor:
+            return CursorPage(self, CursorPage.NEXT, None)
+        direction, values = decode_cursor(cursor)
+        if len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        return CursorPage(self, direction, self.clean(cursor, values))
+
+    def clean(self, cursor, values):
+        """
+        Приводит значения ключа из курсора к типам полей сортировки.
+        Курсор приходит от клиента, поэтому значение не того типа или
+        None - некорректный курсор, а не ошибка в запросе к базе.
+        """
+
+        cleaned = []
+        for name, value in zip(self.fields, values):
+            try:
+                value = self.model_field(name).to_python(value)
+            except (ValidationError, TypeError, ValueError):
+                raise InvalidCursor(cursor)
+            if value is None:
+                raise InvalidCursor(cursor)
+            cleaned.append(value)
+        return cleaned
+
+    def model_field(self, name):
+        """
+        Поле по имени поля сортировки: поле модели, в том числе через __,
+        или тип аннотации кверисета
+        """
+
+        annotation = self.object_list.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        opts = self.object_list.model._meta
+        for part in name.split('__'):
+            field = opts.get_field(part)
+            if field.is_relation:
+                opts = field.related_model._meta
+        return field
+
+    def key(self, item):
+        """Значения ключа пагинации для элемента (модель или словарь)"""
+
+        if isinstance(item, dict):
+            return [item[field] for field in self.fields]
+        return [getattr(item, field) for field in self.fields]
+
+    def _boundary(self, values, forward):
+        # Для сортировки (a, b) условие «после ключа» раскрывается в
+        # a > va OR (a = va AND b > vb) с учетом направления каждого поля.
+        # Нестрогая граница по первому полю дает базе диапазон по индексу,
+        # без нее условие с OR приводит к полному просмотру таблицы
+        condition = Q()
+        equal = {}
+        for ordering, field, value in zip(self.ordering, self.fields, values):
+            descending = ordering.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        descending = self.ordering[0].startswith('-')
+        lookup = 'lte' if descending == forward else 'gte'
+        return Q(**{f'{self.fields[0]}__{lookup}': values[0]}) & condition
+
+    def _reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}'
+                     for field in self.ordering)
+
+    def fetch(self, direction, values):
+        """
+        Выбирает на один элемент больше размера страницы, чтобы без COUNT
+        узнать, есть ли страница дальше в направлении движения.
+        """
+
+        forward = direction == CursorPage.NEXT
+        items = self.object_list
+        if values is not None:
+            items = items.filter(self._boundary(values, forward))
+        ordering = self.ordering if forward else self._reversed_ordering()
+        items = list(items.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if not forward:
+            items.reverse()
+        return items, has_more
+
+
+class CursorPage(Sequence):
+    """
+    Страница пагинатора по ключу. Запрос к базе выполняется лениво, при
+    первом обращении к элементам или навигации.
+    """
+
+    NEXT = 'n'
+    PREVIOUS = 'p'
+    is_cursor = True
+
+    def __init__(self, paginator, direction, values):
+        self.paginator = paginator
+        self.direction = direction
+        self.values = values
+        self._items = None
+        self._has_more = False
+
+    def __repr__(self):
+        return f'<Cursor page {self.direction} {self.values}>'
+
+    def _fetch(self):
+        if self._items is None:
+            self._items, self._has_more = self.paginator.fetch(
+                self.direction, self.values)
+        return self._items
+
+    @property
+    def object_list(self):
+        return self._fetch()
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __getitem__(self, index):
+        return self._fetch()[index]
+
+    def has_next(self):
+        self._fetch()
+        if self.direction == self.NEXT:
+            return self._has_more
+        return self.values is not None
+
+    def has_previous(self):
+        self._fetch()
+        if self.direction == self.PREVIOUS:
+            return self._has_more
+        return self.values is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next() or not self._items:
+            return None
+        return encode_cursor(self.NEXT, self.paginator.key(self._items[-1]))
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous() or not self._items:
+            return None
+        return encode_cursor(self.PREVIOUS,
+                             self.paginator.key(self._items[0]))
@@ -0,0 +1,225 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from posts.models import Comment, Post
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchResults:
+    """
+    Ленивый список найденных постов для пагинатора: общее количество и
+    срез считаются отдельными запросами, посты среза загружаются одним
+    запросом в порядке релевантности.
+    """
+
+    def __init__(self, count_func, ids_func):
+        self._count_func = count_func
+        self._ids_func = ids_func
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self._count_func()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = self.count() if index.stop is None else index.stop
+        ids = self._ids_func(start, stop - start)
+        posts = Post.objects.for_listing().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+class BaseSearchBackend:
+    """
+    Интерфейс поискового индекса по текстам постов и комментариев. Индекс
+    обновляется сигналами при сохранении и удалении, поиск возвращает
+    посты, найденные по тексту поста или его комментариев.
+    """
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_comment(self, comment):
+        pass
+
+    def remove_comment(self, comment_id):
+        pass
+
+    def index_many(self, posts, comments):
+        """
+        Добавляет в индекс новые посты - пары (id, текст) - и комментарии -
+        тройки (id, текст, id поста). Нужен для bulk_create, при котором
+        сигналы не отправляются.
+        """
+
+    def rebuild(self, batch_size=1000):
+        pass
+
+    def search(self, query):
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """
+    Поиск подстрокой без отдельного индекса, для баз без полнотекстового
+    поиска. Ранжирования нет, результаты упорядочены по дате.
+    """
+
+    def search(self, query):
+        posts = Post.objects.all()
+        for term in TERM_RE.findall(query):
+            posts = posts.filter(
+                Q(text__icontains=term) | Q(comments__text__icontains=term))
+        ids = posts.order_by('-created', '-id').values_list(
+            'id', flat=True).distinct()
+        return SearchResults(
+            ids.count, lambda offset, limit: list(ids[offset:offset + limit]))
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """
+    Полнотекстовый индекс SQLite FTS5 с ранжированием BM25 (встроенный
+    rank FTS5). Посты и
+    комментарии хранятся в одной таблице: rowid поста - 2 * id, rowid
+    комментария - 2 * id + 1, в post_id - пост, к которому ведет запись.
+    """
+
+    table = 'posts_search_index'
+
+    @staticmethod
+    def post_rowid(post_id):
+        return post_id * 2
+
+    @staticmethod
+    def comment_rowid(comment_id):
+        return comment_id * 2 + 1
+
+    def _replace(self, rowid, text, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s',
+                           [rowid])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, text, post_id) '
+                f'VALUES (%s, %s, %s)', [rowid, text, post_id])
+
+    def _delete(self, rowid):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s',
+                           [rowid])
+
+    def index_post(self, post):
+        self._replace(self.post_rowid(post.id), post.text, post.id)
+
+    def remove_post(self, post_id):
+        self._delete(self.post_rowid(post_id))
+
+    def index_comment(self, comment):
+        self._replace(self.comment_rowid(comment.id), comment.text,
+                      comment.post_id)
+
+    def remove_comment(self, comment_id):
+        self._delete(self.comment_rowid(comment_id))
+
+    def index_many(self, posts, comments):
+        sql = f'INSERT INTO {self.table} (rowid, text, post_id) ' \
+              f'VALUES (%s, %s, %s)'
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                *((self.post_rowid(post_id), text, post_id)
+                  for post_id, text in posts),
+                *((self.comment_rowid(comment_id), text, post_id)
+                  for comment_id, text, post_id in comments),
+            ])
+
+    def rebuild(self, batch_size=1000):
+        """Заново строит индекс по всем постам и комментариям"""
+
+        sql = f'INSERT INTO {self.table} (rowid, text, post_id) ' \
+              f'VALUES (%s, %s, %s)'
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            sources = (
+                (Post.objects.values_list('id', 'text', 'id'),
+                 self.post_rowid),
+                (Comment.objects.values_list('id', 'text', 'post_id'),
+                 self.comment_rowid),
+            )
+            for rows, rowid in sources:
+                batch = []
+                for object_id, text, post_id in rows.order_by().iterator(
+                        chunk_size=batch_size):
+                    batch.append((rowid(object_id), text, post_id))
+                    if len(batch) >= batch_size:
+                        cursor.executemany(sql, batch)
+                        batch = []
+                cursor.executemany(sql, batch)
+
+    @staticmethod
+    def match_expression(query):
+        # каждое слово берется в кавычки, чтобы пользовательский ввод не
+        # разбирался как синтаксис запросов FTS5
+        return ' '.join(f'"{term}"' for term in TERM_RE.findall(query))
+
+    def search(self, query):
+        match = self.match_expression(query)
+        limit_matches = settings.SEARCH_MAX_RESULTS
+        # Выдача ограничена SEARCH_MAX_RESULTS самыми релевантными записями:
+        # FTS5 отбирает их по rank без сортировки всех совпадений. bm25()
+        # нельзя вызвать внутри агрегата, поэтому оценка считается во
+        # вложенном запросе, а LIMIT не дает развернуть его во внешний.
+        # Чем оценка меньше, тем запись релевантнее
+        matches = (f'SELECT post_id, rank AS score FROM {self.table} '
+                   f'WHERE {self.table} MATCH %s ORDER BY rank LIMIT %s')
+
+        def count():
+            if not match:
+                return 0
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT COUNT(DISTINCT post_id) FROM ({matches})',
+                    [match, limit_matches])
+                return cursor.fetchone()[0]
+
+        def ids(offset, limit):
+            if not match or limit <= 0:
+                return []
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT post_id FROM ({matches}) GROUP BY post_id '
+                    f'ORDER BY MIN(score), post_id DESC '
+                    f'LIMIT %s OFFSET %s',
+                    [match, limit_matches, limit, offset])
+                return [row[0] for row in cursor.fetchall()]
+
+        return SearchResults(count, ids)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """
+    Поисковый бэкенд из настройки SEARCH_BACKEND. Если она не задана, на
+    SQLite используется FTS5, на остальных базах - поиск подстрокой.
+    """
+
+    path = settings.SEARCH_BACKEND
+    if path is None:
+        if connection.vendor == 'sqlite':
+            path = 'posts.search.SQLiteFTS5Backend'
+        else:
+            path = 'posts.search.SimpleSearchBackend'
+    return import_string(path)()
@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.cache import bump_generation
+from posts import counters, feed
+from posts.cache import GROUPS_SCOPE, group_scope, post_scopes
+from posts.models import Comment, Follow, Group, Post
+from posts.search import get_backend
+from posts.storage import is_content_addressed, release_image
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    """Новый пост раскладывается по лентам подписчиков автора"""
+    if created:
+        feed.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    """При подписке лента пользователя заполняется постами автора"""
+    if created:
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(sender, instance, **kwargs):
+    """При отписке посты автора удаляются из ленты пользователя"""
+    feed.prune(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_post(sender, instance, **kwargs):
+    """
+    Запоминает прежние группу поста, чтобы сбросить и ее кеш, и файл
+    изображения, чтобы уменьшить счетчик его использований
+    """
+    instance._previous_group_id = None
+    instance._previous_image = None
+    if instance.pk is not None:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image').first() or (None, None))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_listings(sender, instance, **kwargs):
+    """Изменение поста сбрасывает кеш страниц, где он отображается"""
+    scopes = post_scopes(instance.author_id, instance.group_id)
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id is not None:
+        scopes.append(group_scope(previous_group_id))
+    bump_generation(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_listings(sender, instance, **kwargs):
+    """Изменение комментария сбрасывает кеш страниц с его постом"""
+    post = Post.objects.filter(pk=instance.post_id).values(
+        'author_id', 'group_id').first()
+    if post is not None:
+        bump_generation(*post_scopes(post['author_id'], post['group_id']))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_listings(sender, instance, **kwargs):
+    """Изменение группы сбрасывает кеш всех страниц со списками постов"""
+    bump_generation(group_scope(instance.id), GROUPS_SCOPE)
+
+
+def _count_post(post, delta):
+    counters.incr(counters.POSTS, delta=delta)
+    counters.incr(counters.AUTHOR_POSTS, post.author_id, delta)
+    if post.group_id is not None:
+        counters.incr(counters.GROUP_POSTS, post.group_id, delta)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    """Счетчики постов на сайте, в группе и у автора"""
+    if created:
+        _count_post(instance, 1)
+        return
+    previous_group_id = getattr(instance, '_previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        if previous_group_id is not None:
+            counters.incr(counters.GROUP_POSTS, previous_group_id, -1)
+        if instance.group_id is not None:
+            counters.incr(counters.GROUP_POSTS, instance.group_id)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    _count_post(instance, -1)
+
+
+def _count_image(name, delta):
+    """
+    Меняет счетчик постов с файлом изображения. Файл, который больше
+    никто не использует, удаляется фоновой задачей с задержкой. Файлы,
+    сохраненные до хранилища с адресацией по содержимому, не считаются.
+    """
+    if not is_content_addressed(name):
+        return
+    counters.incr(counters.IMAGE_USES, name, delta)
+    if delta < 0 and counters.get(counters.IMAGE_USES, name) <= 0:
+        release_image.schedule((name,),
+                               countdown=settings.MEDIA_RELEASE_DELAY)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_image(sender, instance, created, **kwargs):
+    """Счетчик использований файла изображения постами"""
+    previous = None if created else getattr(instance, '_previous_image',
+                                            None)
+    current = instance.image.name or None
+    if previous == current:
+        return
+    if current:
+        _count_image(current, 1)
+    if previous:
+        _count_image(previous, -1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        _count_image(instance.image.name, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    """Счетчик комментариев к посту"""
+    if created:
+        counters.incr(counters.POST_COMMENTS, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.incr(counters.POST_COMMENTS, instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, **kwargs):
+    """Счетчик подписчиков автора"""
+    if created:
+        counters.incr(counters.AUTHOR_FOLLOWERS, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.incr(counters.AUTHOR_FOLLOWERS, instance.author_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    """Поисковый индекс обновляется при сохранении и удалении"""
+    get_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    get_backend().remove_post(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    get_backend().index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    get_backend().remove_comment(instance.id)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from core.tasks import task
+
+# имя файла в хранилище: каталог/первые два знака хеша/хеш.расширение
+CONTENT_NAME = re.compile(
+    r'^(?:.+/)?(?P<prefix>[0-9a-f]{2})/(?P<digest>[0-9a-f]{64})\.\w+$')
+CHUNK_SIZE = 64 * 1024
+
+
+def content_name(directory, digest, extension):
+    """Имя файла с содержимым, у которого SHA-256 равен digest"""
+
+    return f'{directory}/{digest[:2]}/{digest}{extension.lower()}'
+
+
+def is_content_addressed(name):
+    match = CONTENT_NAME.match(name or '')
+    return match is not None and match['digest'].startswith(match['prefix'])
+
+
+def file_digest(path):
+    """SHA-256 файла, читаемого по частям"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class DedupStorage(FileSystemStorage):
+    """
+    Файловое хранилище с адресацией по содержимому. При сохранении файл
+    по частям пишется во временный файл в MEDIA_ROOT и одновременно
+    хешируется, а затем получает имя по хешу: одинаковые загрузки
+    хранятся одной копией, повторная просто отбрасывается. Имя из
+    upload_to задает только каталог и расширение. Сколько постов
+    используют файл, считает счетчик IMAGE_USES, файл без использований
+    удаляет задача release_image.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # имя определяется содержимым, совпадение имен - это совпадение
+        # содержимого, подбирать свободное имя не нужно
+        return name
+
+    def _save(self, name, content):
+        directory, base = os.path.split(name)
+        _, extension = os.path.splitext(base)
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(dir=self.location,
+                                                 prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    target.write(chunk)
+            name = content_name(directory, digest.hexdigest(), extension)
+            path = self.path(name)
+            try:
+                # повторная загрузка обновляет время изменения файла:
+                # release_image не удалит его, пока пост с ним сохраняется
+                os.utime(path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                # переименование атомарно: одновременная загрузка того же
+                # файла заменит его тем же содержимым
+                os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return name
+
+
+image_storage = DedupStorage()
+
+
+@task
+def release_image(name):
+    """
+    Фоновая задача: удаляет файл изображения и его копии, если ни один
+    пост его больше не использует. Файл, который загружен повторно, но
+    еще не сохранен в новом посте, ни один пост тоже не использует.
+    Поэтому удаляется только файл, не изменявшийся MEDIA_RELEASE_DELAY
+    секунд: повторная загрузка обновляет время изменения
+    (DedupStorage._save), и задача откладывается.
+    """
+
+    from posts import counters
+    from posts.models import Counter, Post
+    from posts.thumbnails import rendition_name
+
+    if Post.objects.filter(image=name).exists():
+        return
+    try:
+        age = time.time() - os.path.getmtime(image_storage.path(name))
+    except FileNotFoundError:
+        age = None
+    if age is not None and age < settings.MEDIA_RELEASE_DELAY:
+        # при TASKS_EAGER задача выполнилась бы сразу же снова
+        if not settings.TASKS_EAGER:
+            release_image.schedule(
+                (name,), countdown=settings.MEDIA_RELEASE_DELAY - age)
+        return
+    image_storage.delete(name)
+    for size in settings.THUMBNAIL_RENDITIONS:
+        image_storage.delete(rendition_name(name, size))
+    Counter.objects.filter(key=counters.make_key(counters.IMAGE_USES, name),
+                           value__lte=0).delete()
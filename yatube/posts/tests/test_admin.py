@@ -0,0 +1,172 @@
+import csv
+import io
+from http import HTTPStatus
+
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+from posts.paginators import EstimatedCountPaginator
+
+User = get_user_model()
+
+
+class AdminExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password')
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='Group', slug='group',
+                                         description='group_description')
+        cls.post = Post.objects.create(author=cls.user, group=cls.group,
+                                       text='Cats are sleeping')
+        Post.objects.create(author=cls.user, text='Dogs are walking')
+        Comment.objects.create(post=cls.post, author=cls.admin,
+                               text='Comment_text')
+        Follow.objects.create(user=cls.admin, author=cls.user)
+
+    def setUp(self):
+        self.admin_client = Client()
+        self.admin_client.force_login(AdminExportTests.admin)
+
+    def rows(self, response):
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_changelist_has_export_button(self):
+        """Страница списка содержит кнопку выгрузки с текущим поиском"""
+        response = self.admin_client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'Cats'})
+        self.assertContains(
+            response, reverse('admin:posts_post_export') + '?q=Cats')
+
+    def test_export_honors_search(self):
+        """Выгрузка учитывает поиск и связанные поля"""
+        rows = self.rows(self.admin_client.get(
+            reverse('admin:posts_post_export'), {'q': 'Cats'}))
+        self.assertEqual(rows[0], ['id', 'created', 'author', 'group',
+                                   'text', 'image'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2:5], ['user', 'group', 'Cats are sleeping'])
+
+    def test_export_all_models(self):
+        """Выгружаются комментарии и подписки"""
+        for model, expected in (('comment', 'Comment_text'),
+                                ('follow', 'user')):
+            with self.subTest(model=model):
+                rows = self.rows(self.admin_client.get(
+                    reverse(f'admin:posts_{model}_export')))
+                self.assertEqual(len(rows), 2)
+                self.assertIn(expected, rows[1])
+
+    def test_export_action(self):
+        """Действие выгружает только выбранные объекты"""
+        rows = self.rows(self.admin_client.post(
+            reverse('admin:posts_post_changelist'),
+            {'action': 'export_csv',
+             ACTION_CHECKBOX_NAME: [AdminExportTests.post.pk]}))
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [str(AdminExportTests.post.pk)])
+
+    def test_export_escapes_formulas(self):
+        """Текст, похожий на формулу, выгружается с апострофом"""
+        for text in ('=HYPERLINK("http://evil")', '+1', '-1', '@SUM(A1)',
+                     '\tTab', '\rReturn'):
+            with self.subTest(text=text):
+                Comment.objects.all().update(text=text)
+                rows = self.rows(self.admin_client.get(
+                    reverse('admin:posts_comment_export')))
+                self.assertIn("'" + text, rows[1])
+
+    def test_export_requires_staff(self):
+        """Выгрузка недоступна пользователю без доступа к админке"""
+        client = Client()
+        client.force_login(AdminExportTests.user)
+        response = client.get(reverse('admin:posts_post_export'))
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+    def test_export_with_invalid_filter(self):
+        """Некорректный фильтр возвращает на страницу списка"""
+        response = self.admin_client.get(
+            reverse('admin:posts_post_export'), {'missing__field': '1'})
+        self.assertRedirects(
+            response, reverse('admin:posts_post_changelist') + '?e=1')
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password')
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(title='Group', slug='group',
+                                         description='group_description')
+        for i in range(12):
+            Post.objects.create(author=cls.user, group=cls.group,
+                                text=f'Post_number_{i}')
+        Comment.objects.create(post=Post.objects.first(), author=cls.admin,
+                               text='Comment_text')
+        Follow.objects.create(user=cls.admin, author=cls.user)
+
+    def setUp(self):
+        self.admin_client = Client()
+        self.admin_client.force_login(AdminChangelistTests.admin)
+
+    def test_changelists_available(self):
+        """Страницы списков открываются, в том числе по дате"""
+        created = Post.objects.first().created
+        urls = (
+            reverse('admin:posts_post_changelist'),
+            reverse('admin:posts_post_changelist') + (
+                f'?created__year={created.year}'
+                f'&created__month={created.month}'),
+            reverse('admin:posts_comment_changelist'),
+            reverse('admin:posts_follow_changelist') + '?q=user',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.admin_client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_group_select_not_rendered(self):
+        """Поле группы в строках списка - автодополнение, а не все группы"""
+        response = self.admin_client.get(
+            reverse('admin:posts_post_changelist'))
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(
+            response, f'<option value="{AdminChangelistTests.group.pk}">')
+
+    def test_related_objects_joined(self):
+        """Авторы и группы строк списка выбираются одним запросом"""
+        with CaptureQueriesContext(connection) as context:
+            self.admin_client.get(reverse('admin:posts_post_changelist'))
+        users = [query for query in context.captured_queries
+                 if query['sql'].startswith('SELECT')
+                 and 'FROM "auth_user"' in query['sql']]
+        # пользователь сессии и один запрос постов с авторами
+        self.assertLessEqual(len(users), 1)
+
+    def test_estimated_count(self):
+        """Сверх порога количество оценивается, до порога - точное"""
+        paginator = EstimatedCountPaginator(Post.objects.all(), 5)
+        self.assertEqual(paginator.count, 12)
+        paginator = EstimatedCountPaginator(Post.objects.all(), 5)
+        paginator.threshold = 5
+        Post.objects.filter(pk=Post.objects.order_by('id')[1].pk).delete()
+        with self.assertNumQueries(2):
+            # оценка по разбросу первичных ключей не видит удаленный пост
+            self.assertEqual(paginator.count, 12)
+        paginator = EstimatedCountPaginator(
+            Post.objects.filter(text__startswith='Post'), 5)
+        paginator.threshold = 5
+        # условие на SQLite не оценить, считается точно
+        self.assertEqual(paginator.count, 11)
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
+from django.test import TestCase
+
+from posts import counters
+from posts.benchmarks import seed_dataset
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+
+User = get_user_model()
+
+
+class SeedDatasetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cache.clear()
+        seed_dataset(users=50, groups=5, posts=500, comments=1000,
+                     follows=300)
+
+    def test_objects_created(self):
+        """Создаются все пользователи, группы, посты и комментарии"""
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(Group.objects.count(), 5)
+        self.assertEqual(Post.objects.count(), 500)
+        self.assertEqual(Comment.objects.count(), 1000)
+        self.assertEqual(Follow.objects.count(), 300)
+
+    def test_followers_are_skewed(self):
+        """Подписчики распределены неравномерно: у лидера их больше всех"""
+        followers = sorted(Follow.objects.values('author').annotate(
+            total=Count('id')).values_list('total', flat=True))
+        self.assertGreater(followers[-1], 5 * followers[len(followers) // 2])
+
+    def test_counters_match_tables(self):
+        """Счетчики заполнены и совпадают с таблицами"""
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertEqual(counters.get(counters.POSTS), 500)
+
+    def test_feeds_filled(self):
+        """Ленты подписчиков содержат посты авторов из подписок"""
+        follow = Follow.objects.filter(author__posts__isnull=False).first()
+        self.assertTrue(FeedEntry.objects.filter(
+            user=follow.user, author=follow.author).exists())
@@ -0,0 +1,81 @@
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from posts import counters
+from posts.models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Group',
+            slug='group',
+            description='group_description',
+        )
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Test_text')
+
+    def test_counters_follow_create_and_delete(self):
+        """Счетчики изменяются при создании и удалении объектов"""
+        post = Post.objects.create(author=CountersTests.author,
+                                   group=CountersTests.group,
+                                   text='Second_text')
+        comment = Comment.objects.create(post=post,
+                                         author=CountersTests.user,
+                                         text='Comment_text')
+        follow = Follow.objects.create(user=CountersTests.user,
+                                       author=CountersTests.author)
+        expected = {
+            (counters.POSTS, None): 2,
+            (counters.AUTHOR_POSTS, CountersTests.author.id): 2,
+            (counters.GROUP_POSTS, CountersTests.group.id): 2,
+            (counters.POST_COMMENTS, post.id): 1,
+            (counters.AUTHOR_FOLLOWERS, CountersTests.author.id): 1,
+        }
+        for (kind, object_id), value in expected.items():
+            with self.subTest(kind=kind):
+                self.assertEqual(counters.get(kind, object_id), value)
+        comment.delete()
+        follow.delete()
+        post.delete()
+        for (kind, object_id), value in expected.items():
+            with self.subTest(kind=kind):
+                self.assertEqual(counters.get(kind, object_id), value - 1)
+
+    def test_group_change_moves_post_count(self):
+        """При переносе поста в другую группу счетчики групп изменяются"""
+        counters.get(counters.GROUP_POSTS, CountersTests.group.id)
+        other_group = Group.objects.create(title='Other', slug='other',
+                                           description='other_description')
+        post = Post.objects.get(id=CountersTests.post.id)
+        post.group = other_group
+        post.save()
+        self.assertEqual(
+            counters.get(counters.GROUP_POSTS, CountersTests.group.id), 0)
+        self.assertEqual(
+            counters.get(counters.GROUP_POSTS, other_group.id), 1)
+
+    def test_reconcile_fixes_drift(self):
+        """Команда reconcile_counters исправляет расхождения счетчиков"""
+        counters.get(counters.AUTHOR_POSTS, CountersTests.author.id)
+        # bulk_create не отправляет сигналы, счетчик расходится с таблицей
+        Post.objects.bulk_create([
+            Post(author=CountersTests.author, text=f'Bulk_{i}')
+            for i in range(3)
+        ])
+        Counter.objects.filter(key=counters.POSTS).update(value=100)
+        stdout = io.StringIO()
+        call_command('reconcile_counters', batch_size=1, stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'Исправлено счетчиков: 2')
+        self.assertEqual(
+            counters.get(counters.AUTHOR_POSTS, CountersTests.author.id), 4)
+        self.assertEqual(counters.get(counters.POSTS), 4)
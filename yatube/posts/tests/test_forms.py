@@ -1,3 +1,4 @@
+import os
 import shutil
 import tempfile
 from http import HTTPStatus
@@ -8,13 +9,24 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, override_settings, TestCase
 from django.urls import reverse
 
+from core.tasks import Worker
 from posts.models import Comment, Group, Post
+from posts.storage import content_name, file_digest
+from posts.thumbnails import rendition_name
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 User = get_user_model()
 
 
+def stored_name(image):
+    """
+    Имя, под которым хранилище должно сохранить файл: пересжатый JPEG в
+    каталоге posts под хешем содержимого
+    """
+    return content_name('posts', file_digest(image.path), '.jpg')
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostCreateFormTests(TestCase):
     @classmethod
@@ -69,6 +81,8 @@ class PostCreateFormTests(TestCase):
         # отправляем POST запрос
         response = self.authorized_client.post(create_url, data=form_data,
                                                follow=True)
+        # копии нарезает воркер очереди фоновых задач
+        Worker(burst=True).run()
         new_post = Post.objects.get(text=form_data.get('text'))
         # проверяем, Http код, который возвращается в запросе
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -99,9 +113,16 @@ class PostCreateFormTests(TestCase):
                          'Группа нового поста не соответствует той, которая '
                          'передавалась в форму'
                          )
-        self.assertEqual(new_post.image, 'posts/small.gif',
+        # файл хранится под именем по хешу содержимого
+        self.assertEqual(new_post.image, stored_name(new_post.image),
                          'Изображение нового поста не соответствует тому, '
                          'которое передавалось в форму')
+        # проверяем, что копия изображения для списков постов нарезана
+        rendition = rendition_name(new_post.image.name, '960x339')
+        self.assertEqual(new_post.thumbnail_url, f'/media/{rendition}',
+                         'Копия изображения нового поста не нарезана')
+        self.assertTrue(os.path.exists(os.path.join(TEMP_MEDIA_ROOT,
+                                                    rendition)))
 
     def test_update_post(self):
         """Валидная форма обновляет запись в Post"""
@@ -160,7 +181,7 @@ class PostCreateFormTests(TestCase):
                          'Группа поста при обновлении не соответствует той, '
                          'которая передавалась в форму'
                          )
-        self.assertEqual(new_post.image, 'posts/small.gif',
+        self.assertEqual(new_post.image, stored_name(new_post.image),
                          'Изображение нового поста не соответствует тому, '
                          'которое передавалось в форму')
         # проверяем, что поста со старым текстом не существует
@@ -0,0 +1,96 @@
+import io
+import struct
+import zlib
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from posts.forms import PostForm
+
+
+def image_file(name, image, image_format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **params)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def png_header(width, height):
+    """Начало PNG с заданными размерами: заголовок и пустой блок данных"""
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                         0, 0, 0))
+            + chunk(b'IDAT', b''))
+
+
+@override_settings(IMAGE_MAX_DIMENSION=64, IMAGE_FORMAT='JPEG')
+class ImageUploadTests(TestCase):
+    def clean_image(self, upload):
+        form = PostForm(data={'text': 'Post_text'}, files={'image': upload})
+        return form, form.is_valid()
+
+    def test_image_reencoded_without_metadata(self):
+        """
+        Большое изображение уменьшается и сохраняется прогрессивным JPEG
+        без EXIF, поворот из EXIF применяется к пикселям
+        """
+        exif = Image.Exif()
+        # Orientation: повернуть на 90 градусов
+        exif[0x0112] = 6
+        # Make: метаданные, которые не должны попасть в файл
+        exif[0x010F] = 'Phone'
+        upload = image_file('photo.png', Image.new('RGB', (200, 100)),
+                            'PNG', exif=exif)
+        form, valid = self.clean_image(upload)
+        self.assertTrue(valid, form.errors)
+        image_field = form.cleaned_data['image']
+        self.assertEqual(image_field.name, 'photo.jpg')
+        with Image.open(image_field) as saved:
+            self.assertEqual(saved.format, 'JPEG')
+            self.assertEqual(saved.size, (32, 64))
+            self.assertTrue(saved.info.get('progressive'))
+            self.assertNotIn('exif', saved.info)
+
+    def test_huge_dimensions_rejected_by_header(self):
+        """Размеры из заголовка больше лимита отклоняются без декодирования"""
+        upload = SimpleUploadedFile('bomb.png', png_header(2000, 1000))
+        with override_settings(IMAGE_MAX_PIXELS=10 ** 6):
+            form, valid = self.clean_image(upload)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'image_too_large')
+
+    def test_large_file_rejected(self):
+        """Файл больше IMAGE_UPLOAD_MAX_SIZE отклоняется"""
+        upload = image_file('photo.png', Image.new('RGB', (20, 20)), 'PNG')
+        with override_settings(IMAGE_UPLOAD_MAX_SIZE=10):
+            form, valid = self.clean_image(upload)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'file_too_large')
+
+    def test_unsupported_format_rejected(self):
+        """Форматы не из IMAGE_UPLOAD_FORMATS отклоняются"""
+        upload = image_file('photo.bmp', Image.new('RGB', (20, 20)), 'BMP')
+        form, valid = self.clean_image(upload)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'invalid_format')
+
+    def test_animated_gif_kept(self):
+        """Анимированный GIF сохраняется как есть, со всеми кадрами"""
+        frames = [Image.new('P', (20, 20), color) for color in (1, 2)]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True,
+                       append_images=frames[1:])
+        upload = SimpleUploadedFile('meme.gif', buffer.getvalue())
+        form, valid = self.clean_image(upload)
+        self.assertTrue(valid, form.errors)
+        self.assertEqual(form.cleaned_data['image'].name, 'meme.gif')
+        self.assertEqual(form.cleaned_data['image'].read(),
+                         buffer.getvalue())
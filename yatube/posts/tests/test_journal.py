@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import counters, journal
+from posts.models import Comment, Post
+from posts.search import get_backend
+
+User = get_user_model()
+
+TEMP_JOURNAL_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(COMMENTS_WRITE_BEHIND=True, COMMENTS_FLUSH_INTERVAL=0)
+class CommentJournalTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Post_text')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_JOURNAL_DIR, ignore_errors=True)
+
+    def setUp(self):
+        # у каждого теста свой журнал
+        journal_settings = override_settings(
+            COMMENTS_JOURNAL_PATH=os.path.join(TEMP_JOURNAL_DIR,
+                                               f'{self.id()}.sqlite3'))
+        journal_settings.enable()
+        self.addCleanup(journal_settings.disable)
+        self.author_client = Client()
+        self.author_client.force_login(CommentJournalTests.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(CommentJournalTests.reader)
+        self.detail_url = reverse('posts:post_detail', kwargs={
+            'post_id': CommentJournalTests.post.id})
+        cache.clear()
+
+    def add_comment(self, text, post=None):
+        post = post or CommentJournalTests.post
+        self.author_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.id}),
+            {'text': text})
+
+    def test_comment_waits_in_journal(self):
+        """
+        Комментарий попадает в журнал, а не в базу, и виден только автору
+        """
+        self.add_comment('Pending_comment')
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(len(journal.get_journal()), 1)
+        response = self.author_client.get(self.detail_url)
+        self.assertEqual([comment.text for comment in
+                          response.context['pending_comments']],
+                         ['Pending_comment'])
+        self.assertContains(response, 'Pending_comment')
+        self.assertNotContains(self.reader_client.get(self.detail_url),
+                               'Pending_comment')
+
+    def test_own_comment_changes_etag(self):
+        """Свой комментарий в журнале меняет ETag страницы поста"""
+        etag = self.author_client.get(self.detail_url)['ETag']
+        self.add_comment('Pending_comment')
+        response = self.author_client.get(self.detail_url,
+                                          HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Pending_comment')
+
+    def test_flush_moves_comments_to_database(self):
+        """
+        Перенос создает комментарии со счетчиком и поисковым индексом и
+        очищает журнал
+        """
+        for i in range(3):
+            self.add_comment(f'Flushed_comment_{i}')
+        self.assertEqual(journal.flush(), 3)
+        self.assertEqual(
+            list(Comment.objects.order_by('id').values_list('text',
+                                                            flat=True)),
+            [f'Flushed_comment_{i}' for i in range(3)])
+        self.assertEqual(counters.get(counters.POST_COMMENTS,
+                                      CommentJournalTests.post.id), 3)
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertIn(CommentJournalTests.post,
+                      list(get_backend().search('Flushed_comment_1')))
+        self.assertEqual(len(journal.get_journal()), 0)
+        response = self.reader_client.get(self.detail_url)
+        self.assertContains(response, 'Flushed_comment_2')
+        self.assertEqual(
+            self.author_client.get(self.detail_url).context[
+                'pending_comments'], [])
+
+    def test_flush_after_crash_does_not_duplicate(self):
+        """
+        Если журнал не очистился после записи в базу, повторный перенос
+        пачку пропускает
+        """
+        self.add_comment('Once_comment')
+        with mock.patch.object(journal.CommentJournal, 'discard'):
+            self.assertEqual(journal.flush(), 1)
+        self.assertEqual(len(journal.get_journal()), 1)
+        self.add_comment('Next_comment')
+        self.assertEqual(journal.drain(), 1)
+        self.assertEqual(
+            list(Comment.objects.order_by('id').values_list('text',
+                                                            flat=True)),
+            ['Once_comment', 'Next_comment'])
+        self.assertEqual(len(journal.get_journal()), 0)
+
+    def test_comments_of_deleted_post_dropped(self):
+        """Комментарии к посту, удаленному до переноса, отбрасываются"""
+        post = Post.objects.create(author=CommentJournalTests.author,
+                                   text='Deleted_post')
+        self.add_comment('Orphan_comment', post=post)
+        post.delete()
+        self.assertEqual(journal.flush(), 1)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(len(journal.get_journal()), 0)
+
+    def test_flush_keeps_model_created_field(self):
+        """
+        Перенос сохраняет дату из журнала и не мешает обычным сохранениям
+        комментариев в других потоках получать текущую дату
+        """
+        created = timezone.now() - timedelta(days=1)
+        journal.get_journal().append(CommentJournalTests.post.id,
+                                     CommentJournalTests.reader.id,
+                                     'Journal_comment', created)
+        concurrent = []
+        assign_ids = journal.Importer.assign_ids
+
+        def save_meanwhile(*args):
+            concurrent.append(Comment.objects.create(
+                post=CommentJournalTests.post,
+                author=CommentJournalTests.author, text='Direct_comment'))
+            return assign_ids(*args)
+
+        with mock.patch.object(journal.Importer, 'assign_ids',
+                               side_effect=save_meanwhile):
+            self.assertEqual(journal.flush(), 1)
+        self.assertEqual(Comment.objects.get(text='Journal_comment').created,
+                         created)
+        concurrent[0].refresh_from_db()
+        self.assertGreater(concurrent[0].created, created)
+
+    def test_flush_skips_deleted_authors(self):
+        """
+        Комментарий удаленного автора отбрасывается и не останавливает
+        перенос остальных
+        """
+        gone = User.objects.create_user(username='gone')
+        for author, text in ((gone, 'Gone_comment'),
+                             (CommentJournalTests.reader, 'Kept_comment')):
+            journal.get_journal().append(CommentJournalTests.post.id,
+                                         author.id, text, timezone.now())
+        gone.delete()
+        self.assertEqual(journal.flush(), 2)
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Kept_comment'])
+        self.assertEqual(len(journal.get_journal()), 0)
+        self.assertEqual(counters.reconcile(), 0)
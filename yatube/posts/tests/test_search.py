@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Post
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.post_by_text = Post.objects.create(
+            author=cls.user,
+            text='Кошки любят спать на солнце, кошки спят весь день'
+        )
+        cls.post_by_comment = Post.objects.create(
+            author=cls.user,
+            text='Фотография с прогулки'
+        )
+        Comment.objects.create(post=cls.post_by_comment, author=cls.user,
+                               text='Кошки на фотографии? Кажется, там '
+                                    'только деревья, небо, дорога и облака '
+                                    'над старым городом')
+        cls.other_post = Post.objects.create(author=cls.user,
+                                             text='Собаки гуляют в парке')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query):
+        response = self.guest_client.get(reverse('posts:search'),
+                                         {'q': query})
+        return response.context['page_obj'][:]
+
+    def test_search_uses_correct_template(self):
+        """Страница поиска использует соответствующий шаблон"""
+        response = self.guest_client.get(reverse('posts:search'))
+        self.assertTemplateUsed(response, 'posts/search.html')
+
+    def test_search_finds_posts_by_text_and_comments(self):
+        """
+        Поиск находит посты по тексту и комментариям, пост с большим
+        числом совпадений выше в выдаче
+        """
+        self.assertEqual(self.search('кошки'),
+                         [SearchTests.post_by_text,
+                          SearchTests.post_by_comment])
+        self.assertEqual(self.search('СОБАКИ'), [SearchTests.other_post])
+
+    def test_index_follows_changes(self):
+        """Поисковый индекс обновляется при изменении и удалении"""
+        post = Post.objects.get(id=SearchTests.other_post.id)
+        post.text = 'Попугаи гуляют в парке'
+        post.save()
+        self.assertEqual(self.search('собаки'), [])
+        self.assertEqual(self.search('попугаи'), [post])
+        post.delete()
+        self.assertEqual(self.search('попугаи'), [])
+
+    def test_search_syntax_is_escaped(self):
+        """Служебные символы запроса не приводят к ошибке"""
+        self.assertEqual(self.search('"кошки* ( -'),
+                         [SearchTests.post_by_text,
+                          SearchTests.post_by_comment])
@@ -0,0 +1,230 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from core.models import Task
+from core.tasks import Worker
+from posts import counters, thumbnails
+from posts.management.commands.dedupe_media import (manifest_path,
+                                                    write_manifest)
+from posts.models import Post
+from posts.storage import (content_name, file_digest, image_storage,
+                           is_content_addressed, release_image)
+from posts.thumbnails import rendition_name
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def jpeg(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (20, 10), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class DedupStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, content, name='meme.jpg'):
+        post = Post(author=DedupStorageTests.author, text='Post_text')
+        post.image.save(name, ContentFile(content), save=False)
+        post.save()
+        thumbnails.generate(post)
+        return post
+
+    def uses(self, name):
+        return counters.get(counters.IMAGE_USES, name)
+
+    def age(self, path):
+        """Файл выглядит не изменявшимся дольше MEDIA_RELEASE_DELAY"""
+        past = time.time() - settings.MEDIA_RELEASE_DELAY - 1
+        os.utime(path, (past, past))
+
+    def test_same_content_stored_once(self):
+        """
+        Одинаковые файлы хранятся одной копией под именем по хешу, счетчик
+        считает посты с ним
+        """
+        first = self.create_post(jpeg('red'), 'first.jpg')
+        second = self.create_post(jpeg('red'), 'second.jpg')
+        other = self.create_post(jpeg('blue'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertEqual(first.image.name, content_name(
+            'posts', file_digest(first.image.path), '.jpg'))
+        self.assertEqual(self.uses(first.image.name), 2)
+        self.assertEqual(self.uses(other.image.name), 1)
+        self.assertEqual(counters.reconcile(), 0)
+        stored = [name for _, _, files in os.walk(
+            os.path.join(TEMP_MEDIA_ROOT, 'posts')) for name in files]
+        self.assertEqual(len(stored), 2)
+
+    def test_dedupe_media_finishes_interrupted_run(self):
+        """
+        Прежние файлы, которые прерванный запуск не успел удалить после
+        транзакции, удаляет следующий, а файлы постов остаются
+        """
+        directory = os.path.join(TEMP_MEDIA_ROOT, 'posts')
+        os.makedirs(directory)
+        for name in ('moved.jpg', 'kept.jpg'):
+            with open(os.path.join(directory, name), 'wb') as image:
+                image.write(jpeg('red'))
+        post = Post.objects.create(author=DedupStorageTests.author,
+                                   text='Post_text', image='posts/kept.jpg')
+        # запуск прервался после транзакции: moved.jpg уже не нужен
+        write_manifest(['posts/moved.jpg', 'posts/kept.jpg'])
+        call_command('dedupe_media', workers=1, stdout=io.StringIO())
+        self.assertFalse(os.path.exists(os.path.join(directory,
+                                                     'moved.jpg')))
+        self.assertFalse(os.path.exists(manifest_path()))
+        post.refresh_from_db()
+        self.assertTrue(is_content_addressed(post.image.name))
+        self.assertTrue(os.path.exists(post.image.path))
+
+    def test_renditions_reused(self):
+        """Пост с тем же файлом сразу получает готовые копии без задачи"""
+        first = self.create_post(jpeg('red'))
+        Worker(burst=True).run()
+        tasks = Task.objects.count()
+        second = self.create_post(jpeg('red'))
+        second.refresh_from_db()
+        self.assertEqual(Task.objects.count(), tasks)
+        self.assertEqual(second.thumbnail_url, '/media/' + rendition_name(
+            first.image.name, settings.THUMBNAIL_LISTING_SIZE))
+
+    def test_unused_file_released(self):
+        """
+        Файл без использований удаляется вместе с копиями отложенной
+        задачей, пока он нужен хотя бы одному посту - остается
+        """
+        first = self.create_post(jpeg('red'))
+        second = self.create_post(jpeg('red'))
+        Worker(burst=True).run()
+        name = first.image.name
+        path = first.image.path
+        rendition = os.path.join(TEMP_MEDIA_ROOT, rendition_name(
+            name, settings.THUMBNAIL_LISTING_SIZE))
+        first.delete()
+        self.assertEqual(self.uses(name), 1)
+        self.assertFalse(Task.objects.filter(
+            name=release_image.name).exists())
+        second.image = ''
+        second.save()
+        release = Task.objects.get(name=release_image.name)
+        self.assertEqual(json.loads(release.arguments)['args'], [name])
+        # задача отложена и пока не выполняется
+        Worker(burst=True).run()
+        self.assertTrue(os.path.exists(path))
+        self.age(path)
+        release_image(name)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(rendition))
+
+    def test_reuploaded_file_kept(self):
+        """
+        Файл, загруженный повторно, пока ждало удаление, остается: пост с
+        ним может быть еще не сохранен. Удаление откладывается
+        """
+        post = self.create_post(jpeg('red'))
+        name = post.image.name
+        self.age(post.image.path)
+        post.delete()
+        Task.objects.all().delete()
+        image_storage.save('posts/again.jpg', ContentFile(jpeg('red')))
+        release_image(name)
+        self.assertTrue(os.path.exists(image_storage.path(name)))
+        release = Task.objects.get(name=release_image.name)
+        self.assertGreater(release.run_at, timezone.now())
+
+    def test_regenerate_thumbnails(self):
+        """
+        Команда нарезает каждое изображение один раз и записывает копии
+        во все посты с ним, временных файлов не остается
+        """
+        posts = [self.create_post(jpeg(color))
+                 for color in ('red', 'red', 'blue')]
+        Post.objects.update(renditions='')
+        stdout = io.StringIO()
+        call_command('regenerate_thumbnails', workers=1, stdout=stdout)
+        self.assertIn('Обработано изображений: 2, постов: 3',
+                      stdout.getvalue())
+        for post in posts:
+            post.refresh_from_db()
+            self.assertEqual(post.thumbnail_url, '/media/' + rendition_name(
+                post.image.name, settings.THUMBNAIL_LISTING_SIZE))
+        stored = [name for _, _, files in os.walk(TEMP_MEDIA_ROOT)
+                  for name in files]
+        self.assertEqual(len(stored), 4)
+        self.assertFalse([name for name in stored
+                          if name.startswith('.render-')])
+
+    def test_thumbnail_url_falls_back_to_image(self):
+        """Пока копии не нарезаны, страницы показывают исходный файл"""
+        post = self.create_post(jpeg('red'))
+        self.assertIsNone(post.thumbnail_url)
+        url = reverse('posts:post_detail', kwargs={'post_id': post.id})
+        cache.clear()
+        self.assertContains(self.client.get(url), f'src="{post.image.url}"')
+        Worker(burst=True).run()
+        post.refresh_from_db()
+        cache.clear()
+        self.assertContains(self.client.get(url),
+                            f'src="{post.thumbnail_url}"')
+
+    def test_dedupe_media(self):
+        """
+        Команда переводит старые файлы на имена по хешу, одинаковые -
+        в одну копию вместе с копиями для списков
+        """
+        directory = os.path.join(TEMP_MEDIA_ROOT, 'posts')
+        os.makedirs(directory)
+        for name, color in (('a.jpg', 'red'), ('b.jpg', 'red'),
+                            ('c.jpg', 'blue')):
+            with open(os.path.join(directory, name), 'wb') as image:
+                image.write(jpeg(color))
+        posts = [Post.objects.create(author=DedupStorageTests.author,
+                                     text=name, image=f'posts/{name}')
+                 for name in ('a.jpg', 'b.jpg', 'c.jpg', 'c.jpg')]
+        thumbnails.render(TEMP_MEDIA_ROOT, 'posts/a.jpg',
+                          settings.THUMBNAIL_RENDITIONS)
+        call_command('dedupe_media', workers=2, stdout=io.StringIO())
+        a, b, c, c_again = [Post.objects.get(pk=post.pk) for post in posts]
+        self.assertEqual(a.image.name, b.image.name)
+        self.assertEqual(c.image.name, c_again.image.name)
+        self.assertTrue(is_content_addressed(a.image.name))
+        self.assertEqual(self.uses(a.image.name), 2)
+        self.assertEqual(self.uses(c.image.name), 2)
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertEqual(b.thumbnail_url, '/media/' + rendition_name(
+            a.image.name, settings.THUMBNAIL_LISTING_SIZE))
+        self.assertEqual(c.renditions, '')
+        stored = [name for _, _, files in os.walk(directory)
+                  for name in files]
+        self.assertEqual(len(stored), 2)
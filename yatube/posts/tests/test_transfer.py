@@ -0,0 +1,98 @@
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, skipIfDBFeature
+from django.test.utils import CaptureQueriesContext
+
+from core.cache import get_generations
+from posts import counters
+from posts.cache import INDEX_SCOPE
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+from posts.search import get_backend
+from posts.transfer import (CSV, NDJSON, Importer, export_records,
+                            read_records, write_records)
+
+User = get_user_model()
+
+
+class TransferTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(title='Group', slug='group',
+                                         description='group_description')
+        Follow.objects.create(user=cls.follower, author=cls.author)
+        for i in range(3):
+            post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text=f'Post_number_{i}')
+        Comment.objects.create(post=post, author=cls.follower,
+                               text='First_comment')
+        Comment.objects.create(post=post, author=cls.author,
+                               text='Second_comment')
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def dump(self, fmt):
+        stream = io.StringIO()
+        write_records(export_records(chunk_size=2), stream, fmt)
+        stream.seek(0)
+        return stream
+
+    def test_round_trip(self):
+        """Выгрузка, загрузка в пустую базу и повторная выгрузка совпадают"""
+        for fmt in (NDJSON, CSV):
+            with self.subTest(fmt=fmt):
+                dump = self.dump(fmt).getvalue()
+                Post.objects.all().delete()
+                Importer(batch_size=2).run(
+                    read_records(io.StringIO(dump), fmt))
+                self.assertEqual(self.dump(fmt).getvalue(), dump)
+
+    def test_import_creates_missing_authors_and_groups(self):
+        """Неизвестные авторы и группы создаются при загрузке"""
+        records = [{'author': 'newcomer', 'group': 'new-group',
+                    'created': '2021-01-01T00:00:00+00:00', 'text': 'Text',
+                    'comments': [{'author': 'commenter', 'text': 'Reply'}]}]
+        stats = Importer().run(records)
+        self.assertEqual(stats['created_users'], 2)
+        self.assertEqual(stats['created_groups'], 1)
+        post = Post.objects.get(author__username='newcomer')
+        self.assertEqual(post.group.slug, 'new-group')
+        self.assertEqual(post.comments.get().author.username, 'commenter')
+
+    def test_import_replicates_signals(self):
+        """Загрузка обновляет счетчики, ленты, поиск и кеш страниц"""
+        generation, = get_generations(INDEX_SCOPE)
+        records = [{'author': 'author', 'group': 'group', 'created': '',
+                    'text': f'Imported_post_{i}', 'comments': []}
+                   for i in range(5)]
+        Importer(batch_size=2).run(records)
+        self.assertEqual(counters.reconcile(), 0)
+        self.assertEqual(counters.get(counters.POSTS), 8)
+        self.assertEqual(counters.get(counters.AUTHOR_POSTS,
+                                      TransferTests.author.id), 8)
+        self.assertEqual(FeedEntry.objects.filter(
+            user=TransferTests.follower,
+            post__text__startswith='Imported').count(), 5)
+        self.assertEqual(len(get_backend().search('Imported_post_3')), 1)
+        self.assertGreater(get_generations(INDEX_SCOPE)[0], generation)
+
+    @skipIfDBFeature('can_return_ids_from_bulk_insert')
+    def test_ids_assigned_under_write_lock(self):
+        """
+        Прежде чем читать MAX(id), загрузка берет блокировку записи
+        пустым UPDATE
+        """
+        with transaction.atomic(), CaptureQueriesContext(
+                connection) as queries:
+            Importer.assign_ids(Post, [Post()])
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(statements, ['UPDATE', 'SELECT'])
@@ -48,6 +48,9 @@ class PostURLTests(TestCase):
                 'username': self.author.username}): 'posts/profile.html',
             reverse('posts:post_detail', kwargs={
                 'post_id': PostURLTests.post.id}): 'posts/post_detail.html',
+            reverse('posts:post_comments', kwargs={
+                'post_id': PostURLTests.post.id}): (
+                'posts/includes/comments.html'),
             reverse('posts:post_edit', kwargs={
                 'post_id': PostURLTests.post.id}): 'posts/create_post.html',
             reverse('posts:post_create'): 'posts/create_post.html',
@@ -70,6 +73,8 @@ class PostURLTests(TestCase):
                                    kwargs={'post_id': PostURLTests.post.id}),
             'add_comment': reverse('posts:add_comment',
                                    kwargs={'post_id': PostURLTests.post.id}),
+            'post_comments': reverse('posts:post_comments',
+                                     kwargs={'post_id': PostURLTests.post.id}),
             'profile_follow': reverse('posts:profile_follow',
                                       kwargs={
                                           'username': self.author.username}),
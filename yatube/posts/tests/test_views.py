@@ -1,10 +1,14 @@
+from http import HTTPStatus
+
 from django import forms
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.test import Client, override_settings, TestCase
 from django.urls import reverse
 
-from posts.models import Comment, Follow, Group, Post
+from posts.benchmarks import seed_posts
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+from posts.paginators import CursorPage, encode_cursor
 
 User = get_user_model()
 
@@ -299,6 +303,43 @@ class CommentTests(TestCase):
         self.assertIn(new_comment, comment_on_page,
                       'Комментарий не отображается на странице post_detail')
 
+    @override_settings(COMMENTS_ON_PAGE=2)
+    def test_comments_loaded_by_portions(self):
+        """
+        На странице поста первая порция комментариев, остальные по курсору
+        приходят фрагментами с posts:post_comments без повторов и пропусков
+        """
+        for i in range(5):
+            Comment.objects.create(post=CommentTests.post,
+                                   author=CommentTests.user,
+                                   text=f'Comment_{i}')
+        expected = list(Comment.objects.filter(
+            post=CommentTests.post).order_by('-created', '-id'))
+        response = self.authorized_client.get(reverse(
+            'posts:post_detail', kwargs={'post_id': CommentTests.post.id}))
+        page = response.context['comments']
+        shown = list(page)
+        self.assertEqual(len(shown), 2)
+        fragment_url = reverse('posts:post_comments',
+                               kwargs={'post_id': CommentTests.post.id})
+        self.assertContains(
+            response, f'{fragment_url}?cursor={page.next_cursor}')
+        while page.has_next():
+            response = self.authorized_client.get(
+                fragment_url, {'cursor': page.next_cursor})
+            self.assertTemplateUsed(response, 'posts/includes/comments.html')
+            self.assertNotContains(response, '<html')
+            page = response.context['comments']
+            shown.extend(page)
+        self.assertEqual(shown, expected)
+        self.assertNotContains(response, 'data-fragment')
+
+    def test_comments_fragment_not_found(self):
+        """Фрагмент комментариев несуществующего поста - 404"""
+        response = self.authorized_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
 
 class FollowTests(TestCase):
     @classmethod
@@ -388,3 +429,329 @@ class FollowTests(TestCase):
         # follow_index пользователя, который не подписан на автора
         self.assertNotIn(post, posts_on_user_page,
                          'Пост отображается на странице follow_index')
+
+
+@override_settings(POSTS_PAGINATION='cursor')
+class PostsCursorPaginatorTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+        cls.group = Group.objects.create(
+            title='Group',
+            slug='group',
+            description='group_description',
+        )
+        number_of_posts = 13
+        post_list = []
+        for i in range(number_of_posts):
+            text = f'Post_number_{i} ' * 8
+            post_list.append(Post(author=cls.user,
+                                  group=cls.group,
+                                  text=text))
+        Post.objects.bulk_create(post_list)
+
+    def setUp(self):
+        # Создаем авторизованный клиент
+        self.authenticate_client = Client()
+        self.user = PostsCursorPaginatorTests.user
+        self.authenticate_client.force_login(self.user)
+        cache.clear()
+
+    def test_cursor_pages(self):
+        """
+        При пагинации по курсору страницы идут без пропусков и повторов,
+        курсор предыдущей страницы возвращает на первую страницу
+        """
+        page_names = {
+            'index': reverse('posts:index'),
+            'group_list': reverse('posts:group_list', kwargs={
+                'slug': PostsCursorPaginatorTests.group.slug}),
+            'profile': reverse('posts:profile', kwargs={
+                'username': self.user.username}),
+        }
+        expected = list(Post.objects.order_by('-created', '-id'))
+        for name, reverse_name in page_names.items():
+            with self.subTest(reverse_name=reverse_name):
+                first_page = self.authenticate_client.get(
+                    reverse_name).context['page_obj']
+                self.assertFalse(first_page.has_previous())
+                second_page = self.authenticate_client.get(
+                    reverse_name, {'cursor': first_page.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(first_page), expected[:10])
+                self.assertEqual(list(second_page), expected[10:])
+                self.assertFalse(second_page.has_next())
+                previous_page = self.authenticate_client.get(
+                    reverse_name, {'cursor': second_page.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(previous_page), expected[:10])
+                self.assertFalse(previous_page.has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Некорректный курсор возвращает первую страницу"""
+        response = self.authenticate_client.get(reverse('posts:index'),
+                                                {'cursor': 'broken'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_tampered_cursor_returns_first_page(self):
+        """
+        Курсор с подмененными значениями ключа не доходит до запроса к
+        базе, страница и API возвращают первую страницу
+        """
+        first_post = Post.objects.order_by('-created', '-id').first()
+        for values in (['garbage', 1], [{'a': 1}, 1], [None, None],
+                       ['2020-01-01T00:00:00', 'id']):
+            cursor = encode_cursor(CursorPage.NEXT, values)
+            with self.subTest(values=values):
+                response = self.authenticate_client.get(
+                    reverse('posts:index'), {'cursor': cursor})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.context['page_obj'][0],
+                                 first_post)
+                response = self.authenticate_client.get(
+                    reverse('api:index'), {'cursor': cursor})
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(response.json()['results'][0]['id'],
+                                 first_post.id)
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.old_post = Post.objects.create(author=cls.author,
+                                           text='Old_post_text')
+
+    def setUp(self):
+        # Создаем авторизованный клиент пользователя
+        self.authorized_client = Client()
+        self.authorized_client.force_login(FeedTests.user)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_feed(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return response.context['page_obj'][:]
+
+    def test_follow_backfills_and_unfollow_prunes_feed(self):
+        """
+        При подписке в ленту попадают прежние посты автора, при отписке
+        они из ленты удаляются
+        """
+        self.authorized_client.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': FeedTests.author.username}))
+        self.assertIn(FeedTests.old_post, self.get_feed())
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': FeedTests.author.username}))
+        self.assertEqual(self.get_feed(), [])
+        self.assertFalse(FeedEntry.objects.filter(
+            user=FeedTests.user).exists())
+
+    def test_new_post_fanned_out_to_followers(self):
+        """Новый пост автора записывается в ленты подписчиков"""
+        Follow.objects.create(user=FeedTests.user, author=FeedTests.author)
+        post = Post.objects.create(author=FeedTests.author,
+                                   text='New_post_text')
+        self.assertTrue(FeedEntry.objects.filter(
+            user=FeedTests.user, post=post).exists())
+        self.assertEqual(self.get_feed(), [post, FeedTests.old_post])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_posts_read_on_demand(self):
+        """
+        Посты автора с большим числом подписчиков не раскладываются по
+        лентам, но отображаются в ленте подписчика
+        """
+        Follow.objects.create(user=FeedTests.user, author=FeedTests.author)
+        cache.clear()
+        post = Post.objects.create(author=FeedTests.author,
+                                   text='New_post_text')
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+        self.assertEqual(self.get_feed(), [post, FeedTests.old_post])
+
+    def test_backfill_larger_than_insert_batch(self):
+        """Подписка на автора с сотнями постов заполняет ленту целиком"""
+        seed_posts(600, author=FeedTests.author)
+        Follow.objects.create(user=FeedTests.user, author=FeedTests.author)
+        self.assertEqual(
+            FeedEntry.objects.filter(user=FeedTests.user).count(), 601)
+
+
+class PostsQueryCountTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        authors = [User.objects.create_user(username=f'author_{i}',
+                                            first_name=f'Name_{i}')
+                   for i in range(3)]
+        groups = [Group.objects.create(title=f'Group_{i}', slug=f'group_{i}',
+                                       description='group_description')
+                  for i in range(3)]
+        for author in authors:
+            Follow.objects.create(user=cls.user, author=author)
+        # посты разных авторов и групп: запрос на каждый пост сразу
+        # изменил бы количество запросов к базе
+        for i in range(10):
+            Post.objects.create(author=authors[i % 3], group=groups[i % 3],
+                                text=f'Post_number_{i}')
+        cls.author = authors[0]
+        cls.group = groups[0]
+        cls.post = Post.objects.filter(author=cls.author).first()
+        for i in range(5):
+            Comment.objects.create(post=cls.post, author=authors[i % 3],
+                                   text=f'Comment_{i}')
+
+    def setUp(self):
+        # Создаем авторизованный клиент
+        self.authorized_client = Client()
+        self.authorized_client.force_login(PostsQueryCountTests.user)
+        cache.clear()
+
+    def test_listing_views_query_count(self):
+        """
+        Количество запросов к базе на страницах со списками не зависит от
+        количества постов и комментариев
+        """
+        # два запроса сессии и пользователя выполняются на каждой странице
+        # авторизованного клиента, еще 1-3 запроса по индексам вычисляют
+        # ETag и Last-Modified для условного GET
+        urls_queries = {
+            reverse('posts:index'): 5,
+            reverse('posts:group_list', kwargs={
+                'slug': PostsQueryCountTests.group.slug}): 7,
+            reverse('posts:profile', kwargs={
+                'username': PostsQueryCountTests.author.username}): 9,
+            reverse('posts:post_detail', kwargs={
+                'post_id': PostsQueryCountTests.post.id}): 7,
+            reverse('posts:follow_index'): 5,
+        }
+        for url, queries in urls_queries.items():
+            with self.subTest(url=url):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    self.authorized_client.get(url)
+
+
+class ListingCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Group',
+            slug='group',
+            description='group_description',
+        )
+        for i in range(13):
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Post_number_{i}')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def listing_urls(self):
+        return [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={
+                'slug': ListingCacheTests.group.slug}),
+            reverse('posts:profile', kwargs={
+                'username': ListingCacheTests.author.username}),
+        ]
+
+    def test_pages_cached_separately(self):
+        """Каждая страница списка кешируется отдельно"""
+        for url in self.listing_urls():
+            with self.subTest(url=url):
+                self.guest_client.get(url)
+                second_page = self.guest_client.get(url + '?page=2')
+                self.assertContains(second_page, 'Post_number_0')
+                self.assertNotContains(second_page, 'Post_number_12')
+
+    def test_new_post_invalidates_cached_pages(self):
+        """Новый пост сразу отображается на закешированных страницах"""
+        for url in self.listing_urls():
+            self.guest_client.get(url)
+        Post.objects.create(author=ListingCacheTests.author,
+                            group=ListingCacheTests.group,
+                            text='Fresh_post_text')
+        for url in self.listing_urls():
+            with self.subTest(url=url):
+                self.assertContains(self.guest_client.get(url),
+                                    'Fresh_post_text')
+
+    def test_edit_invalidates_previous_group_page(self):
+        """При переносе поста в другую группу сбрасывается кеш прежней"""
+        url = reverse('posts:group_list',
+                      kwargs={'slug': ListingCacheTests.group.slug})
+        self.assertContains(self.guest_client.get(url), 'Post_number_12')
+        post = Post.objects.get(text='Post_number_12')
+        post.group = Group.objects.create(title='Other', slug='other',
+                                          description='other_description')
+        post.save()
+        self.assertNotContains(self.guest_client.get(url), 'Post_number_12')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.post = Post.objects.create(author=cls.author, text='Test_text')
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ConditionalGetTests.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def revalidate(self, url):
+        etag = self.authorized_client.get(url)['ETag']
+        return self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_not_modified(self):
+        """Неизменившиеся страницы отдаются как 304 без рендеринга"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[ConditionalGetTests.author]),
+            reverse('posts:post_detail', args=[ConditionalGetTests.post.id]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.revalidate(url)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertFalse(response.templates)
+
+    def test_comment_changes_post_page(self):
+        """Новый комментарий меняет ETag страницы поста"""
+        url = reverse('posts:post_detail', args=[ConditionalGetTests.post.id])
+        etag = self.authorized_client.get(url)['ETag']
+        Comment.objects.create(post=ConditionalGetTests.post,
+                               author=ConditionalGetTests.user,
+                               text='Comment_text')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_follow_changes_profile_page(self):
+        """Подписка меняет ETag профиля автора"""
+        url = reverse('posts:profile', args=[ConditionalGetTests.author])
+        etag = self.authorized_client.get(url)['ETag']
+        Follow.objects.create(user=ConditionalGetTests.user,
+                              author=ConditionalGetTests.author)
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from core.tasks import task
+
+RENDITIONS_DIR = 'renditions'
+
+
+def parse_size(size):
+    width, height = size.split('x')
+    return int(width), int(height)
+
+
+def rendition_name(image_name, size):
+    base, _ = os.path.splitext(image_name)
+    return f'{RENDITIONS_DIR}/{size}/{base}.jpg'
+
+
+def render(media_root, image_name, sizes, force=False):
+    """
+    Нарезает уменьшенные копии изображения: кадрирование по центру с
+    увеличением маленьких картинок, как у {% thumbnail ... crop="center"
+    upscale=True %}. Имя изображения задается его содержимым, поэтому уже
+    нарезанные копии того же файла используются повторно; force=True
+    нарезает их заново. Функция работает только с файлами и Pillow, без
+    ORM, поэтому выполняется в отдельном процессе. Возвращает словарь
+    {размер: имя файла копии в хранилище}.
+    """
+
+    renditions = {size: rendition_name(image_name, size) for size in sizes}
+    missing = [size for size, name in renditions.items()
+               if force or not os.path.exists(os.path.join(media_root,
+                                                           name))]
+    if not missing:
+        return renditions
+    with Image.open(os.path.join(media_root, image_name)) as image:
+        image = image.convert('RGB')
+        for size in missing:
+            path = os.path.join(media_root, renditions[size])
+            save_atomically(ImageOps.fit(image, parse_size(size),
+                                         Image.LANCZOS), path)
+    return renditions
+
+
+def save_atomically(image, path):
+    """
+    Сохраняет копию во временный файл рядом и переименовывает его: копию
+    одного файла могут нарезать несколько процессов сразу, а читатели
+    видят либо прежний, либо полностью записанный файл
+    """
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                             prefix='.render-')
+    try:
+        with os.fdopen(descriptor, 'wb') as target:
+            image.save(target, 'JPEG', quality=85, optimize=True,
+                       progressive=True)
+        # mkstemp создает файл с правами 0600, а копии раздает веб-сервер
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def save_renditions(post_id, renditions):
+    """Сохраняет имена копий в посте и сбрасывает кеш страниц с ним"""
+
+    from core.cache import bump_generation
+    from posts.cache import post_scopes
+    from posts.models import Post
+
+    Post.objects.filter(pk=post_id).update(renditions=json.dumps(renditions))
+    post = Post.objects.filter(pk=post_id).values(
+        'author_id', 'group_id').first()
+    if post is not None:
+        bump_generation(*post_scopes(post['author_id'], post['group_id']))
+
+
+@task
+def make_renditions(post_id):
+    """
+    Фоновая задача: нарезает копии текущего изображения поста. Пост,
+    удаленный или оставшийся без изображения до выполнения, пропускается.
+    """
+
+    from posts.models import Post
+
+    image = Post.objects.filter(pk=post_id).values_list(
+        'image', flat=True).first()
+    if not image:
+        return
+    save_renditions(post_id, render(settings.MEDIA_ROOT, image,
+                                    settings.THUMBNAIL_RENDITIONS))
+
+
+def generate(post):
+    """
+    Ставит нарезку копий изображения поста в очередь фоновых задач,
+    ответ ее не ждет. Если у другого поста с тем же файлом все копии уже
+    есть, они сразу записываются и в этот пост.
+    """
+
+    from posts.models import Post
+
+    if not post.image:
+        return
+    ready = json.loads(Post.objects.filter(image=post.image.name).exclude(
+        pk=post.pk).exclude(renditions='').values_list(
+        'renditions', flat=True).first() or '{}')
+    if set(settings.THUMBNAIL_RENDITIONS) <= ready.keys():
+        save_renditions(post.id, ready)
+    else:
+        make_renditions.delay(post.id)
+
+
+def rendition_url(renditions, size):
+    name = json.loads(renditions or '{}').get(size)
+    if name is None:
+        return None
+    return default_storage.url(name)
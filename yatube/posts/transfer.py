@@ -0,0 +1,293 @@
+import csv
+import json
+import os
+import shutil
+from collections import Counter as Tally
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.cache import bump_generation
+from core.models import ExplicitCreatedQuerySet
+from posts import counters
+from posts.cache import INDEX_SCOPE, group_scope, profile_scope
+from posts.feed import fan_out_on_read_authors
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+from posts.search import get_backend
+from posts.storage import is_content_addressed
+
+User = get_user_model()
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = (NDJSON, CSV)
+# столбцы CSV: строка поста, за ней строки его комментариев со ссылкой
+# на пост в столбце post
+CSV_FIELDS = ('kind', 'id', 'post', 'author', 'group', 'created', 'text',
+              'image')
+
+
+def guess_format(path):
+    return CSV if path.endswith('.csv') else NDJSON
+
+
+def export_records(chunk_size=2000):
+    """
+    Посты вместе с комментариями в порядке id в виде словарей. Посты и
+    комментарии читаются двумя курсорами .iterator() и сливаются по id
+    поста, поэтому память не зависит от размера таблиц.
+    """
+
+    posts = Post.objects.order_by('id').values_list(
+        'id', 'author__username', 'group__slug', 'created', 'text',
+        'image').iterator(chunk_size=chunk_size)
+    # порядок совпадает с индексом (post, -created, -id)
+    comments = Comment.objects.order_by(
+        'post_id', '-created', '-id').values_list(
+        'post_id', 'author__username', 'created', 'text').iterator(
+        chunk_size=chunk_size)
+    comment = next(comments, None)
+    for post_id, author, group, created, text, image in posts:
+        post_comments = []
+        while comment is not None and comment[0] <= post_id:
+            if comment[0] == post_id:
+                post_comments.append({'author': comment[1],
+                                      'created': comment[2].isoformat(),
+                                      'text': comment[3]})
+            comment = next(comments, None)
+        yield {'id': post_id, 'author': author, 'group': group,
+               'created': created.isoformat(), 'text': text,
+               'image': image, 'comments': post_comments}
+
+
+def write_records(records, stream, fmt):
+    """Пишет записи в поток построчно. Возвращает число постов"""
+
+    written = 0
+    if fmt == CSV:
+        writer = csv.DictWriter(stream, CSV_FIELDS)
+        writer.writeheader()
+        for record in records:
+            comments = record.pop('comments')
+            writer.writerow(dict(record, kind='post', group=record['group']
+                                 or ''))
+            for comment in comments:
+                writer.writerow(dict(comment, kind='comment',
+                                     post=record['id']))
+            written += 1
+    else:
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False))
+            stream.write('\n')
+            written += 1
+    return written
+
+
+def read_records(stream, fmt):
+    """Читает из потока посты с комментариями по одному"""
+
+    if fmt == NDJSON:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+        return
+    record = None
+    for row in csv.DictReader(stream):
+        if row['kind'] == 'post':
+            if record is not None:
+                yield record
+            record = dict(row, comments=[])
+        elif record is not None and row['post'] == record['id']:
+            record['comments'].append(row)
+        else:
+            raise ValueError(f'Комментарий без поста: {row}')
+    if record is not None:
+        yield record
+
+
+class Importer:
+    """
+    Загружает посты с комментариями пачками через bulk_create. Авторы и
+    группы ищутся по имени и slug с кешем, отсутствующие создаются.
+    Сигналы при bulk_create не отправляются, поэтому ленты подписок,
+    счетчики, поисковый индекс и кеш страниц обновляются здесь же пачками.
+    Изображения копируются из media_source в MEDIA_ROOT в workers потоков.
+    """
+
+    def __init__(self, batch_size=5000, media_source=None, workers=1):
+        self.batch_size = batch_size
+        self.media_source = media_source
+        self.copier = None
+        if media_source is not None:
+            self.copier = ThreadPoolExecutor(max_workers=workers)
+        self.copies = []
+        self.users = {}
+        self.groups = {}
+        self.scopes = {INDEX_SCOPE}
+        self.stats = Tally()
+
+    def run(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.load(batch)
+                batch = []
+        if batch:
+            self.load(batch)
+        bump_generation(*self.scopes)
+        if self.copier is not None:
+            self.copier.shutdown(wait=True)
+            for copy in self.copies:
+                copy.result()
+        return self.stats
+
+    def resolve(self, cache, model, field, values, defaults):
+        """id объектов по значениям поля, отсутствующие создаются"""
+
+        missing = set(values) - cache.keys() - {None, ''}
+        if not missing:
+            return
+        cache.update(model.objects.filter(
+            **{f'{field}__in': missing}).values_list(field, 'id'))
+        missing -= cache.keys()
+        if missing:
+            model.objects.bulk_create(
+                [model(**{field: value}, **defaults(value))
+                 for value in missing])
+            cache.update(model.objects.filter(
+                **{f'{field}__in': missing}).values_list(field, 'id'))
+            self.stats[f'created_{model._meta.model_name}s'] += len(missing)
+
+    @staticmethod
+    def parse_created(value):
+        created = parse_datetime(value) if value else None
+        if created is None:
+            return timezone.now()
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
+        return created
+
+    def load(self, records):
+        self.resolve(
+            self.users, User, 'username',
+            [record['author'] for record in records]
+            + [comment['author'] for record in records
+               for comment in record['comments']],
+            lambda username: {'password': '!'})
+        self.resolve(
+            self.groups, Group, 'slug',
+            [record.get('group') for record in records],
+            lambda slug: {'title': slug, 'description': ''})
+        posts = [Post(author_id=self.users[record['author']],
+                      group_id=self.groups.get(record.get('group')),
+                      text=record['text'], image=record.get('image') or '',
+                      renditions='',
+                      created=self.parse_created(record.get('created')))
+                 for record in records]
+        with transaction.atomic():
+            self.assign_ids(Post, posts)
+            ExplicitCreatedQuerySet(Post).bulk_create(posts)
+            # комментарии выгружаются от новых к старым, id же растут
+            # со временем: вставка в обратном порядке сохраняет их порядок
+            comments = [
+                Comment(post_id=post.id, author_id=self.users[
+                    comment['author']], text=comment['text'],
+                    created=self.parse_created(comment.get('created')))
+                for post, record in zip(posts, records)
+                for comment in reversed(record['comments'])
+            ]
+            self.assign_ids(Comment, comments)
+            ExplicitCreatedQuerySet(Comment).bulk_create(comments)
+            self.fan_out(posts)
+            get_backend().index_many(
+                [(post.id, post.text) for post in posts],
+                [(comment.id, comment.text, comment.post_id)
+                 for comment in comments])
+            self.count(posts, comments)
+        if self.copier is not None:
+            # завершенные копирования больше не держим, ошибки - сразу
+            for copy in self.copies:
+                if copy.done():
+                    copy.result()
+            self.copies = [copy for copy in self.copies if not copy.done()]
+            self.copies.extend(
+                self.copier.submit(self.copy_image, post.image.name)
+                for post in posts if post.image)
+        self.stats['posts'] += len(posts)
+        self.stats['comments'] += len(comments)
+
+    @staticmethod
+    def assign_ids(model, objects):
+        """
+        На базах, где bulk_create не возвращает id (SQLite), id задаются
+        заранее: они нужны для комментариев, лент и индекса. Вызывается в
+        транзакции до вставки. Транзакция SQLite берет блокировку записи
+        только на первой записи, и чтение MAX(id) ее не берет: другой
+        процесс успел бы вставить строки с теми же id. Поэтому сначала
+        пустой UPDATE таблицы берет блокировку записи базы, и до конца
+        транзакции другие процессы в нее не пишут.
+        """
+
+        if connection.features.can_return_ids_from_bulk_insert:
+            return
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        column = quote(model._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET {column} = {column} WHERE 0 = 1')
+        last_id = model.objects.aggregate(last=Max('id'))['last'] or 0
+        for offset, obj in enumerate(objects, start=1):
+            obj.id = last_id + offset
+
+    def fan_out(self, posts):
+        """Раскладывает новые посты по лентам подписчиков авторов"""
+
+        fan_out_on_read = fan_out_on_read_authors()
+        by_author = {}
+        for post in posts:
+            if post.author_id not in fan_out_on_read:
+                by_author.setdefault(post.author_id, []).append(post)
+        follows = Follow.objects.filter(
+            author_id__in=by_author).values_list('user_id', 'author_id')
+        entries = []
+        for user_id, author_id in follows.iterator():
+            entries.extend(
+                FeedEntry(user_id=user_id, post_id=post.id,
+                          author_id=author_id, created=post.created)
+                for post in by_author[author_id])
+            if len(entries) >= self.batch_size:
+                FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+                entries = []
+        FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+    def count(self, posts, comments):
+        """Изменяет денормализованные счетчики и помечает области кеша"""
+
+        authors = Tally(post.author_id for post in posts)
+        groups = Tally(post.group_id for post in posts
+                       if post.group_id is not None)
+        counters.incr(counters.POSTS, delta=len(posts))
+        for kind, tally in ((counters.AUTHOR_POSTS, authors),
+                            (counters.GROUP_POSTS, groups),
+                            (counters.POST_COMMENTS,
+                             Tally(comment.post_id for comment in comments)),
+                            (counters.IMAGE_USES,
+                             Tally(post.image.name for post in posts
+                                   if is_content_addressed(
+                                       post.image.name)))):
+            counters.incr_many(kind, tally)
+        self.scopes.update(profile_scope(author_id) for author_id in authors)
+        self.scopes.update(group_scope(group_id) for group_id in groups)
+
+    def copy_image(self, name):
+        source = os.path.join(self.media_source, name)
+        target = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
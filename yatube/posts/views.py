@@ -1,91 +1,176 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
-
+from django.utils.http import urlencode
+
+from core.concurrency import gather
+from core.db import retry_on_locked
+from core.http import conditional
+from posts import counters, journal, thumbnails
+from posts.cache import (INDEX_SCOPE, author_posts_count, group_scope,
+                         listing_cache, profile_scope)
+from posts.conditional import (group_validators, index_validators,
+                               post_validators, profile_validators)
+from posts.feed import feed_count, feed_posts
 from posts.forms import CommentForm, PostForm
 from posts.models import Comment, Follow, Group, Post
+from posts.paginators import CountedPaginator, CursorPaginator
+from posts.search import get_backend
 from yatube.settings import POSTS_ON_PAGE
 
 User = get_user_model()
 
 
-def paginator(request, items, count=POSTS_ON_PAGE):
+def paginator(request, items, count=POSTS_ON_PAGE, mode=None, total=None):
     """
     Пагинатор количества элементов на странице.Функция принимает на вход
     request, кверисет и количество элементов на странице. Количество
     элементов на странице по умолчанию задается в настройках.
+    Режим mode='cursor' включает пагинацию по ключу (created, id) через
+    параметр ?cursor=, без COUNT(*) и OFFSET. Режим по умолчанию задается
+    настройкой POSTS_PAGINATION. Если общее количество элементов известно
+    из счетчика, оно передается в total, и пагинатор не выполняет COUNT(*).
     """
 
-    paginator = Paginator(items, count)
+    if (mode or settings.POSTS_PAGINATION) == 'cursor':
+        return CursorPaginator(items, count).get_page(
+            request.GET.get('cursor'))
+    paginator = CountedPaginator(items, count, total=total)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
 
 
+@conditional(index_validators, weak=True)
 def index(request):
     """Функция возвращает данные для главной страницы"""
 
     template = 'posts/index.html'
-    posts = Post.objects.all()
-    page_obj = paginator(request=request, items=posts)
+    posts = Post.objects.for_listing()
+    page_obj = paginator(request=request, items=posts,
+                         total=counters.get(counters.POSTS))
     context = {
         'page_obj': page_obj,
+        'listing_cache': listing_cache(request, INDEX_SCOPE),
     }
     return render(request=request, template_name=template, context=context)
 
 
+@conditional(group_validators, weak=True)
 def group_posts(request, slug):
     """Функция возвращает данные для страницы группы"""
 
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = paginator(request=request, items=posts)
+    posts = group.posts.for_listing()
+    page_obj = paginator(request=request, items=posts,
+                         total=counters.get(counters.GROUP_POSTS, group.id))
     context = {
         'page_obj': page_obj,
         'group': group,
+        'listing_cache': listing_cache(request, group_scope(group.id)),
     }
     return render(request=request, template_name=template, context=context)
 
 
+@conditional(profile_validators, weak=True)
 def profile(request, username):
     """Функция возвращает данные для страницы профиля пользователя"""
 
     template = 'posts/profile.html'
     author = get_object_or_404(User, username=username)
-    following = Follow.objects.filter(author=author).exists()
+    following, posts_count = gather(
+        lambda: Follow.objects.filter(author=author).exists(),
+        lambda: author_posts_count(author.id),
+    )
     is_author = author != request.user
-    posts = author.posts.all()
-    page_obj = paginator(request=request, items=posts)
+    posts = author.posts.for_listing()
+    page_obj = paginator(request=request, items=posts, total=posts_count)
     context = {
         'page_obj': page_obj,
         'author': author,
+        'posts_count': posts_count,
         'following': following,
         'is_author': is_author,
+        'listing_cache': listing_cache(request, profile_scope(author.id)),
     }
     return render(request=request, template_name=template, context=context)
 
 
+def comments_page(request, post_id):
+    """
+    Порция комментариев к посту, от новых к старым, с авторами в том же
+    запросе. Следующая порция выбирается по курсору ?cursor= от последнего
+    показанного комментария, поэтому ее стоимость не зависит от числа
+    комментариев выше.
+    """
+
+    comments = Comment.objects.filter(post=post_id).for_listing()
+    return CursorPaginator(comments, settings.COMMENTS_ON_PAGE).get_page(
+        request.GET.get('cursor'))
+
+
+@conditional(post_validators, weak=True)
 def post_detail(request, post_id):
     """Функция возвращает данные страницы детальной информации о публикации"""
 
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, id=post_id)
+    comments = comments_page(request, post_id)
+    post, _ = gather(
+        lambda: get_object_or_404(Post.objects.for_listing(), id=post_id),
+        lambda: comments.object_list,
+    )
     form = CommentForm(request.POST or None)
-    count = post.author.posts.count()
+    count = author_posts_count(post.author_id)
     is_author = post.author == request.user
-    comments = Comment.objects.filter(post=post_id)
     context = {
         'post': post,
         'count': count,
         'is_author': is_author,
         'comments': comments,
+        'pending_comments': (
+            [] if request.GET.get('cursor')
+            else journal.pending_comments(request.user, post_id)),
         'form': form,
     }
     return render(request=request, template_name=template, context=context)
 
 
+@conditional(post_validators, per_user=False)
+def post_comments(request, post_id):
+    """
+    Функция возвращает HTML-фрагмент со следующей порцией комментариев
+    к посту для кнопки «Показать еще». Фрагмент одинаков для всех
+    пользователей; несуществующий пост отсекает post_validators.
+    """
+
+    template = 'posts/includes/comments.html'
+    context = {
+        'comments': comments_page(request, post_id),
+        'post_id': post_id,
+    }
+    return render(request=request, template_name=template, context=context)
+
+
+def search(request):
+    """
+    Функция возвращает страницу полнотекстового поиска по постам и
+    комментариям, результаты упорядочены по релевантности
+    """
+
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    results = get_backend().search(query) if query else []
+    page_obj = paginator(request=request, items=results, mode='page')
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        'pagination_query': urlencode({'q': query}) + '&',
+    }
+    return render(request=request, template_name=template, context=context)
+
+
 @login_required
 def post_create(request):
     """Функция создает новую запись поста"""
@@ -95,7 +180,8 @@ def post_create(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        retry_on_locked(post.save)()
+        thumbnails.generate(post)
         return redirect('posts:profile', request.user)
     context = {'form': form}
     return render(request=request, template_name=template, context=context)
@@ -112,7 +198,9 @@ def post_edit(request, post_id=None):
     form = PostForm(request.POST or None, files=request.FILES or None,
                     instance=post)
     if form.is_valid():
-        form.save()
+        post = retry_on_locked(form.save)()
+        if 'image' in form.changed_data:
+            thumbnails.generate(post)
         return redirect('posts:post_detail', post_id)
     context = {'form': form, 'is_edit': True, 'post': post}
     return render(request=request, template_name=template, context=context)
@@ -120,15 +208,20 @@ def post_edit(request, post_id=None):
 
 @login_required
 def add_comment(request, post_id):
-    """Функция добавления комментария к посту"""
+    """
+    Функция добавления комментария к посту. При COMMENTS_WRITE_BEHIND
+    комментарий уходит в журнал и переносится в базу позже пачкой
+    """
 
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
-    if form.is_valid():
+    if form.is_valid() and settings.COMMENTS_WRITE_BEHIND:
+        journal.submit(post.id, request.user, form.cleaned_data['text'])
+    elif form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        retry_on_locked(comment.save)()
     return redirect('posts:post_detail', post_id=post_id)
 
 
@@ -140,10 +233,9 @@ def follow_index(request):
     """
 
     template = 'posts/follow.html'
-    following_authors = Follow.objects.filter(user=request.user).values_list(
-        'author_id', flat=True)
-    posts = Post.objects.filter(author_id__in=list(following_authors))
-    page_obj = paginator(request=request, items=posts)
+    posts = feed_posts(request.user).for_listing()
+    page_obj = paginator(request=request, items=posts,
+                         total=feed_count(request.user))
     context = {
         'page_obj': page_obj,
     }
@@ -166,5 +258,5 @@ def profile_unfollow(request, username):
 
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.filter(author=author).delete()
+        Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:profile', author)
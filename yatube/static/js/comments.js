@@ -0,0 +1,23 @@
+// Кнопка «Показать еще» под комментариями: следующая порция загружается
+// фрагментом и встает на место кнопки. При ошибке - обычный переход.
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('a[data-fragment]');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    link.classList.add('disabled');
+    fetch(link.dataset.fragment, {credentials: 'same-origin'})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            link.parentNode.outerHTML = html;
+        })
+        .catch(function () {
+            window.location.href = link.href;
+        });
+});
@@ -1,6 +1,9 @@
+from django.contrib.auth import forms as auth_forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
 
+from core.mail import send_password_reset
+
 User = get_user_model()
 
 
@@ -8,3 +11,20 @@ class CreationForm(UserCreationForm):
     class Meta:
         model = User
         fields = ('first_name', 'last_name', 'username', 'email')
+
+
+class PasswordResetForm(auth_forms.PasswordResetForm):
+    """
+    Письмо со ссылкой сброса пароля отправляет фоновая задача: ответ не
+    ждет почтовый сервер. В задачу передается только id пользователя,
+    ссылку с токеном задача создает сама. Поддерживается только
+    default_token_generator.
+    """
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        send_password_reset.delay(
+            context['user'].pk, context['domain'], context['site_name'],
+            context['protocol'], subject_template_name, email_template_name,
+            from_email, html_email_template_name)
@@ -5,6 +5,7 @@ from django.contrib.auth.views import (LoginView, LogoutView,
                                        PasswordResetView)
 from django.urls import path
 
+from users.forms import PasswordResetForm
 from users.views import SignUp
 
 app_name = 'users'
@@ -16,7 +17,8 @@ urlpatterns = [
     path('login/', LoginView.as_view(template_name='users/login.html'),
          name='login'),
     path('password_reset/', PasswordResetView.as_view(
-        template_name='users/password_reset_form.html'),
+        template_name='users/password_reset_form.html',
+        form_class=PasswordResetForm),
         name='password_reset_form'),
     path('password_change/', PasswordChangeView.as_view(
         template_name='users/password_change_form.html'),
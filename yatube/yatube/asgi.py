@@ -0,0 +1,22 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Django 2.2 has no ASGI handler of its own, so requests
+are run by the WSGI handler in a thread pool (core.asgi.ASGIHandler).
+
+Run with any ASGI server, for example::
+
+    uvicorn yatube.asgi:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+from core.asgi import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+application = ASGIHandler(get_wsgi_application(),
+                          workers=int(os.getenv('ASGI_WORKERS', 32)))
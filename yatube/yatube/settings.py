@@ -1,6 +1,10 @@
 import os
+import sys
 from dotenv import load_dotenv
 
+from core.cache_backends import cache_config
+from core.db import database_config, replica_aliases
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -33,9 +37,11 @@ INSTALLED_APPS = [
     'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
+    'api.apps.ApiConfig',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -43,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -50,7 +57,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.metrics.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -71,12 +78,37 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+# Основная база и реплики задаются переменными окружения, см.
+# core.db.database_config. По умолчанию - SQLite в db.sqlite3
+DATABASES = database_config(BASE_DIR)
+REPLICA_DATABASES = replica_aliases(DATABASES)
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+# страницы, которые читают данные с реплик
+REPLICA_READ_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+)
+# после записи пользователь читает основную базу столько секунд
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_COOKIE = 'pin_primary'
+# PRAGMA, которые выполняются для каждого нового соединения с SQLite.
+# Отрицательный cache_size задается в КиБ
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024)),
+    'temp_store': 'MEMORY',
 }
+# повторы записи при «database is locked», пауза удваивается
+DB_RETRY_ATTEMPTS = 5
+DB_RETRY_DELAY = 0.05
+# потоков для одновременных независимых запросов страниц
+# (core.concurrency.gather), 0 - запросы выполняются по очереди
+CONCURRENT_QUERIES = int(os.getenv('CONCURRENT_QUERIES', 4))
 
 
 # Password validation
@@ -121,6 +153,35 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# изображения постов хранятся одной копией на содержимое (posts.storage);
+# файл, который больше не использует ни один пост, удаляется через
+# столько секунд
+MEDIA_RELEASE_DELAY = int(os.getenv('MEDIA_RELEASE_DELAY', 3600))
+
+# загружаемые файлы сразу пишутся во временный файл на диске, а не в память
+FILE_UPLOAD_HANDLERS = (
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+)
+
+# обработка загружаемых изображений постов (posts.images): ограничения
+# проверяются по заголовку до декодирования, затем изображение
+# пересжимается без метаданных
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE',
+                                      20 * 1024 * 1024))
+# наибольшее тело запроса под ASGI (core.asgi): изображение и поля формы
+REQUEST_MAX_BODY_SIZE = IMAGE_UPLOAD_MAX_SIZE + 1024 * 1024
+IMAGE_UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 50 * 1000 * 1000))
+# большая сторона сохраненного изображения
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', 2048))
+# JPEG или WEBP (нужен Pillow, собранный с libwebp)
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+
+# размеры копий изображения поста, которые нарезаются при сохранении
+THUMBNAIL_RENDITIONS = ('960x339',)
+# копия для страниц со списками постов и страницы поста
+THUMBNAIL_LISTING_SIZE = '960x339'
 
 
 LOGIN_URL = 'users:login'
@@ -133,11 +194,102 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 # настройка пагинации
 POSTS_ON_PAGE = 10
+# комментариев на странице поста и в каждой порции «показать еще»
+COMMENTS_ON_PAGE = int(os.getenv('COMMENTS_ON_PAGE', 20))
+# отложенная запись комментариев, см. posts.journal: комментарий сразу
+# попадает в локальный журнал SQLite, а в базу переносится пачками до
+# COMMENTS_FLUSH_BATCH штук фоновым потоком раз в COMMENTS_FLUSH_INTERVAL
+# секунд (0 - только командой flush_comments)
+COMMENTS_WRITE_BEHIND = os.getenv('COMMENTS_WRITE_BEHIND', '0') == '1'
+COMMENTS_JOURNAL_PATH = os.getenv('COMMENTS_JOURNAL_PATH', os.path.join(
+    BASE_DIR, 'comments_journal.sqlite3'))
+COMMENTS_FLUSH_BATCH = 500
+COMMENTS_FLUSH_INTERVAL = float(os.getenv('COMMENTS_FLUSH_INTERVAL', 1))
+# режим пагинации списков постов: 'page' - по номеру страницы,
+# 'cursor' - по ключу (created, id), не зависит от глубины страницы
+POSTS_PAGINATION = os.getenv('POSTS_PAGINATION', 'page')
+
+# настройка ленты подписок
+# авторы с большим числом подписчиков не раскладываются по лентам при
+# публикации, их посты подмешиваются в ленту при чтении
+FEED_FANOUT_MAX_FOLLOWERS = 5000
+# время кеширования списка таких авторов, секунды
+FEED_FANOUT_AUTHORS_TIMEOUT = 5 * 60
+# сколько последних постов автора попадает в ленту при подписке
+FEED_BACKFILL_SIZE = 1000
+FEED_FANOUT_BATCH_SIZE = 1000
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+# замер запросов: Server-Timing, лог core.metrics и перцентили по URL
+METRICS_ENABLED = True
+# заголовок Server-Timing раскрывает устройство страниц, поэтому он
+# включается явно и отдается только сотрудникам
+METRICS_SERVER_TIMING = os.getenv('METRICS_SERVER_TIMING', '0') == '1'
+# сколько последних запросов каждого URL учитывать в перцентилях
+METRICS_WINDOW = 1000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.metrics': {
+            'handlers': ['console'],
+            # при запуске тестов лог запросов не выводится
+            'level': os.getenv('METRICS_LOG_LEVEL', 'WARNING'
+                               if sys.argv[1:2] == ['test'] else 'INFO'),
+            'propagate': False,
+        },
+        'core.tasks': {
+            'handlers': ['console'],
+            'level': os.getenv('TASKS_LOG_LEVEL', 'CRITICAL'
+                               if sys.argv[1:2] == ['test'] else 'INFO'),
+            'propagate': False,
+        },
+    },
 }
+
+# общий кеш и локальный кеш процесса перед ним, см.
+# core.cache_backends.cache_config. По умолчанию - LocMemCache процесса
+CACHES = cache_config()
+
+# поисковый бэкенд по постам и комментариям. None - FTS5 на SQLite,
+# поиск подстрокой на остальных базах
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND')
+# сколько самых релевантных совпадений попадает в выдачу поиска
+SEARCH_MAX_RESULTS = 1000
+
+# время жизни закешированных фрагментов со списками постов, секунды.
+# Фрагменты сбрасываются сигналами при записи, поэтому время может быть
+# большим
+LISTING_CACHE_TIMEOUT = 60 * 60
+
+# защита от одновременного пересчета кеша, см. core.cache.get_or_compute:
+# сколько секунд держится блокировка пересчета, как часто ждущий запрос
+# проверяет готовность значения, сколько секунд после истечения отдается
+# устаревшее значение и насколько рано оно пересчитывается
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_POLL_INTERVAL = 0.05
+CACHE_STALE_TIMEOUT = 60
+CACHE_EARLY_REFRESH_BETA = 1.0
+
+# фоновые задачи, см. core.tasks. Задачи выполняет команда run_tasks;
+# TASKS_EAGER=1 - выполнять сразу в запросе, без воркера
+TASKS_EAGER = os.getenv('TASKS_EAGER', '0') == '1'
+TASKS_MAX_ATTEMPTS = 5
+# пауза перед повтором упавшей задачи, секунды: удваивается с каждой
+# попыткой, но не больше TASKS_RETRY_MAX_DELAY
+TASKS_RETRY_DELAY = 10
+TASKS_RETRY_MAX_DELAY = 60 * 60
+# сколько секунд задача принадлежит захватившему ее воркеру, после этого
+# задачу упавшего воркера выполнит другой
+TASKS_LEASE = 5 * 60
+# как часто воркер проверяет пустую очередь, секунды
+TASKS_POLL_INTERVAL = 1
+# сколько секунд хранятся выполненные задачи и по скольким последним
+# считаются перцентили ожидания и выполнения
+TASKS_KEEP_DONE = 24 * 60 * 60
+TASKS_METRICS_WINDOW = 1000
@@ -7,6 +7,8 @@ urlpatterns = [
     path('auth/', include('users.urls', namespace='users')),
     path('', include('posts.urls', namespace='posts')),
     path('about/', include('about.urls', namespace='about')),
+    path('api/v1/', include('api.urls', namespace='api')),
+    path('', include('core.urls', namespace='core')),
     path('admin/', admin.site.urls),
     path('auth/', include('django.contrib.auth.urls')),
 ]